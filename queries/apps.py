@@ -1,5 +1,36 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
+from django.db.models import CharField, IntegerField
+from django.db.models.functions import Reverse
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 
 
 class QueriesConfig(AppConfig):
     name = 'queries'
+
+    def ready(self):
+        from django.contrib.auth.models import Group, User
+        from . import bulk, cache, prepared, stats
+
+        for model in (User, Group):
+            post_save.connect(cache.user_or_group_saved, sender=model, dispatch_uid=f'queries-cache-{model.__name__}')
+            post_delete.connect(cache.user_or_group_deleted, sender=model, dispatch_uid=f'queries-cache-{model.__name__}')
+        m2m_changed.connect(cache.memberships_changed, sender=User.groups.through, dispatch_uid='queries-cache-groups')
+
+        post_save.connect(stats.user_saved, sender=User, dispatch_uid='queries-stats-User')
+        post_save.connect(stats.group_saved, sender=Group, dispatch_uid='queries-stats-Group')
+        for model in (User, Group):
+            pre_delete.connect(stats.user_or_group_pre_delete, sender=model,
+                               dispatch_uid=f'queries-stats-{model.__name__}')
+            post_delete.connect(stats.user_or_group_deleted, sender=model, dispatch_uid=f'queries-stats-{model.__name__}')
+        m2m_changed.connect(stats.memberships_changed, sender=User.groups.through, dispatch_uid='queries-stats-groups')
+
+        connection_created.connect(prepared.connection_created, dispatch_uid='queries-prepared')
+
+        checks.register(cache.check_versions_cache, checks.Tags.caches)
+
+        # name__reverse__startswith, served by the reverse(name) indexes (see name_search.py)
+        CharField.register_lookup(Reverse)
+        # id__any=[...], one array parameter instead of id__in's one parameter per id (see bulk.py)
+        IntegerField.register_lookup(bulk.Any)
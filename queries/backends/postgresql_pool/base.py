@@ -0,0 +1,94 @@
+"""
+PostgreSQL backend that takes its connections from a process-wide pool.
+
+    DATABASES['default'] = {
+        'ENGINE': 'queries.backends.postgresql_pool',
+        ...
+        'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 20, 'MAX_IDLE': 300, 'TIMEOUT': 30, 'CHECK_AFTER': 30,
+                 'RESET': 'DISCARD ALL', 'MAINTENANCE_INTERVAL': 10},
+    }
+
+Django still opens a connection per thread and closes it at the end of each request (or after CONN_MAX_AGE), but
+opening checks a connection out of the pool and closing returns it, so requests under WSGI or ASGI worker threads
+don't pay for a new postgres connection. Returned connections are reset with `RESET`, so a request never sees the
+prepared statements, temporary tables or settings of the previous one (`None` keeps them). There is one pool per set
+of connection parameters (the test database gets its own). The pools of a database are closed before the test
+runner drops it or clones it (see creation.py), and the connections django opens to the `postgres` database for
+those statements don't go through a pool.
+"""
+import threading
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from .creation import DatabaseCreation
+from .pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _connect(conn_params, options):
+    connection = base.Database.connect(**conn_params)
+    if 'isolation_level' in options and options['isolation_level'] != connection.isolation_level:
+        connection.set_session(isolation_level=options['isolation_level'])
+    return connection
+
+
+def get_pool(conn_params, options, pool_settings):
+    key = repr(sorted(conn_params.items()))
+    with _pools_lock:
+        if key not in _pools:
+            label = f'{conn_params.get("host", "")}:{conn_params.get("port", "")}/{conn_params.get("database", "")}'
+            _pools[key] = label, conn_params.get('database'), ConnectionPool(
+                lambda: _connect(conn_params, options),
+                min_size=pool_settings.get('MIN_SIZE', 1),
+                max_size=pool_settings.get('MAX_SIZE', 10),
+                max_idle=pool_settings.get('MAX_IDLE', 300),
+                timeout=pool_settings.get('TIMEOUT', 30),
+                check_after=pool_settings.get('CHECK_AFTER', 30),
+                reset=pool_settings.get('RESET', 'DISCARD ALL'),
+                maintenance_interval=pool_settings.get('MAINTENANCE_INTERVAL', 10),
+            )
+        return _pools[key][-1]
+
+
+def close_pools(database=None):
+    """
+    close the pools of this process, or those connected to `database` (at exit, or before dropping a database);
+    later connections get new pools
+    """
+    with _pools_lock:
+        keys = [key for key, (_, pooled_database, _) in _pools.items() if database in (None, pooled_database)]
+        pools = [_pools.pop(key)[-1] for key in keys]
+    for pool in pools:
+        pool.closeall()
+
+
+def pool_stats():
+    """ stats of every pool of this process, by host:port/database """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {label: pool.stats() for label, _, pool in pools}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    _pool = None
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            # short-lived, to create and drop databases: a pool would keep it open
+            return super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        self._pool = get_pool(conn_params, options, self.settings_dict.get('POOL', {}))
+        connection = self._pool.getconn()
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self._pool is None:
+            return super()._close()
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._pool.putconn(self.connection)
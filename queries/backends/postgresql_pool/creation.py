@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import creation
+
+from . import base
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    # postgres refuses to drop a database, or to copy it as a template, while connections to it are open: those the
+    # pools keep (MIN_SIZE of them, in the background) are closed first
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        base.close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        base.close_pools(self.connection.settings_dict['NAME'])
+        super()._clone_test_db(suffix, verbosity, keepdb)
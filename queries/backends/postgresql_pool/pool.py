@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class PoolClosed(psycopg2.OperationalError):
+    pass
+
+
+def _maintain(pool_ref, interval, stopped):
+    # a weak reference: the thread doesn't keep a pool nobody uses alive
+    while True:
+        pool = pool_ref()
+        if pool is None:
+            return
+        pool.maintain()
+        del pool
+        if stopped.wait(interval):
+            return
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    - at most `max_size` connections are open; getconn() waits up to `timeout` seconds for one to be returned
+    - every `maintenance_interval` seconds, a background thread closes the connections idle for more than `max_idle`
+      seconds and opens new ones, so that at least `min_size` are open (from the start, and after failures)
+    - on check-in, the session state the user left is dropped with `reset` (`DISCARD ALL`: prepared statements,
+      temporary tables, SET, advisory locks...), so every checkout gets a connection as good as new
+    - on checkout, a connection is discarded if it is closed or left in a transaction, and pinged with `SELECT 1` if
+      it has been idle for more than `check_after` seconds (the server may have dropped it meanwhile)
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, max_idle=300, timeout=30, check_after=30,
+                 reset='DISCARD ALL', maintenance_interval=10):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError(f'invalid pool size: min {min_size}, max {max_size}')
+        self._connect = connect
+        self.min_size, self.max_size = min_size, max_size
+        self.max_idle, self.timeout, self.check_after = max_idle, timeout, check_after
+        self.reset = reset
+
+        self._idle = deque()  # (connection, returned at), most recently returned last
+        self._size = 0  # idle + checked out
+        self._condition = threading.Condition()
+        self._stats = dict.fromkeys(
+            ['created', 'closed', 'checkouts', 'waits', 'timeouts', 'failed_checks', 'reaped'], 0
+        )
+        self._wait_time = 0.0
+        self._closed = threading.Event()
+        if maintenance_interval:
+            threading.Thread(
+                target=_maintain, args=(weakref.ref(self), maintenance_interval, self._closed),
+                name='queries-pool-maintenance', daemon=True,
+            ).start()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection, idle_since = self._checkout(deadline)
+            if connection is None:
+                return self._create()
+            if self._is_healthy(connection, idle_since):
+                return connection
+            self._discard(connection, 'failed_checks')
+
+    def putconn(self, connection):
+        if not connection.closed and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+        if (connection.closed or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+                or not self._reset(connection) or not self._add_idle(connection)):
+            self._discard(connection, 'closed')
+
+    def closeall(self):
+        """ close the idle connections and stop the pool: the others are closed when they are returned """
+        self._closed.set()
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._discard(connection, 'closed')
+
+    def maintain(self):
+        """ close the connections idle for too long and open new ones up to `min_size` (see the class docstring) """
+        with self._condition:
+            if self._closed.is_set():
+                return
+            self._reap_locked()
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing  # reserved for the new connections
+        for _ in range(missing):
+            try:
+                connection = self._create()
+            except Exception as e:  # the server is unavailable: retried at the next round
+                logger.warning('could not open a pooled connection: %s', e)
+                continue
+            if not self._add_idle(connection):
+                self._discard(connection, 'closed')
+
+    def stats(self):
+        with self._condition:
+            return {
+                **self._stats,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'wait_time_ms': self._wait_time * 1000,
+            }
+
+    def _checkout(self, deadline):
+        """ (idle connection, idle since) or (None, None) if the caller may open a new one """
+        with self._condition:
+            if self._closed.is_set():
+                raise PoolClosed('the pool is closed')
+            self._reap_locked()
+            waited = None
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'no connection available after {self.timeout}s (max_size {self.max_size})')
+                if waited is None:
+                    waited = time.monotonic()
+                    self._stats['waits'] += 1
+                self._condition.wait(remaining)
+            if waited is not None:
+                self._wait_time += time.monotonic() - waited
+            self._stats['checkouts'] += 1
+            if self._idle:
+                return self._idle.pop()  # the most recently used one: its server process is warm
+            self._size += 1  # reserved for the new connection
+            return None, None
+
+    def _create(self):
+        try:
+            connection = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats['created'] += 1
+        return connection
+
+    def _add_idle(self, connection):
+        """ False if the pool is closed: the caller discards the connection """
+        with self._condition:
+            if self._closed.is_set():
+                return False
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+            return True
+
+    def _reset(self, connection):
+        if not self.reset:
+            return True
+        try:
+            autocommit = connection.autocommit
+            connection.autocommit = True  # DISCARD ALL can't run in a transaction
+            with connection.cursor() as cursor:
+                cursor.execute(self.reset)
+            connection.autocommit = autocommit
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _is_healthy(self, connection, idle_since):
+        if connection.closed or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.check_after:
+            return True
+        try:
+            autocommit = connection.autocommit
+            connection.autocommit = True  # don't leave the ping's transaction open
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.autocommit = autocommit
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reap_locked(self):
+        now = time.monotonic()
+        # the oldest returned connections are at the left
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+            connection, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats['reaped'] += 1
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def _discard(self, connection, reason):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._size -= 1
+            self._stats[reason] += 1
+            self._condition.notify()
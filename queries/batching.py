@@ -0,0 +1,121 @@
+"""
+Single-object lookups fetched in one round trip.
+
+`qs[0]`, `get()`, `first()`, `last()`, `earliest()` and `latest()` each send a statement and wait for its answer, so
+a view doing six of them pays six network round trips. `SingleObjectBatch` records the lookups instead, builds the
+statement each one would send, and runs all of them as a single
+
+    SELECT 0 AS "batch_index", * FROM (<statement 0>) "batch_0"
+    UNION ALL
+    SELECT 1 AS "batch_index", * FROM (<statement 1>) "batch_1"
+    ...
+
+The discriminator column tells which lookup every row answers. `fetch()` then applies the rules of the original
+method to its rows (`get()` raises DoesNotExist or MultipleObjectsReturned, `first()` returns None...) and returns
+model instances along with the statement the lookup would have sent on its own.
+"""
+from django.db import connections
+from django.db.models.query import MAX_GET_RESULTS
+
+from .execution import CompiledQuery
+
+
+class SingleObjectBatch:
+
+    def __init__(self):
+        self._lookups = []  # (name, kind, queryset)
+
+    def limit(self, name, queryset, index):
+        """ queryset[index] """
+        self._lookups.append((name, 'limit', queryset[index:index + 1]))
+
+    def get(self, name, queryset, *args, **kwargs):
+        # as QuerySet.get(): unordered, fetching enough rows to tell there is more than one
+        clone = queryset.filter(*args, **kwargs)
+        if queryset.query.can_filter() and not queryset.query.distinct_fields:
+            clone = clone.order_by()
+        self._lookups.append((name, 'get', clone[:MAX_GET_RESULTS]))
+
+    def first(self, name, queryset):
+        queryset = queryset if queryset.ordered else queryset.order_by('pk')
+        self._lookups.append((name, 'first', queryset[:1]))
+
+    def last(self, name, queryset):
+        queryset = queryset.reverse() if queryset.ordered else queryset.order_by('-pk')
+        self._lookups.append((name, 'last', queryset[:1]))
+
+    def earliest(self, name, queryset, *fields):
+        self._lookups.append((name, 'earliest', self._ordered_by(queryset, fields)[:1]))
+
+    def latest(self, name, queryset, *fields):
+        self._lookups.append((name, 'latest', self._ordered_by(queryset, fields).reverse()[:1]))
+
+    @staticmethod
+    def _ordered_by(queryset, fields):
+        fields = fields or [queryset.model._meta.get_latest_by]
+        if not fields[0]:
+            raise ValueError('earliest() and latest() require either fields or Meta.get_latest_by')
+        return queryset.order_by(*fields)
+
+    def fetch(self):
+        """ {name: (model instance or None, sql)} in the order the lookups were added """
+        compiled_queries = [CompiledQuery(queryset) for _, _, queryset in self._lookups]
+        rows = _execute([(index, compiled) for index, compiled in enumerate(compiled_queries) if compiled.sql])
+
+        results = {}
+        for index, ((name, kind, queryset), compiled) in enumerate(zip(self._lookups, compiled_queries)):
+            instances = _instances(compiled, rows.get(index, []))
+            results[name] = _single(kind, queryset.model, instances), compiled.display()
+        return results
+
+
+def _columns(compiled):
+    return [(col.alias, col.target) for col, _, _ in compiled.compiler.select]
+
+
+def _execute(indexed_queries):
+    """ {index: [rows]} from one UNION ALL of the (index, compiled query) pairs """
+    if not indexed_queries:
+        return {}
+    _, first = indexed_queries[0]
+    for _, compiled in indexed_queries:
+        if compiled.db != first.db or _columns(compiled) != _columns(first):
+            raise ValueError('batched querysets must select the same columns from the same database')
+        if compiled.compiler.klass_info is None or compiled.compiler.annotation_col_map:
+            raise ValueError('batched querysets must select model instances')
+
+    parts, params = [], []
+    for index, compiled in indexed_queries:
+        parts.append(f'SELECT {index} AS "batch_index", * FROM ({compiled.sql}) "batch_{index}"')
+        params.extend(compiled.params)
+    rows = {}
+    with connections[first.db].cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(parts), params)
+        for row in cursor.fetchall():
+            rows.setdefault(row[0], []).append(row[1:])
+    return rows
+
+
+def _instances(compiled, rows):
+    # as ModelIterable does, on rows fetched by the batch
+    compiler = compiled.compiler
+    select_fields = compiler.klass_info['select_fields']
+    start, end = select_fields[0], select_fields[-1] + 1
+    init_list = [column[0].target.attname for column in compiler.select[start:end]]
+    model = compiler.klass_info['model']
+    return [
+        model.from_db(compiled.db, init_list, row[start:end])
+        for row in compiler.results_iter([rows])
+    ]
+
+
+def _single(kind, model, instances):
+    if len(instances) > 1:
+        raise model.MultipleObjectsReturned(f'get() returned more than one {model._meta.object_name}')
+    if instances:
+        return instances[0]
+    if kind == 'limit':
+        raise IndexError('list index out of range')
+    if kind in ('get', 'earliest', 'latest'):
+        raise model.DoesNotExist(f'{model._meta.object_name} matching query does not exist.')
+    return None  # first(), last()
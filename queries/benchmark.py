@@ -0,0 +1,35 @@
+"""
+Small timing helpers shared by the bench_* management commands
+"""
+import time
+
+
+def measure(func, repeat=5, warmup=1):
+    """ call func() warmup + repeat times and return the duration in seconds of the last `repeat` calls """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    """ nearest-rank percentile (pct in 0..100) of a non-empty list of numbers """
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """ min/p50/p99/max/mean of a list of durations, in milliseconds """
+    return {
+        'count': len(samples),
+        'min_ms': min(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'mean_ms': sum(samples) / len(samples) * 1000,
+    }
@@ -0,0 +1,59 @@
+"""
+Lookups by large lists of ids.
+
+`in_bulk(ids)` and `filter(pk__in=ids)` put one placeholder per id in the statement: with tens of thousands of ids
+the SQL grows with the list, postgres parses and plans a different statement for every list length, and backends with
+a parameter limit (sqlite) need the list split. The `__any` lookup sends the whole list as one array literal instead,
+`"id" = ANY('{1,4,7}'::integer[])`, the same statement whatever the number of ids (and preparable, see prepared.py).
+`iter_bulk()` queries `QUERIES_BULK_CHUNK_SIZE` ids at a time, so huge lists are read and sent a chunk at a time.
+"""
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Lookup
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class Any(Lookup):
+    """ integer_field__any=[...], registered on IntegerField in QueriesConfig.ready() """
+    lookup_name = 'any'
+
+    def get_prep_lookup(self):
+        # int() every id: they end up in an array literal, not in separate parameters
+        return [self.lhs.output_field.get_prep_value(value) for value in self.rhs]
+
+    def as_sql(self, compiler, connection):
+        # backends without arrays
+        if not self.rhs:
+            raise EmptyResultSet
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        return f'{lhs} IN ({", ".join(["%s"] * len(self.rhs))})', [*lhs_params, *self.rhs]
+
+    def as_postgresql(self, compiler, connection):
+        if not self.rhs:
+            raise EmptyResultSet
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        array_type = self.lhs.output_field.rel_db_type(connection)  # integer for an AutoField, not serial
+        return f'{lhs} = ANY(%s::{array_type}[])', [*lhs_params, '{' + ','.join(map(str, self.rhs)) + '}']
+
+
+def chunks(ids, chunk_size=None):
+    """ the distinct ids, sorted (neighbouring ids share index pages), in lists of at most `chunk_size` """
+    chunk_size = chunk_size or getattr(settings, 'QUERIES_BULK_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    ids = sorted(set(ids))
+    return [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+
+
+def iter_bulk(queryset, ids, chunk_size=None):
+    """ yield the rows (instances or dicts) of `queryset` whose pk is in `ids`, querying a chunk of ids at a time """
+    for chunk in chunks(ids, chunk_size):
+        yield from queryset.filter(pk__any=chunk)
+
+
+def in_bulk_array(queryset, ids, chunk_size=None):
+    """ like `queryset.in_bulk(ids)`: {pk: row}, with the ids sent as array parameters """
+    pk_name = queryset.model._meta.pk.attname
+    return {
+        row[pk_name] if isinstance(row, dict) else row.pk: row
+        for row in iter_bulk(queryset, ids, chunk_size)
+    }
@@ -0,0 +1,168 @@
+"""
+Cross-request cache of query results.
+
+Results are stored in the django cache named by `QUERIES_RESULT_CACHE_ALIAS` (see CACHES in settings.py), so the
+backend is pluggable: LocMemCache evicts the least recently used entries past MAX_ENTRIES, FileBasedCache shares
+entries between processes, and both expire them after TIMEOUT seconds. The version tokens below are in the cache
+named by `QUERIES_RESULT_CACHE_VERSIONS_ALIAS` (the results cache by default), which must be shared by every process
+serving requests: a token replaced in the local memory of one worker leaves the others serving stale rows until their
+entries expire. The `queries.W001` system check warns about a local memory cache there.
+
+Entries are keyed by the compiled SQL and params plus a version token of every table the query reads. Saving or
+deleting a User or Group, or changing User.groups, replaces the version token of the affected table (see
+`table_changed`), which makes every entry that depends on it unreachable at once; the token is replaced again when
+the transaction commits, and the writing transaction caches nothing from the tables it wrote. Writes that don't send
+signals (`QuerySet.update()`, `bulk_create()`, raw SQL) are only picked up when entries expire.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# tables whose changes we are told about through signals; queries reading any other table are not cached
+WATCHED_TABLES = ('auth_user', 'auth_group', 'auth_user_groups')
+
+_counters = {'hits': 0, 'misses': 0}
+_counters_lock = threading.Lock()
+_MISSING = object()
+
+
+def is_enabled():
+    return getattr(settings, 'QUERIES_RESULT_CACHE', False)
+
+
+def _cache():
+    return caches[getattr(settings, 'QUERIES_RESULT_CACHE_ALIAS', 'queries')]
+
+
+def _versions_alias():
+    return getattr(settings, 'QUERIES_RESULT_CACHE_VERSIONS_ALIAS', None) or getattr(
+        settings, 'QUERIES_RESULT_CACHE_ALIAS', 'queries'
+    )
+
+
+def _versions_cache():
+    return caches[_versions_alias()]
+
+
+def _version_key(table):
+    return f'queries:table-version:{table}'
+
+
+def table_versions(tables):
+    """ current version token of each table """
+    cache = _versions_cache()
+    keys = {_version_key(table): table for table in tables}
+    versions = cache.get_many(keys)
+    for key in set(keys) - set(versions):
+        # a fresh token rather than 0: if the version was evicted, entries built on an older token must stay stale
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def _new_version(table):
+    _versions_cache().set(_version_key(table), uuid.uuid4().hex, timeout=None)
+
+
+class _NewVersionOnCommit:
+    """ on_commit() callback of table_changed() """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __call__(self):
+        _new_version(self.table)
+
+
+def _uncommitted_tables(connection):
+    """ tables written by the transaction open on `connection` """
+    # the callbacks still waiting for the commit: django drops them when their transaction or savepoint rolls back
+    return {callback[1].table for callback in connection.run_on_commit if isinstance(callback[1], _NewVersionOnCommit)}
+
+
+def table_changed(table, using=DEFAULT_DB_ALIAS):
+    """
+    Replace the version token of `table` now, and again once the transaction writing to it commits: entries cached
+    in between by other requests hold the rows from before the commit. Until then, the writing transaction doesn't
+    cache what it reads from `table`, which may never be committed
+    """
+    _new_version(table)
+    if connections[using].in_atomic_block:
+        transaction.on_commit(_NewVersionOnCommit(table), using=using)
+
+
+def dependencies(queryset, sql):
+    """ watched tables read by `queryset`, None if it reads a table we can't invalidate or uncommitted rows """
+    tables = {join.table_name for join in queryset.query.alias_map.values()}
+    if not tables.issubset(WATCHED_TABLES):
+        return None
+    # scanning the SQL also finds the tables of subqueries
+    tables = sorted(table for table in WATCHED_TABLES if f'"{table}"' in sql)
+    if not _uncommitted_tables(connections[queryset.db]).isdisjoint(tables):
+        return None
+    return tables
+
+
+def entry_key(sql_key, tables):
+    versions = table_versions(tables)
+    raw = repr((sql_key, sorted(versions.items())))
+    return 'queries:result:' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def lookup(key):
+    """ cached rows for `key`, None on a miss """
+    rows = _cache().get(key, _MISSING)
+    with _counters_lock:
+        _counters['misses' if rows is _MISSING else 'hits'] += 1
+    return None if rows is _MISSING else rows
+
+
+def store(key, rows):
+    _cache().set(key, rows)
+
+
+def stats():
+    with _counters_lock:
+        hits, misses = _counters['hits'], _counters['misses']
+    return {
+        'enabled': is_enabled(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+    }
+
+
+# system check, registered in QueriesConfig.ready()
+
+def check_versions_cache(app_configs, **kwargs):
+    if not is_enabled() or not isinstance(_versions_cache(), LocMemCache):
+        return []
+    return [checks.Warning(
+        f'the version tokens of the result cache are in the local memory cache {_versions_alias()!r}',
+        hint='Invalidations only reach the process that saw the write: set QUERIES_RESULT_CACHE_VERSIONS_ALIAS to a '
+             'cache shared by every process (file based, redis, memcached).',
+        id='queries.W001',
+    )]
+
+
+# signal receivers, connected in QueriesConfig.ready()
+
+def user_or_group_saved(sender, instance, using, **kwargs):
+    table_changed(sender._meta.db_table, using)
+
+
+def user_or_group_deleted(sender, instance, using, **kwargs):
+    table_changed(sender._meta.db_table, using)
+    # memberships of the deleted row are removed by the database cascade, which sends no m2m_changed
+    table_changed('auth_user_groups', using)
+
+
+def memberships_changed(sender, instance, action, using, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        table_changed(sender._meta.db_table, using)
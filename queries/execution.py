@@ -0,0 +1,213 @@
+"""
+Evaluation of the querysets that make up a response.
+
+Views hand a list of `(name, queryset)` pairs to `evaluate()`, which returns the `{name: {data, query}}` payload.
+The querysets of a view are independent from each other, so when `QUERIES_PARALLEL_WORKERS` is greater than 1 they
+are evaluated concurrently by a shared thread pool and the response waits for the slowest query instead of the sum
+of all of them.
+
+Querysets that compile to the same SQL and parameters (`and_operation` builds the same query four different ways)
+are only sent to the database once per response when `QUERIES_DEDUPLICATE` is on, and with `QUERIES_RESULT_CACHE`
+results are reused across requests until the tables they read change (see cache.py).
+
+Every queryset is compiled once: the same SQL and params are the deduplication and cache key and are what gets
+executed, and the `query` shown in the response is the statement as the database cursor received it, rather than
+`str(qs.query)`, which compiles the query again and quotes parameters its own way. Streamed responses read the
+rows with `CompiledQuery.iterator()`, from the same compiled statement.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import close_old_connections, connections
+from django.db.models.query import FlatValuesListIterable, ValuesIterable, ValuesListIterable
+
+from . import cache, metrics, prepared
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.QUERIES_PARALLEL_WORKERS, thread_name_prefix='queries-execution'
+            )
+        return _executor
+
+
+class CompiledQuery:
+    """ a queryset compiled once, to be executed, displayed and compared with other querysets """
+
+    def __init__(self, queryset):
+        # the database router answers every `queryset.db` anew (in turn, with replicas): compile, key and run it on
+        # the same database
+        self.db = queryset.db
+        self.queryset = queryset.using(self.db)
+        self.compiler = self.queryset.query.get_compiler(using=self.db)
+        try:
+            self.sql, self.params = self.compiler.as_sql()
+        except EmptyResultSet:
+            # can't match any row, e.g. filter(pk__in=[]): nothing is sent to the database
+            self.sql, self.params = None, ()
+
+    @property
+    def key(self):
+        """ what the database receives, None if nothing is sent """
+        if self.sql is None:
+            return None
+        return self.db, self.sql, repr(tuple(self.params))
+
+    @property
+    def builds_rows(self):
+        """ whether the rows are built from the results of the compiled statement, rather than by the queryset """
+        iterable_class = self.queryset._iterable_class
+        if iterable_class is ValuesListIterable:
+            # values_list() moves the columns of extra() and annotations after the fields: let it do that
+            query = self.queryset.query
+            return not query.extra_select and not query.annotation_select
+        return issubclass(iterable_class, (FlatValuesListIterable, ValuesIterable))
+
+    def _rows(self, results):
+        """ the rows of the queryset, from `results`, an iterable of lists of rows of the statement """
+        rows = self.compiler.results_iter(results)
+        iterable_class = self.queryset._iterable_class
+        if issubclass(iterable_class, FlatValuesListIterable):
+            return (row[0] for row in rows)
+        if iterable_class is ValuesListIterable:
+            return (tuple(row) for row in rows)
+        # same as ValuesIterable, but reusing our compiler instead of compiling the query again
+        query = self.queryset.query
+        names = [*query.extra_select, *query.values_select, *query.annotation_select]
+        return (dict(zip(names, row)) for row in rows)
+
+    def fetch(self):
+        """ (rows, executed sql) """
+        if self.sql is None:
+            return [], None
+        if not self.builds_rows:
+            # model instances: let the queryset build them
+            return list(self.queryset), str(self.queryset.query)
+
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            if prepared.is_enabled(connection):
+                executed = prepared.execute(connection, cursor, self.sql, self.params)
+            else:
+                cursor.execute(self.sql, self.params)
+                executed = connection.ops.last_executed_query(cursor, self.sql, self.params)
+            results = [cursor.fetchall()]
+        return list(self._rows(results)), executed
+
+    def iterator(self, chunk_size):
+        """ the rows, fetched `chunk_size` at a time, from a server-side cursor where the database has them """
+        if self.sql is None:
+            return
+        if not self.builds_rows:
+            yield from self.queryset.iterator(chunk_size=chunk_size)
+            return
+        connection = connections[self.db]
+        # as QuerySet.iterator(), without compiling the statement again
+        chunked = not connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS')
+        with (connection.chunked_cursor() if chunked else connection.cursor()) as cursor:
+            cursor.execute(self.sql, self.params)
+            yield from self._rows(iter(lambda: cursor.fetchmany(chunk_size), []))
+
+    def display(self):
+        """ the statement the database would receive, without running it """
+        if self.sql is None:
+            return None
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                return cursor.mogrify(self.sql, self.params).decode()  # what psycopg2 sends
+            return connection.ops.last_executed_query(cursor, self.sql, self.params)
+
+
+def display_sql(queryset):
+    return CompiledQuery(queryset).display()
+
+
+def _fetch_in_worker(context, compiled):
+    # runs in the context of the request, so its queries are accounted for in its metrics
+    return context.run(_fetch_on_worker_connection, compiled)
+
+
+def _fetch_on_worker_connection(compiled):
+    # django connections are thread-local, so every worker runs its queries on its own connection; like a request,
+    # it honours CONN_MAX_AGE (set it to keep worker connections open between requests)
+    close_old_connections()
+    try:
+        with metrics.instrument(connections[compiled.db]):
+            return compiled.fetch()
+    finally:
+        close_old_connections()
+
+
+def _can_run_in_parallel(compiled_queries):
+    if getattr(settings, 'QUERIES_PARALLEL_WORKERS', 0) <= 1 or len(compiled_queries) <= 1:
+        return False
+    # worker connections can't see the uncommitted changes of an open transaction (ATOMIC_REQUESTS, tests...)
+    return not any(connections[compiled.db].in_atomic_block for compiled in compiled_queries)
+
+
+def evaluate(querysets):
+    """
+    Evaluate `querysets`, a list of (name, queryset) pairs.
+
+    Returns ({name: {'data': rows, 'query': sql}}, stats) where stats counts the database round trips saved by
+    deduplication and by the result cache
+    """
+    deduplicate = getattr(settings, 'QUERIES_DEDUPLICATE', True)
+    caching = cache.is_enabled()
+    compiled_queries = [CompiledQuery(qs) for _, qs in querysets]
+
+    # querysets that compile to the same statement are evaluated once and share their rows
+    unique, positions = [], []
+    first_seen = {}
+    for compiled in compiled_queries:
+        key = compiled.key
+        if deduplicate and key is not None and key in first_seen:
+            positions.append(first_seen[key])
+            continue
+        if key is not None:
+            first_seen[key] = len(unique)
+        positions.append(len(unique))
+        unique.append(compiled)
+
+    results = [None] * len(unique)
+    cache_keys = {}
+    if caching:
+        for i, compiled in enumerate(unique):
+            tables = cache.dependencies(compiled.queryset, compiled.sql) if compiled.key else None
+            if tables is not None:
+                cache_keys[i] = cache.entry_key(compiled.key, tables)
+                results[i] = cache.lookup(cache_keys[i])
+    pending = [i for i in range(len(unique)) if results[i] is None]
+
+    pending_queries = [unique[i] for i in pending]
+    if _can_run_in_parallel(pending_queries):
+        contexts = [contextvars.copy_context() for _ in pending_queries]
+        fetched = list(_get_executor().map(_fetch_in_worker, contexts, pending_queries))
+    else:
+        fetched = [compiled.fetch() for compiled in pending_queries]
+    for i, result in zip(pending, fetched):
+        results[i] = result
+        if i in cache_keys:
+            cache.store(cache_keys[i], result)
+
+    payload = {}
+    for (name, _), position in zip(querysets, positions):
+        rows, executed_sql = results[position]
+        payload[name] = {
+            'data': rows,
+            'query': executed_sql,
+        }
+    return payload, {
+        'deduplicated': len(querysets) - len(unique),
+        'cache_hits': len(unique) - len(pending),
+    }
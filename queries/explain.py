@@ -0,0 +1,137 @@
+"""
+Execution plans of the querysets of a response.
+
+With `?explain=1`, staff users get every statement of a view run again as `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`,
+and an `explain` entry next to its `data` and `query` (a list, when the entry took several statements): the plan tree,
+planning and execution time, the shared and temp buffers the statement went through, and the sequential scans of
+tables with at least `QUERIES_EXPLAIN_SEQ_SCAN_ROWS` rows (as estimated by the last ANALYZE). Those scans are also
+logged as warnings, so requests replayed from production point at the views missing an index.
+
+ANALYZE executes the statement: explained responses run every query twice.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import connections
+
+from .execution import CompiledQuery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEQ_SCAN_ROWS = 10000
+
+_BUFFERS = {
+    'shared_hit': 'Shared Hit Blocks',
+    'shared_read': 'Shared Read Blocks',
+    'shared_dirtied': 'Shared Dirtied Blocks',
+    'shared_written': 'Shared Written Blocks',
+    'temp_read': 'Temp Read Blocks',
+    'temp_written': 'Temp Written Blocks',
+}
+
+# estimated rows of the tables named as in the plans (resolved through the search_path)
+_TABLE_ROWS = """
+    SELECT name, (SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(name))
+    FROM unnest(%s::text[]) name
+"""
+
+
+def is_requested(request):
+    return bool(request.GET.get('explain'))
+
+
+def is_allowed(request):
+    return request.user.is_staff
+
+
+def is_supported(aliases):
+    """ whether the databases of `aliases` can explain their statements """
+    return all(connections[alias].vendor == 'postgresql' for alias in aliases)
+
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _nodes(child)
+
+
+def _table_rows(connection, tables):
+    with connection.cursor() as cursor:
+        cursor.execute(_TABLE_ROWS, [sorted(tables)])
+        return dict(cursor.fetchall())
+
+
+def analyze(queryset):
+    """ {plan, planning_ms, execution_ms, buffers, seq_scans} of `queryset`, None if it sends nothing """
+    compiled = CompiledQuery(queryset)
+    if compiled.sql is None:
+        return None
+    return analyze_sql(compiled.db, compiled.sql, compiled.params)
+
+
+def analyze_sql(using, sql, params=None):
+    """ analyze() of a statement run on `using`: `sql` with `params`, or complete, as psycopg2 sent it """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+        result = cursor.fetchone()[0]
+    # psycopg2 decodes the json column, other drivers may not
+    explained = (json.loads(result) if isinstance(result, str) else result)[0]
+    plan = explained['Plan']
+
+    scans = [node for node in _nodes(plan) if node['Node Type'] == 'Seq Scan']
+    table_rows = _table_rows(connection, {node['Relation Name'] for node in scans}) if scans else {}
+    threshold = getattr(settings, 'QUERIES_EXPLAIN_SEQ_SCAN_ROWS', DEFAULT_SEQ_SCAN_ROWS)
+    seq_scans = [
+        {
+            'table': node['Relation Name'],
+            'table_rows': table_rows.get(node['Relation Name']),
+            'rows': node.get('Actual Rows'),
+            'filter': node.get('Filter'),
+        }
+        for node in scans
+        if (table_rows.get(node['Relation Name']) or 0) >= threshold
+    ]
+    return {
+        'plan': plan,
+        'planning_ms': explained.get('Planning Time'),
+        'execution_ms': explained.get('Execution Time'),
+        'buffers': {key: plan.get(name, 0) for key, name in _BUFFERS.items()},
+        'seq_scans': seq_scans,
+    }
+
+
+def _log_seq_scans(route, name, explained):
+    for scan in explained['seq_scans'] if explained else []:
+        logger.warning(
+            'sequential scan of %s (%s rows) in %s %s, filter: %s',
+            scan['table'], scan['table_rows'], route, name, scan['filter'],
+        )
+
+
+def attach(route, querysets, payload):
+    """ add the `explain` entry of every (name, queryset) to its {data, query} in `payload` """
+    for name, queryset in querysets:
+        payload[name]['explain'] = explained = analyze(queryset)
+        _log_seq_scans(route, name, explained)
+    return payload
+
+
+def attach_statements(route, using, statements, payload):
+    """
+    add the `explain` entry of every (name, statement) to its {data, query} in `payload`, for views that capture
+    the statements they ran on `using` rather than build querysets. A list of statements gets a list of plans
+    """
+    plans = {}  # statements shared by several names are run once
+
+    def plan(sql):
+        if sql not in plans:
+            plans[sql] = analyze_sql(using, sql)
+        return plans[sql]
+
+    for name, sql in statements:
+        payload[name]['explain'] = explained = [plan(each) for each in sql] if isinstance(sql, list) else plan(sql)
+        for each in explained if isinstance(explained, list) else [explained]:
+            _log_seq_scans(route, name, each)
+    return payload
@@ -0,0 +1,138 @@
+"""
+CSV dumps of users and memberships with postgres COPY.
+
+`values()` and `JsonResponse` build a dict per row and encode it in Python; `COPY (<query>) TO STDOUT (FORMAT csv)`
+has postgres produce the CSV itself, and psycopg2 hands it over as it arrives. `copy_to()` writes a dump to a file,
+`iter_copy()` yields it in chunks of about `QUERIES_EXPORT_CHUNK_SIZE` bytes for a streaming response: COPY pushes
+data into a file-like object, so it runs in a thread that fills a queue of at most `QUERIES_EXPORT_QUEUE_CHUNKS`
+chunks, which bounds memory whatever the size of the table. Like the parallel querysets of execution.py, that thread
+uses its own connection and only sees committed data. Under ASGI, django 3.0 would read those chunks in the event
+loop, stalling the other requests of the worker while COPY runs: the export view refuses them (see streaming.py).
+
+The queries are built by the ORM (`DATASETS`), so the dumps hold the same rows as `first` and `joins`; the password
+hashes are left out.
+"""
+import queue
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import F
+
+from .execution import CompiledQuery
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_QUEUE_CHUNKS = 8
+
+USER_COLUMNS = [
+    'id', 'username', 'first_name', 'last_name', 'email', 'is_staff', 'is_active', 'is_superuser', 'last_login',
+    'date_joined',
+]
+
+DATASETS = {
+    'users': lambda: User.objects.values(*USER_COLUMNS),
+    # a row per membership, and one with an empty group_name per user without groups, as /queries/joins
+    'memberships': lambda: User.objects.values(
+        'id', 'username', 'first_name', 'last_name', group_id=F('groups__id'), group_name=F('groups__name'),
+    ),
+}
+
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """ the consumer of iter_copy() went away """
+
+
+def is_supported(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def copy_sql(queryset):
+    """ the COPY statement dumping `queryset` as CSV with a header line """
+    # COPY takes no parameters: inline them as psycopg2 would send them
+    return f'COPY ({CompiledQuery(queryset).display()}) TO STDOUT (FORMAT csv, HEADER)'
+
+
+def copy_to(queryset, file):
+    """ write the CSV of `queryset` to a binary `file`, returns the number of rows """
+    with connections[queryset.db].cursor() as cursor:
+        cursor.copy_expert(copy_sql(queryset), file)
+        return cursor.rowcount
+
+
+class _QueueWriter:
+    """ the file COPY writes to: gathers its rows into chunks and hands them to the consumer """
+
+    def __init__(self, chunks, cancelled, chunk_size):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise ExportCancelled
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+def _produce(sql, using, writer):
+    try:
+        with connections[using].cursor() as cursor:
+            cursor.copy_expert(sql, writer)
+        writer.flush()
+        writer.put(_DONE)
+    except ExportCancelled:
+        pass
+    except Exception as e:
+        try:
+            writer.put(e)
+        except ExportCancelled:
+            pass
+    finally:
+        # an interrupted COPY leaves the connection unusable, and this thread won't serve requests
+        connections[using].close()
+
+
+def iter_copy(queryset, chunk_size=None, queue_chunks=None):
+    """ iterator over the CSV of `queryset` in chunks of bytes, see the module docstring """
+    chunk_size = chunk_size or getattr(settings, 'QUERIES_EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    queue_chunks = queue_chunks or getattr(settings, 'QUERIES_EXPORT_QUEUE_CHUNKS', DEFAULT_QUEUE_CHUNKS)
+    # built now, where the database router knows the request, rather than when the response is consumed
+    return _consume(copy_sql(queryset), queryset.db, chunk_size, queue_chunks)
+
+
+def _consume(sql, using, chunk_size, queue_chunks):
+    chunks = queue.Queue(maxsize=queue_chunks)
+    cancelled = threading.Event()
+    writer = _QueueWriter(chunks, cancelled, chunk_size)
+    producer = threading.Thread(target=_produce, args=(sql, using, writer), name='queries-export', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # stops the producer at its next chunk if the response was not read to the end
+        cancelled.set()
+        producer.join()
@@ -0,0 +1,35 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from queries.benchmark import measure, summarize
+from queries.bulk import in_bulk_array
+
+
+class Command(BaseCommand):
+    help = 'Compare in_bulk() with in_bulk_array() (ids as chunked array parameters) for long lists of ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', type=int, nargs='+', default=[10000, 100000], help='numbers of ids looked up')
+        parser.add_argument('--chunk-size', type=int, help='ids per query of in_bulk_array (default: settings)')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, ids, chunk_size, repeat, seed, **options):
+        bounds = User.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        self.stdout.write(f'{User.objects.count()} users, ids between {bounds["low"]} and {bounds["high"]}')
+        self.stdout.write(
+            f'{"ids":>8} {"found":>8} {"in_bulk p50 ms":>15} {"in_bulk_array p50 ms":>21} {"speedup":>8}'
+        )
+        rng = random.Random(seed)
+        for count in ids:
+            id_list = [rng.randint(bounds['low'] or 1, bounds['high'] or 1) for _ in range(count)]
+            found = len(in_bulk_array(User.objects.all(), id_list, chunk_size))
+            plain = summarize(measure(lambda: User.objects.in_bulk(id_list), repeat))
+            array = summarize(measure(lambda: in_bulk_array(User.objects.all(), id_list, chunk_size), repeat))
+            self.stdout.write(
+                f'{count:>8} {found:>8} {plain["p50_ms"]:>15.1f} {array["p50_ms"]:>21.1f} '
+                f'{plain["p50_ms"] / array["p50_ms"]:>7.1f}x'
+            )
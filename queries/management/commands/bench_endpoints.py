@@ -0,0 +1,175 @@
+import json
+import resource
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from queries import urls
+from queries.benchmark import summarize
+
+# introspection routes, not queries
+EXCLUDED_ROUTES = {'metrics', 'cache_stats', 'profiles', 'profiles/<str:profile_id>'}
+# query string sent to routes that need one
+ROUTE_PARAMS = {
+    'search': {'field': 'first_name', 'match': 'endswith', 'q': 'ohn'},
+    'bulk_lookup': {'ids': ','.join(str(i) for i in range(1, 1001))},
+    'export': {'data': 'memberships'},
+}
+
+
+def benchmarked_routes():
+    return [
+        str(pattern.pattern) for pattern in urls.urlpatterns
+        if str(pattern.pattern) not in EXCLUDED_ROUTES
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every route of queries/urls.py: throughput, p50/p99 latency, queries per request and, in-process, '
+        'peak RSS. Results are written as JSON and can be compared with a previous run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='timed requests per route')
+        parser.add_argument('--warmup', type=int, default=3, help='untimed requests per route')
+        parser.add_argument('--routes', nargs='+', help='only these routes (default: all)')
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            help='run once per dataset size, topping up users with generate_data before each run')
+        parser.add_argument('--server', help='base url of a running server, e.g. http://localhost:7777 '
+                                             '(default: in-process through the django test client)')
+        parser.add_argument('--output', help='write results to this JSON file')
+        parser.add_argument('--baseline', help='JSON file of a previous run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='fail if p50 or p99 latency grows by more than this fraction over the baseline')
+
+    def handle(self, *args, **options):
+        routes = options['routes'] or benchmarked_routes()
+        runs = {}
+        for size in options['sizes'] or [None]:
+            if size is not None:
+                call_command('generate_data', users=size, stdout=self.stdout)
+            users = User.objects.count()
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{users} users'))
+            runs[str(users)] = {route: self._bench_route(route, options) for route in routes}
+
+        report = {
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'server': options['server'] or 'in-process',
+            'requests': options['requests'],
+            'runs': runs,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'results written to {options["output"]}')
+        if options['baseline']:
+            self._compare(report, options['baseline'], options['threshold'])
+
+    def _bench_route(self, route, options):
+        path = f'/queries/{route}'
+        params = ROUTE_PARAMS.get(route, {})
+        get = self._server_get(options['server']) if options['server'] else self._client_get()
+
+        rss_before = self._peak_rss_kb()
+        for _ in range(options['warmup']):
+            get(path, params)
+        latencies, queries, sizes = [], [], []
+        start = time.perf_counter()
+        for _ in range(options['requests']):
+            request_start = time.perf_counter()
+            status, headers, body = get(path, params)
+            latencies.append(time.perf_counter() - request_start)
+            if status != 200:
+                raise CommandError(f'{path} returned {status}')
+            sizes.append(len(body))
+            if 'X-Queries-Count' in headers:  # set by QueryMetricsMiddleware
+                queries.append(int(headers['X-Queries-Count']))
+        elapsed = time.perf_counter() - start
+        # the memory of the process serving the requests: unknown for a server
+        peak_rss = None if options['server'] else self._peak_rss_kb()
+
+        stats = summarize(latencies)
+        result = {
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': stats['p50_ms'],
+            'p99_ms': stats['p99_ms'],
+            'mean_ms': stats['mean_ms'],
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+            'response_bytes': sum(sizes) / len(sizes),
+            # high-water mark of the process, so it only grows from one route to the next: the growth is what the
+            # route needed on top of the previous ones
+            'peak_rss_kb': peak_rss,
+            'peak_rss_growth_kb': None if peak_rss is None else peak_rss - rss_before,
+        }
+        self.stdout.write(
+            f'{route or "(index)":>15} {result["throughput_rps"]:>9.1f} req/s  p50 {result["p50_ms"]:>8.2f} ms  '
+            f'p99 {result["p99_ms"]:>8.2f} ms  {result["queries_per_request"]} queries'
+            + (f'  {peak_rss} KB rss (+{result["peak_rss_growth_kb"]})' if peak_rss is not None else '')
+        )
+        return result
+
+    @staticmethod
+    def _peak_rss_kb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @staticmethod
+    def _client_get():
+        client = Client(HTTP_HOST='localhost')
+
+        def get(path, params):
+            response = client.get(path, params)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            return response.status_code, response, body
+
+        return get
+
+    @staticmethod
+    def _server_get(base_url):
+        def get(path, params):
+            url = base_url.rstrip('/') + path
+            if params:
+                url += '?' + urllib.parse.urlencode(params)
+            try:
+                with urllib.request.urlopen(url) as response:
+                    return response.status, response.headers, response.read()
+            except urllib.error.HTTPError as e:  # an error status: reported as such by the caller
+                return e.code, e.headers, e.read()
+            except urllib.error.URLError as e:
+                raise CommandError(f'{url}: {e.reason}')
+
+        return get
+
+    def _compare(self, report, baseline_file, threshold):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for size, routes in report['runs'].items():
+            for route, result in routes.items():
+                before = baseline['runs'].get(size, {}).get(route)
+                if before is None:
+                    continue
+                for metric in ('p50_ms', 'p99_ms'):
+                    if result[metric] > before[metric] * (1 + threshold):
+                        regressions.append(
+                            f'{size} users, {route}: {metric} {before[metric]:.2f} -> {result[metric]:.2f}'
+                        )
+                if (result['queries_per_request'] or 0) > (before['queries_per_request'] or 0):
+                    regressions.append(
+                        f'{size} users, {route}: queries per request '
+                        f'{before["queries_per_request"]} -> {result["queries_per_request"]}'
+                    )
+
+        if regressions:
+            raise CommandError('regressions over the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'no regressions over {baseline_file} (threshold {threshold:.0%})'))
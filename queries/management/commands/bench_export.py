@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from queries import export
+from queries.benchmark import measure, summarize
+
+
+class _Discard(io.RawIOBase):
+    """ a binary file that counts what it is given """
+
+    def __init__(self):
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time dumping users or memberships through values() and JSON, values() and the csv module, and postgres '
+        'COPY, written to a file or streamed through the queue of /queries/export (postgres only)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data', choices=list(export.DATASETS), default='memberships')
+        parser.add_argument('--repeat', type=int, default=3, help='timed runs per method')
+
+    def handle(self, *args, data, repeat, **options):
+        queryset = export.DATASETS[data]()
+        if not export.is_supported(queryset):
+            raise CommandError('COPY needs postgres')
+
+        def to_json():
+            return len(json.dumps(list(queryset.all().iterator()), cls=DjangoJSONEncoder))
+
+        def to_csv():
+            out = io.StringIO()
+            csv.writer(out).writerows(row.values() for row in queryset.all().iterator())
+            return len(out.getvalue())
+
+        def copy_to_file():
+            discard = _Discard()
+            export.copy_to(queryset, discard)
+            return discard.size
+
+        def copy_streamed():
+            return sum(len(chunk) for chunk in export.iter_copy(queryset))
+
+        self.stdout.write(f'{queryset.count()} {data} rows')
+        self.stdout.write(f'{"":>26} {"p50 ms":>10} {"MB/s":>8}')
+        for name, func in [
+            ('values() + json', to_json),
+            ('values() + csv', to_csv),
+            ('COPY to a file', copy_to_file),
+            ('COPY through the queue', copy_streamed),
+        ]:
+            size = func()
+            stats = summarize(measure(func, repeat, warmup=0))
+            self.stdout.write(f'{name:>26} {stats["p50_ms"]:>10.1f} {size / stats["p50_ms"] * 1000 / 2 ** 20:>8.1f}')
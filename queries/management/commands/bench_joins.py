@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from queries.benchmark import measure, summarize
+
+
+class Command(BaseCommand):
+    help = 'Compare the flat /queries/joins response with the nested one built by postgres (?nested=1)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help='timed requests per mode')
+
+    def handle(self, *args, repeat, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('nested mode needs postgres')
+
+        client = Client(HTTP_HOST='localhost')
+        self.stdout.write(f'{User.objects.count()} users')
+        self.stdout.write(f'{"mode":>8} {"rows":>9} {"bytes":>12} {"p50 ms":>10} {"p99 ms":>10}')
+        for mode, params in [('flat', {}), ('nested', {'nested': 1})]:
+            response = client.get('/queries/joins', params)
+            if response.status_code != 200:
+                raise CommandError(f'/queries/joins returned {response.status_code}')
+            rows = sum(len(value['data']) for value in response.json().values())
+            stats = summarize(measure(lambda: client.get('/queries/joins', params), repeat))
+            self.stdout.write(
+                f'{mode:>8} {rows:>9} {len(response.content):>12} {stats["p50_ms"]:>10.2f} {stats["p99_ms"]:>10.2f}'
+            )
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from queries import pagination
+from queries.benchmark import measure, summarize
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET/LIMIT pagination with keyset pagination at increasing page depths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depths', type=int, nargs='+', default=[1, 10, 100, 1000, 10000],
+                            help='page numbers to fetch, from 1')
+        parser.add_argument('--size', type=int, default=10, help='page size')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement')
+
+    def handle(self, *args, depths, size, repeat, **options):
+        if min(depths) < 1 or size < 1:
+            raise CommandError('--depths and --size must be at least 1')
+        total = User.objects.count()
+        ordered = User.objects.order_by(*pagination.ORDERING)
+        self.stdout.write(f'{total} users, page size {size}')
+        self.stdout.write(f'{"page":>8} {"offset p50 ms":>14} {"keyset p50 ms":>14} {"speedup":>8}')
+
+        for depth in depths:
+            offset = (depth - 1) * size
+            if offset >= total:
+                self.stdout.write(f'{depth:>8} skipped, only {total} users')
+                continue
+            # the cursor of the previous page is what a client would send back, computing it is not timed
+            cursor = pagination.encode_cursor(ordered[offset - 1]) if offset else None
+
+            offset_stats = summarize(measure(lambda: list(ordered.values()[offset:offset + size]), repeat))
+            keyset_stats = summarize(measure(
+                lambda: list(pagination.seek(User.objects.all(), cursor).values()[:size]), repeat
+            ))
+            speedup = offset_stats['p50_ms'] / keyset_stats['p50_ms']
+            self.stdout.write(
+                f'{depth:>8} {offset_stats["p50_ms"]:>14.3f} {keyset_stats["p50_ms"]:>14.3f} {speedup:>7.1f}x'
+            )
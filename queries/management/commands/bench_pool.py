@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from queries.backends.postgresql_pool.base import pool_stats
+from queries.benchmark import summarize
+
+ENGINES = {
+    'plain': 'django.db.backends.postgresql',
+    'pooled': 'queries.backends.postgresql_pool',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test connection handling: many threads each running short "requests" (connect, one cheap query, '
+        'close) with plain connections and with the connection pool'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200, help='requests per thread')
+        parser.add_argument('--max-size', type=int, default=8, help='pool MAX_SIZE, smaller than --threads to '
+                                                                     'exercise waiting for a free connection')
+
+    def handle(self, *args, threads, requests, max_size, **options):
+        default = connections.databases[DEFAULT_DB_ALIAS]
+        if 'postgresql' not in default['ENGINE']:
+            raise CommandError('the connection pool is for postgres')
+
+        for mode, engine in ENGINES.items():
+            alias = f'bench_{mode}'
+            connections.databases[alias] = {
+                **default,
+                'ENGINE': engine,
+                'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': max_size},
+            }
+            latencies, elapsed = self._run(alias, threads, requests)
+            stats = summarize(latencies)
+            self.stdout.write(
+                f'{mode:>7}: {len(latencies) / elapsed:>8.1f} req/s  p50 {stats["p50_ms"]:>7.2f} ms  '
+                f'p99 {stats["p99_ms"]:>7.2f} ms'
+            )
+        for label, stats in pool_stats().items():
+            self.stdout.write(f'pool {label}: {stats}')
+
+    @staticmethod
+    def _run(alias, threads, requests):
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            own = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                connection = connections[alias]  # thread-local, like in a request
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connection.close()  # what happens at the end of each request with CONN_MAX_AGE = 0
+                own.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(own)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return latencies, time.perf_counter() - start
@@ -0,0 +1,61 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from queries.benchmark import measure, summarize
+from queries.execution import CompiledQuery
+
+
+def catalog():
+    """ the kind of statements the views run """
+    today = timezone.now()
+    return {
+        'and_operation': User.objects.filter(Q(first_name='John') & Q(is_active=True)).values(),
+        'like': User.objects.filter(first_name__startswith='Jo').values(),
+        'comparison': User.objects.filter(id__lte=2).values(),
+        'between': User.objects.filter(date_joined__range=[today - timedelta(days=14), today]).values(),
+        'orderby': User.objects.order_by('date_joined', '-last_name').values()[:10],
+        'joins': User.objects.filter(id__lte=100).values('username', 'first_name', 'last_name', 'groups__name'),
+        'annotations': Group.objects.annotate(user_count=Count('user__username')).values('name', 'user_count'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare plain statements with server-side prepared statements (postgres only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200, help='executions per statement and mode')
+
+    def handle(self, *args, repeat, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('prepared statements need postgres')
+
+        self.stdout.write(
+            f'{"statement":>14} {"planning ms":>12} {"plain p50 ms":>13} {"prepared p50 ms":>16} {"saved":>7}'
+        )
+        for name, queryset in catalog().items():
+            planning_ms = self._planning_time(queryset)
+            plain = summarize(measure(lambda: CompiledQuery(queryset).fetch(), repeat))
+            with override_settings(QUERIES_PREPARED_STATEMENTS=True):
+                prepared = summarize(measure(lambda: CompiledQuery(queryset).fetch(), repeat))
+            saved = 1 - prepared['p50_ms'] / plain['p50_ms']
+            self.stdout.write(
+                f'{name:>14} {planning_ms:>12.3f} {plain["p50_ms"]:>13.3f} {prepared["p50_ms"]:>16.3f} {saved:>7.1%}'
+            )
+
+    @staticmethod
+    def _planning_time(queryset):
+        """ what postgres spends planning the statement, which a prepared statement with a cached plan skips """
+        compiled = CompiledQuery(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {compiled.sql}', compiled.params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Planning Time']
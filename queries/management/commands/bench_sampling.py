@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from queries.benchmark import measure, summarize
+from queries.sampling import random_sample
+
+
+class Command(BaseCommand):
+    help = "Compare random_sample() with order_by('?') for picking random users"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--n', type=int, nargs='+', default=[1, 10, 100], help='sample sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement')
+
+    def handle(self, *args, n, repeat, **options):
+        self.stdout.write(f'{User.objects.count()} users')
+        self.stdout.write(f'{"n":>6} {"order_by(?) p50 ms":>19} {"random_sample p50 ms":>21} {"speedup":>8}')
+        for size in n:
+            order_by_stats = summarize(measure(lambda: list(User.objects.values().order_by('?')[:size]), repeat))
+            sample_stats = summarize(measure(lambda: random_sample(User.objects.values(), size), repeat))
+            speedup = order_by_stats['p50_ms'] / sample_stats['p50_ms']
+            self.stdout.write(
+                f'{size:>6} {order_by_stats["p50_ms"]:>19.3f} {sample_stats["p50_ms"]:>21.3f} {speedup:>7.1f}x'
+            )
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from queries.benchmark import measure, summarize
+from queries.name_search import search
+
+# (field, match, pattern) over the names generate_data creates. Each of them is shared by 1/22 of the users, so a
+# sequential scan soon fills a page of results; a pattern no name matches makes it read the whole table
+SEARCHES = [
+    ('first_name', 'startswith', 'Jo'),
+    ('first_name', 'endswith', 'ohn'),
+    ('first_name', 'contains', 'ohn'),
+    ('last_name', 'endswith', 'son'),
+    ('last_name', 'regex', '^Sm.th$'),
+    ('last_name', 'contains', 'xyz'),
+    ('last_name', 'endswith', 'xyz'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare name searches with and without the indexes of migration 0004 (postgres only). '
+        'Generate a realistic table first, e.g. generate_data --users 1000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs per search and mode')
+        parser.add_argument('--size', type=int, default=100, help='rows fetched per search, as /queries/search')
+
+    def handle(self, *args, repeat, size, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('the search indexes need postgres')
+
+        self.stdout.write(f'{User.objects.count()} users')
+        self.stdout.write(
+            f'{"search":>30} {"rows":>6} {"seq scan p50 ms":>16} {"indexed p50 ms":>15} {"speedup":>8}  plan'
+        )
+        for field, match, pattern in SEARCHES:
+            queryset = search(User.objects.all(), field, match, pattern).values()[:size]
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    # only lasts until the end of this transaction
+                    cursor.execute('SET LOCAL enable_indexscan = off')
+                    cursor.execute('SET LOCAL enable_bitmapscan = off')
+                seq = summarize(measure(lambda: list(queryset), repeat))
+            indexed = summarize(measure(lambda: list(queryset), repeat))
+            plan = queryset.explain().splitlines()
+            self.stdout.write(
+                f'{f"{field} {match} {pattern!r}":>30} {len(list(queryset)):>6} {seq["p50_ms"]:>16.3f} '
+                f'{indexed["p50_ms"]:>15.3f} {seq["p50_ms"] / indexed["p50_ms"]:>7.1f}x  {_scan(plan)}'
+            )
+
+
+def _scan(plan):
+    """ the innermost node of an EXPLAIN text plan, e.g. `Bitmap Index Scan on queries_user_first_name_trgm` """
+    return plan[-1].strip(' ->').split('  (')[0] if plan else ''
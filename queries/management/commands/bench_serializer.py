@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.forms import model_to_dict
+
+from queries.benchmark import measure, summarize
+from queries.serializers import serializer_for
+
+EXCLUDE = ('groups', 'user_permissions')
+
+
+class Command(BaseCommand):
+    help = 'Per-row cost of model_to_dict() on User instances compared with RowSerializer on value rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='users serialized per run')
+        parser.add_argument('--repeat', type=int, default=10, help='timed runs per measurement')
+
+    def handle(self, *args, rows, repeat, **options):
+        serializer = serializer_for(User, exclude=EXCLUDE)
+        queryset = User.objects.order_by('pk')[:rows]
+        instances = list(queryset)
+        value_rows = list(serializer.values_list(queryset))
+        count = len(instances)
+        if [model_to_dict(user, exclude=EXCLUDE) for user in instances] != [serializer(row) for row in value_rows]:
+            raise CommandError('RowSerializer and model_to_dict disagree')
+
+        cases = [
+            # serialization alone, on rows already fetched
+            ('model_to_dict', lambda: [model_to_dict(user, exclude=EXCLUDE) for user in instances]),
+            ('RowSerializer', lambda: [serializer(row) for row in value_rows]),
+            # fetching included: instances are built from the cursor rows first
+            ('fetch + model_to_dict', lambda: [model_to_dict(user, exclude=EXCLUDE) for user in queryset.all()]),
+            ('fetch + RowSerializer', lambda: [serializer(row) for row in serializer.values_list(queryset)]),
+        ]
+        self.stdout.write(f'{count} users')
+        self.stdout.write(f'{"":>22} {"p50 ms":>9} {"us/row":>8}')
+        for name, func in cases:
+            stats = summarize(measure(func, repeat))
+            self.stdout.write(f'{name:>22} {stats["p50_ms"]:>9.2f} {stats["p50_ms"] * 1000 / max(count, 1):>8.2f}')
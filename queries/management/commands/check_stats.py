@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from queries import stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Check the precomputed GroupStats/UserStats rows against auth_user_groups (postgres only). '
+        'Fails if any of them is missing or stale, unless --fix recomputes them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='recompute the stale rows')
+        parser.add_argument('--show', type=int, default=10, help='stale ids listed per table')
+
+    def handle(self, *args, fix, show, **options):
+        if not stats.is_enabled(connection):
+            raise CommandError('the precomputed statistics need postgres')
+
+        with transaction.atomic():
+            stale = stats.stale()
+            for name, ids in stale.items():
+                listed = ', '.join(map(str, ids[:show])) + (', ...' if len(ids) > show else '')
+                self.stdout.write(f'{len(ids)} stale {name}' + (f': {listed}' if ids else ''))
+            if fix:
+                stats.refresh_users(stale['users'])
+                stats.refresh_groups(stale['groups'])
+
+        if not any(stale.values()):
+            self.stdout.write(self.style.SUCCESS('statistics are consistent'))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS('stale statistics recomputed'))
+        else:
+            raise CommandError('statistics are stale, run check_stats --fix')
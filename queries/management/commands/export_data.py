@@ -0,0 +1,38 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from queries import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Dump users or memberships as CSV with postgres COPY, straight from the database to a file (or stdout), '
+        'the same data as /queries/export'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('data', choices=list(export.DATASETS))
+        parser.add_argument('--output', help='CSV file to write (default: stdout)')
+
+    def handle(self, *args, data, output, **options):
+        queryset = export.DATASETS[data]()
+        if not export.is_supported(queryset):
+            raise CommandError('export needs postgres')
+
+        start = time.perf_counter()
+        if output:
+            with open(output, 'wb') as f:
+                rows = export.copy_to(queryset, f)
+                size = f.tell()
+        else:
+            rows = export.copy_to(queryset, sys.stdout.buffer)
+            size = None
+        elapsed = time.perf_counter() - start
+
+        # on stderr, stdout may be the CSV
+        summary = f'{rows} {data} rows in {elapsed:.2f} s ({rows / elapsed:.0f} rows/s'
+        if size is not None:
+            summary += f', {size / elapsed / 2 ** 20:.1f} MB/s'
+        self.stderr.write(summary + ')')
@@ -0,0 +1,151 @@
+import csv
+import io
+import random
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date
+from django.utils.timezone import utc
+
+from queries import stats
+
+FIRST_NAMES = [
+    'John', 'Jane', 'Mary', 'James', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+    'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen', 'Aryan',
+]
+LAST_NAMES = [
+    'Doe', 'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin', 'Dee',
+]
+UNUSABLE_PASSWORD = '!'  # like set_unusable_password(), without hashing a password per row
+
+USER_COLUMNS = [
+    'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'is_staff', 'is_active', 'date_joined'
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate users, groups and memberships for benchmarking. The same arguments always produce the same data, '
+        'and every user only depends on its index (not on --users or --batch-size): rows that already exist are '
+        'skipped, so running it again with a bigger --users tops the tables up'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='number of generated users')
+        parser.add_argument('--groups', type=int, default=100, help='number of generated groups')
+        parser.add_argument('--max-groups-per-user', type=int, default=3)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='zipf exponent of group popularity: 0 is uniform, bigger means a few huge groups')
+        parser.add_argument('--since', type=parse_date, default=date(2020, 1, 1),
+                            help='date_joined of the first user (YYYY-MM-DD)')
+        parser.add_argument('--join-interval', type=float, default=60,
+                            help='seconds between the date_joined of consecutive users')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='gen', help='prefix of generated usernames and group names')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['groups'] < 1 and options['max_groups_per_user'] > 0:
+            raise CommandError('--groups must be positive to create memberships')
+        self.options = options
+        self.since = datetime.combine(options['since'], time.min, tzinfo=utc)
+
+        with transaction.atomic():
+            groups = self._create_groups()
+            created = skipped = 0
+            for start in range(0, options['users'], options['batch_size']):
+                users, memberships = self._generate_batch(start, groups)
+                existing = set(User.objects.filter(
+                    username__in=[row[2] for row in users]
+                ).values_list('username', flat=True))
+                if existing:
+                    users = [row for row in users if row[2] not in existing]
+                    memberships = [row for row in memberships if row[0] not in existing]
+                    skipped += len(existing)
+                if users:
+                    self._load(users, memberships)
+                    created += len(users)
+                self.stdout.write(f'{min(start + options["batch_size"], options["users"])} / {options["users"]}',
+                                  ending='\r')
+                self.stdout.flush()
+
+            # COPY and bulk_create send no signals
+            stats.refresh_all()
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE auth_user, auth_group, auth_user_groups, queries_userstats, queries_groupstats')
+        self.stdout.write(self.style.SUCCESS(
+            f'created {created} users ({skipped} already existed), {len(groups)} groups'
+        ))
+
+    def _create_groups(self):
+        prefix = self.options['prefix']
+        names = [f'{prefix}-group-{i:05}' for i in range(self.options['groups'])]
+        Group.objects.bulk_create([Group(name=name) for name in names], ignore_conflicts=True)
+        ids = dict(Group.objects.filter(name__in=names).values_list('name', 'id'))
+        return [(name, ids[name]) for name in names]  # ordered by popularity
+
+    def _generate_batch(self, start, groups):
+        options = self.options
+        cum_weights = list(accumulate(1 / (rank + 1) ** options['skew'] for rank in range(len(groups))))
+        step = timedelta(seconds=options['join_interval'])
+
+        users, memberships = [], []
+        for index in range(start, min(start + options['batch_size'], options['users'])):
+            # one generator per user: a user is the same whatever the batches and the number of users around it
+            rng = random.Random(f'{options["seed"]}:{index}')
+            username = f'{options["prefix"]}{index:08}'
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            # append-only: date_joined grows with the index, like in a real table
+            date_joined = self.since + step * index + step * rng.random()
+            is_active = rng.random() < 0.9
+            group_count = rng.randint(0, options['max_groups_per_user']) if groups else 0
+            user_groups = {group_id for _, group_id in rng.choices(groups, cum_weights=cum_weights, k=group_count)}
+            users.append([
+                UNUSABLE_PASSWORD, False, username, first_name, last_name, f'{username}@example.com', False,
+                is_active, date_joined,
+            ])
+            memberships.extend((username, group_id) for group_id in sorted(user_groups))
+        return users, memberships
+
+    def _load(self, users, memberships):
+        if connection.vendor == 'postgresql':
+            self._copy(users, memberships)
+        else:
+            self._bulk_create(users, memberships)
+
+    @staticmethod
+    def _copy(users, memberships):
+        def as_csv(rows):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            return buffer
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY auth_user ({", ".join(USER_COLUMNS)}) FROM STDIN WITH (FORMAT csv)', as_csv(users)
+            )
+            cursor.execute(
+                'CREATE TEMPORARY TABLE generated_memberships (username varchar(150), group_id integer)'
+            )
+            cursor.copy_expert('COPY generated_memberships FROM STDIN WITH (FORMAT csv)', as_csv(memberships))
+            cursor.execute(
+                'INSERT INTO auth_user_groups (user_id, group_id) '
+                'SELECT u.id, m.group_id FROM generated_memberships m JOIN auth_user u ON u.username = m.username'
+            )
+            cursor.execute('DROP TABLE generated_memberships')
+
+    @staticmethod
+    def _bulk_create(users, memberships):
+        User.objects.bulk_create([User(**dict(zip(USER_COLUMNS, row))) for row in users])
+        ids = dict(User.objects.filter(username__in=[row[2] for row in users]).values_list('username', 'id'))
+        Membership = User.groups.through
+        Membership.objects.bulk_create([
+            Membership(user_id=ids[username], group_id=group_id) for username, group_id in memberships
+        ])
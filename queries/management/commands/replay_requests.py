@@ -0,0 +1,302 @@
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from queries.benchmark import percentile, summarize
+
+TARGETS = ('wsgi', 'asgi')
+
+
+class Capture:
+    """ a request read from a JSONL capture """
+
+    def __init__(self, entry):
+        url = urllib.parse.urlsplit(entry['path'])
+        self.method = entry.get('method', 'GET').upper()
+        self.path = url.path
+        self.query_string = url.query
+        self.headers = {name.lower(): str(value) for name, value in entry.get('headers', {}).items()}
+        self.offset = entry.get('offset')
+        body = entry.get('body', b'')
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+            self.headers.setdefault('content-type', 'application/json')
+        self.body = body.encode() if isinstance(body, str) else body
+
+    @property
+    def full_path(self):
+        return self.path + ('?' + self.query_string if self.query_string else '')
+
+    @property
+    def route(self):
+        try:
+            match = resolve(self.path)
+        except Resolver404:
+            return self.path
+        return '/' + match.route
+
+
+def read_captures(lines):
+    """ (captures, number of skipped lines): lines without a path, like the backlog in requests.jsonl, are skipped """
+    captures, skipped = [], 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            skipped += 1
+            continue
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+            skipped += 1
+            continue
+        captures.append(Capture(entry))
+    return captures, skipped
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay the requests of a JSONL capture, one {"method", "path", "headers", "body", "offset"} object per line '
+        '(only path is required, offset is in seconds since the start of the capture), concurrently, in-process '
+        'through the WSGI or ASGI application of querysets/ or against a running server. Reports throughput, latency '
+        'percentiles, error rate and queries per request for every route. Requests the application fails to answer '
+        'count as errors, with the exception name as their status'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help='JSONL file of requests')
+        parser.add_argument('--target', default='wsgi',
+                            help='wsgi or asgi (the application objects of querysets/wsgi.py and asgi.py), '
+                                 'or the base url of a running server, e.g. http://localhost:7777')
+        parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at most')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='requests started per second (default: as fast as the concurrency allows)')
+        parser.add_argument('--speed', type=float, default=0,
+                            help='follow the offsets of the capture, this many times faster (overrides --rate)')
+        parser.add_argument('--repeat', type=int, default=1, help='replay the capture this many times')
+        parser.add_argument('--host', default='localhost',
+                            help='Host header of the in-process requests (must be in ALLOWED_HOSTS)')
+        parser.add_argument('--output', help='write results to this JSON file')
+
+    def handle(self, *args, **options):
+        with open(options['capture']) as f:
+            captures, skipped = read_captures(f)
+        if skipped:
+            self.stderr.write(f'skipped {skipped} lines that are not requests')
+        if not captures:
+            raise CommandError(f'no requests in {options["capture"]}')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['speed'] and any(capture.offset is None for capture in captures):
+            raise CommandError('--speed needs an offset on every request')
+
+        schedule = self._schedule(captures, options)
+        target = options['target']
+        if target == 'asgi':
+            results, elapsed = asyncio.run(self._replay_asgi(schedule, options['concurrency'], options['host']))
+        elif target == 'wsgi':
+            results, elapsed = self._replay_threads(
+                schedule, options['concurrency'], self._wsgi_send(options['host'])
+            )
+        elif target.startswith(('http://', 'https://')):
+            results, elapsed = self._replay_threads(schedule, options['concurrency'], self._http_send(target))
+        else:
+            raise CommandError(f'unknown target {target}, use one of {", ".join(TARGETS)} or a url')
+
+        report = {
+            'date': timezone.now().isoformat(),
+            'capture': options['capture'],
+            'target': target,
+            'concurrency': options['concurrency'],
+            'requests': len(results),
+            'elapsed_s': elapsed,
+            'throughput_rps': len(results) / elapsed,
+            'routes': self._report(results, elapsed),
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'results written to {options["output"]}')
+
+    @staticmethod
+    def _schedule(captures, options):
+        """ [(seconds after the start the request is due, capture)] for every repetition of the capture """
+        repeat = options['repeat']
+        if options['speed']:
+            # the offsets of every repetition start where the previous one ended
+            length = max(capture.offset for capture in captures)
+            return [
+                ((run * length + capture.offset) / options['speed'], capture)
+                for run in range(repeat) for capture in captures
+            ]
+        captures = captures * repeat
+        if options['rate']:
+            return [(index / options['rate'], capture) for index, capture in enumerate(captures)]
+        return [(0, capture) for capture in captures]
+
+    # targets: every send returns (status, {lower-case header: value}, body)
+
+    @staticmethod
+    def _wsgi_send(host):
+        from querysets.wsgi import application
+        factory = RequestFactory(HTTP_HOST=host)
+
+        def send(capture):
+            extra = {'HTTP_' + name.upper().replace('-', '_'): value for name, value in capture.headers.items()
+                     if name != 'content-type'}
+            environ = factory.generic(
+                capture.method, capture.full_path, capture.body,
+                content_type=capture.headers.get('content-type', 'application/octet-stream'), **extra,
+            ).environ
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split()[0])
+                started['headers'] = {name.lower(): value for name, value in headers}
+
+            chunks = application(environ, start_response)
+            try:
+                body = b''.join(chunks)
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()  # sends request_finished, which closes the database connection of the thread
+            return started['status'], started['headers'], body
+
+        return send
+
+    @staticmethod
+    def _http_send(base_url):
+        def send(capture):
+            request = urllib.request.Request(
+                base_url.rstrip('/') + capture.full_path, data=capture.body or None, method=capture.method,
+                headers=capture.headers,
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, {k.lower(): v for k, v in response.headers.items()}, response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, {k.lower(): v for k, v in e.headers.items()}, e.read()
+
+        return send
+
+    @staticmethod
+    async def _asgi_send(application, capture, host):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': capture.method,
+            'scheme': 'http',
+            'path': capture.path,
+            'raw_path': capture.path.encode(),
+            'query_string': capture.query_string.encode(),
+            'headers': [(b'host', host.encode())] + [
+                (name.encode(), value.encode()) for name, value in capture.headers.items()
+            ],
+            'server': (host, 80),
+            'client': ('127.0.0.1', 0),
+        }
+        messages = [{'type': 'http.request', 'body': capture.body, 'more_body': False}]
+        response = {'body': []}
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+            elif message['type'] == 'http.response.body':
+                response['body'].append(message.get('body', b''))
+
+        await application(scope, receive, send)
+        return response['status'], response['headers'], b''.join(response['body'])
+
+    # replays: return ([(capture, status or the name of its exception, seconds, queries or None)], elapsed seconds)
+
+    @staticmethod
+    def _measure(capture, status, headers, seconds):
+        queries = headers.get('x-queries-count')  # set by QueryMetricsMiddleware
+        return capture, status, seconds, int(queries) if queries is not None else None
+
+    def _replay_threads(self, schedule, concurrency, send):
+        start = time.perf_counter()
+
+        def replay(item):
+            due, capture = item
+            delay = start + due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            request_start = time.perf_counter()
+            try:
+                status, headers, _ = send(capture)
+            except Exception as e:  # the server or the application failed: count it, keep replaying
+                self.stderr.write(f'{capture.method} {capture.full_path}: {e!r}')
+                return capture, type(e).__name__, time.perf_counter() - request_start, None
+            return self._measure(capture, status, headers, time.perf_counter() - request_start)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='replay') as executor:
+            results = list(executor.map(replay, schedule))
+        return results, time.perf_counter() - start
+
+    async def _replay_asgi(self, schedule, concurrency, host):
+        from querysets.asgi import application
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def replay(due, capture):
+            await asyncio.sleep(max(0, start + due - loop.time()))
+            async with semaphore:
+                request_start = time.perf_counter()
+                try:
+                    status, headers, _ = await self._asgi_send(application, capture, host)
+                except Exception as e:
+                    self.stderr.write(f'{capture.method} {capture.full_path}: {e!r}')
+                    return capture, type(e).__name__, time.perf_counter() - request_start, None
+                return self._measure(capture, status, headers, time.perf_counter() - request_start)
+
+        results = await asyncio.gather(*(replay(due, capture) for due, capture in schedule))
+        return results, loop.time() - start
+
+    def _report(self, results, elapsed):
+        routes = {}
+        for capture, status, seconds, queries in results:
+            routes.setdefault(capture.route, []).append((status, seconds, queries))
+
+        report = {}
+        for route, samples in sorted(routes.items()):
+            latencies = [seconds for _, seconds, _ in samples]
+            queries = [count for _, _, count in samples if count is not None]
+            errors = sum(1 for status, _, _ in samples if isinstance(status, str) or status >= 400)
+            stats = summarize(latencies)
+            report[route] = result = {
+                'requests': len(samples),
+                'throughput_rps': len(samples) / elapsed,
+                'p50_ms': stats['p50_ms'],
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': stats['p99_ms'],
+                'max_ms': stats['max_ms'],
+                'error_rate': errors / len(samples),
+                'statuses': {
+                    str(status): sum(1 for sample in samples if sample[0] == status)
+                    for status in sorted({sample[0] for sample in samples}, key=str)
+                },
+                'queries_per_request': sum(queries) / len(queries) if queries else None,
+            }
+            self.stdout.write(
+                f'{route:>32} {result["requests"]:>6} req {result["throughput_rps"]:>9.1f} req/s  '
+                f'p50 {result["p50_ms"]:>8.2f} ms  p95 {result["p95_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms  '
+                f'{result["error_rate"]:>6.1%} errors  {result["queries_per_request"]} queries'
+            )
+        return report
@@ -0,0 +1,139 @@
+"""
+In-process request metrics.
+
+`QueryMetricsMiddleware` (see middleware.py) creates a `RequestMetrics` for every request and makes it the current
+one; database queries are counted and timed by an execute wrapper (no need for DEBUG=True) and code can time its own
+phases with `with metrics.phase('serialize'): ...`, which does nothing when no request is being measured.
+
+Finished requests are aggregated per route in `Histogram`s over a sliding window of the latest samples, so memory
+stays bounded and percentiles follow the current behaviour of the server.
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+WINDOW = 1024  # samples kept per histogram
+
+_current = contextvars.ContextVar('queries_request_metrics', default=None)
+
+
+class Histogram:
+    """ distribution of the latest `window` values of a measurement """
+
+    def __init__(self, window=WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value):
+        self._samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {'count': 0}
+
+        def pct(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+        return {
+            'count': self.count,
+            'mean': sum(ordered) / len(ordered),
+            'p50': pct(50),
+            'p95': pct(95),
+            'p99': pct(99),
+            'max': ordered[-1],
+        }
+
+
+class RequestMetrics:
+    """ measurements of one request """
+
+    def __init__(self):
+        self.queries = 0
+        self.phases = defaultdict(float)  # seconds, 'sql' is filled by the execute wrapper
+        self._lock = threading.Lock()  # querysets may be evaluated by several threads, see execution.py
+
+    def add(self, phase, seconds, queries=0):
+        with self._lock:
+            self.phases[phase] += seconds
+            self.queries += queries
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('sql', time.perf_counter() - start, queries=1)
+
+
+def current():
+    """ metrics of the request being served in this context, None if it isn't measured """
+    return _current.get()
+
+
+@contextmanager
+def measuring(request_metrics):
+    token = _current.set(request_metrics)
+    try:
+        yield request_metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """ add the time spent in the block to phase `name` of the current request """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.add(name, time.perf_counter() - start)
+
+
+@contextmanager
+def instrument(connection):
+    """ count and time the queries run on `connection` (thread-local) for the current request """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    with connection.execute_wrapper(request_metrics.execute_wrapper):
+        yield
+
+
+class Registry:
+    """ histograms per route and measurement """
+
+    def __init__(self, window=WINDOW):
+        self._window = window
+        self._routes = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def record(self, route, **values):
+        with self._lock:
+            histograms = self._routes[route]
+            for name, value in values.items():
+                if name not in histograms:
+                    histograms[name] = Histogram(self._window)
+                histograms[name].add(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: {name: histogram.summary() for name, histogram in histograms.items()}
+                for route, histograms in sorted(self._routes.items())
+            }
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = Registry()
@@ -0,0 +1,144 @@
+import cProfile
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, profiling, routers
+
+
+class QueryMetricsMiddleware:
+    """
+    Records, per route: number of queries, total database time, serialization time, response size and latency.
+
+    Aggregated histograms are served by the `metrics` view; every response also gets an `X-Queries-Count` header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        start = time.perf_counter()
+        with metrics.measuring(request_metrics), self._instrumented():
+            response = self.get_response(request)
+
+        route = request.resolver_match.route if request.resolver_match else None
+        if response.streaming:
+            # the body, and its queries, are produced after we return: measure while it is consumed
+            response.streaming_content = self._observe_stream(
+                response.streaming_content, request_metrics, route, start
+            )
+        else:
+            response['X-Queries-Count'] = request_metrics.queries
+            self._record(route, request_metrics, len(response.content), start)
+        return response
+
+    @staticmethod
+    def _instrumented():
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(metrics.instrument(connection))
+        return stack
+
+    def _observe_stream(self, chunks, request_metrics, route, start):
+        size = 0
+        with metrics.measuring(request_metrics), self._instrumented():
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        self._record(route, request_metrics, size, start)
+
+    @staticmethod
+    def _record(route, request_metrics, size, start):
+        if route is None:
+            return
+        metrics.registry.record(
+            route,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            queries=request_metrics.queries,
+            db_ms=request_metrics.phases['sql'] * 1000,
+            serialize_ms=request_metrics.phases['serialize'] * 1000,
+            response_bytes=size,
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Read-your-writes for ReplicaRouter (see routers.py): a request that writes gets a cookie, and the requests that
+    carry it read from the primary until it expires.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = routers.RequestRouting(read_primary=routers.STICKY_COOKIE in request.COOKIES)
+        with routers.routing(state):
+            response = self.get_response(request)
+
+        if state.wrote:
+            # writes made while a streamed body is sent come too late for its headers
+            self._set_cookie(response)
+        if response.streaming:
+            response.streaming_content = self._route_stream(response.streaming_content, state)
+        return response
+
+    @staticmethod
+    def _route_stream(chunks, state):
+        # the body is read while it is consumed, after __call__ returned: keep routing it the same way
+        with routers.routing(state):
+            yield from chunks
+
+    @staticmethod
+    def _set_cookie(response):
+        response.set_cookie(
+            routers.STICKY_COOKIE, '1', max_age=getattr(settings, 'QUERIES_REPLICA_STICKY_SECONDS', 10),
+            httponly=True, samesite='Lax',
+        )
+
+
+class ProfilerMiddleware:
+    """ profiles the requests picked by `is_requested()`, see profiling.py; put it after AuthenticationMiddleware """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.is_requested(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        if response.streaming:
+            # most of the work happens while the body is consumed
+            response.streaming_content = self._profile_stream(
+                response.streaming_content, profiler, request, response, start
+            )
+        else:
+            response['X-Queries-Profile'] = self._save(profiler, request, response, start)
+        return response
+
+    def _profile_stream(self, chunks, profiler, request, response, start):
+        iterator = iter(chunks)
+        while True:
+            profiler.enable()
+            try:
+                chunk = next(iterator, None)
+            finally:
+                profiler.disable()
+            if chunk is None:
+                break
+            yield chunk
+        self._save(profiler, request, response, start)
+
+    @staticmethod
+    def _save(profiler, request, response, start):
+        return profiling.save(profiler, request, response, time.perf_counter() - start, metrics.current())
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # supports keyset pagination by (date_joined, id), see queries/pagination.py
+    dependencies = [
+        ('queries', '0002_create_groups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_date_joined_id ON auth_user (date_joined, id)',
+            'DROP INDEX queries_user_date_joined_id',
+        ),
+    ]
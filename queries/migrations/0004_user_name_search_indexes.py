@@ -0,0 +1,31 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # supports the `like` view and name search, see queries/name_search.py
+    dependencies = [
+        ('queries', '0003_user_date_joined_id_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # LIKE 'x%', LIKE '%x%', LIKE '%x' and ~ 'regex'
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_first_name_trgm ON auth_user USING gin (first_name gin_trgm_ops)',
+            'DROP INDEX queries_user_first_name_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_last_name_trgm ON auth_user USING gin (last_name gin_trgm_ops)',
+            'DROP INDEX queries_user_last_name_trgm',
+        ),
+        # suffix matches as prefix matches on the reversed name: REVERSE(name) LIKE 'x%'
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_first_name_reverse ON auth_user (reverse(first_name) text_pattern_ops)',
+            'DROP INDEX queries_user_first_name_reverse',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_last_name_reverse ON auth_user (reverse(last_name) text_pattern_ops)',
+            'DROP INDEX queries_user_last_name_reverse',
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # supports the orderings of the `orderby` and `get_single` views and the date range of `between`
+    # (date_joined and date_joined DESC alone are served by queries_user_date_joined_id, see 0003)
+    dependencies = [
+        ('queries', '0004_user_name_search_indexes'),
+    ]
+
+    operations = [
+        # ORDER BY date_joined, last_name DESC
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_date_joined_last_name ON auth_user (date_joined, last_name DESC)',
+            'DROP INDEX queries_user_date_joined_last_name',
+        ),
+        # first() and earliest() by date_joined, -first_name; read backwards, latest() by the same fields
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_date_joined_first_name ON auth_user (date_joined, first_name DESC)',
+            'DROP INDEX queries_user_date_joined_first_name',
+        ),
+        # last() and latest() by first_name
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_first_name ON auth_user (first_name)',
+            'DROP INDEX queries_user_first_name',
+        ),
+        # users are appended in date_joined order, so block ranges of date_joined barely overlap: a BRIN index
+        # a few pages big serves wide date_joined ranges without the size and write cost of another btree
+        migrations.RunSQL(
+            'CREATE INDEX queries_user_date_joined_brin ON auth_user USING brin (date_joined)',
+            'DROP INDEX queries_user_date_joined_brin',
+        ),
+    ]
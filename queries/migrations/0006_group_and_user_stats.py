@@ -0,0 +1,52 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:20
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('queries', '0005_user_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupStats',
+            fields=[
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queries_stats', serialize=False, to='auth.Group')),
+                ('user_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queries_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('group_count', models.PositiveIntegerField(default=0)),
+                ('group_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=150), default=list, size=None)),
+            ],
+        ),
+        # statistics of the existing rows, as stats.refresh_all()
+        migrations.RunSQL(
+            """
+            INSERT INTO queries_userstats (user_id, group_count, group_names)
+            SELECT u.id, COUNT(g.id), COALESCE(ARRAY_AGG(g.name ORDER BY g.name) FILTER (WHERE g.id IS NOT NULL), '{}')
+            FROM auth_user u
+            LEFT JOIN auth_user_groups ug ON ug.user_id = u.id
+            LEFT JOIN auth_group g ON g.id = ug.group_id
+            GROUP BY u.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO queries_groupstats (group_id, user_count)
+            SELECT g.id, COUNT(ug.user_id) FROM auth_group g LEFT JOIN auth_user_groups ug ON ug.group_id = g.id
+            GROUP BY g.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
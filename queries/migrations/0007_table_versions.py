@@ -0,0 +1,57 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+# the tables of the views with ETags (see queries/conditional.py)
+TABLES = ['auth_user', 'auth_group', 'auth_user_groups', 'queries_groupstats', 'queries_userstats']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queries', '0006_group_and_user_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=63)),
+                ('backend', models.IntegerField()),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('table_name', 'backend')},
+            },
+        ),
+        # every statement writing to these tables, committed or not, increments their version in the same
+        # transaction. On the counter of the backend running it: a backend runs one transaction at a time, so the
+        # row is never locked by another transaction. Rows are never deleted, the sum would go back to an old value
+        migrations.RunSQL(
+            [
+                """
+                CREATE FUNCTION queries_increment_table_version() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO queries_tableversion (table_name, backend, version)
+                    VALUES (TG_TABLE_NAME, pg_backend_pid(), 1)
+                    ON CONFLICT (table_name, backend) DO UPDATE SET version = queries_tableversion.version + 1;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+                """,
+                *[
+                    f"""
+                    CREATE TRIGGER queries_{table}_version
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                    FOR EACH STATEMENT EXECUTE PROCEDURE queries_increment_table_version()
+                    """
+                    for table in TABLES
+                ],
+            ],
+            [
+                *[f'DROP TRIGGER queries_{table}_version ON {table}' for table in TABLES],
+                'DROP FUNCTION queries_increment_table_version()',
+            ],
+        ),
+    ]
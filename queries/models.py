@@ -1,3 +1,30 @@
+from django.contrib.auth.models import Group, User
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 
-# Create your models here.
+
+# Membership statistics of the `annotations` view, precomputed. Rows are kept up to date by the signal receivers of
+# stats.py and checked against auth_user_groups by the check_stats command.
+
+class GroupStats(models.Model):
+    group = models.OneToOneField(Group, primary_key=True, on_delete=models.CASCADE, related_name='queries_stats')
+    user_count = models.PositiveIntegerField(default=0)
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name='queries_stats')
+    group_count = models.PositiveIntegerField(default=0)
+    group_names = ArrayField(models.CharField(max_length=150), default=list)  # sorted
+
+
+# Change counters of the tables the views read, incremented by database triggers on every statement that writes to
+# them (see migration 0007), for the ETags of conditional.py. A table has a counter per database backend (process)
+# that wrote to it, so writers never wait for each other's counter; its version is their sum.
+
+class TableVersion(models.Model):
+    table_name = models.CharField(max_length=63)
+    backend = models.IntegerField()  # pg_backend_pid()
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('table_name', 'backend')]
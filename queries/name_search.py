@@ -0,0 +1,40 @@
+"""
+Name search backed by the indexes of migration 0004.
+
+- `contains` and `regex` use the pg_trgm GIN indexes on first_name/last_name, which postgres can only narrow down
+  with patterns of at least 3 characters (one trigram), hence MIN_PATTERN_LENGTH
+- `startswith` uses the same trigram indexes (the start of a word is padded into trigrams)
+- `endswith` is run as `REVERSE(name) LIKE 'reversed pattern%'`, a prefix match the btree index on `reverse(name)`
+  answers directly
+
+`%` and `_` in the pattern are matched literally, django escapes them. Regexes are checked with `re` first, but
+postgres reads them as ARE (advanced regular expressions): python syntax like `(?P<name>...)` only fails in postgres,
+with a DataError the view answers with 400.
+"""
+import re
+
+FIELDS = ('first_name', 'last_name')
+MATCHES = ('startswith', 'endswith', 'contains', 'regex')
+MIN_PATTERN_LENGTH = 3
+
+
+def search(queryset, field, match, pattern):
+    """ `queryset` filtered on `field` matching `pattern`; ValueError on a field, match or pattern it can't serve """
+    if field not in FIELDS:
+        raise ValueError(f'field must be one of {", ".join(FIELDS)}')
+    if match not in MATCHES:
+        raise ValueError(f'match must be one of {", ".join(MATCHES)}')
+    if not pattern:
+        raise ValueError('empty pattern')
+    if match in ('contains', 'regex') and len(pattern) < MIN_PATTERN_LENGTH:
+        raise ValueError(f'{match} needs a pattern of at least {MIN_PATTERN_LENGTH} characters to use an index')
+
+    if match == 'endswith':
+        # the `reverse` transform is registered on CharField in QueriesConfig.ready()
+        return queryset.filter(**{f'{field}__reverse__startswith': pattern[::-1]})
+    if match == 'regex':
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f'invalid regex: {e}')
+    return queryset.filter(**{f'{field}__{match}': pattern})
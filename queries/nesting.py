@@ -0,0 +1,61 @@
+"""
+Nested JSON built by PostgreSQL.
+
+The flat joins (`values(..., 'groups__name')`) return a row per membership, repeating the user columns once per group.
+The querysets below return one row per user (or group) instead, already shaped as the JSON object the response
+sends, with the related names aggregated into an array by `JSONB_AGG`: no duplicated columns travel from the
+database and Python only has to pass the objects through.
+"""
+from django.contrib.auth.models import Group, User
+from django.contrib.postgres.aggregates import JSONBAgg
+from django.contrib.postgres.fields import JSONField
+from django.db.models import F, Func, Q, Value
+from django.db.models.functions import Coalesce
+
+
+class _Literal(Value):
+    # a parameter cast to `db_type`, so that the statement can be prepared (see prepared.py); like any Value, it
+    # stays out of the GROUP BY
+
+    def __init__(self, value, db_type):
+        super().__init__(value)
+        self.db_type = db_type
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return f'{sql}::{self.db_type}', params
+
+
+class JSONObject(Func):
+    """ JSONB_BUILD_OBJECT('key', value, ...) from keyword arguments """
+    function = 'JSONB_BUILD_OBJECT'
+    output_field = JSONField()
+
+    def __init__(self, **fields):
+        args = []
+        for key, value in fields.items():
+            args.extend((_Literal(key, 'text'), value))
+        super().__init__(*args)
+
+
+def json_array(expression, **extra):
+    """ JSONB_AGG(expression), [] rather than null when there is nothing to aggregate """
+    return Coalesce(JSONBAgg(expression, **extra), _Literal('[]', 'jsonb'))
+
+
+def users_with_groups():
+    """ {username, first_name, last_name, groups: [name, ...]} per user """
+    return User.objects.annotate(nested=JSONObject(
+        username=F('username'),
+        first_name=F('first_name'),
+        last_name=F('last_name'),
+        groups=json_array('groups__name', filter=Q(groups__isnull=False)),
+    )).values_list('nested', flat=True)
+
+
+def groups_with_users():
+    """ {name, users: [username, ...]} per group """
+    return Group.objects.annotate(nested=JSONObject(
+        name=F('name'),
+        users=json_array('user__username', filter=Q(user__isnull=False)),
+    )).values_list('nested', flat=True)
@@ -0,0 +1,50 @@
+"""
+Keyset (seek) pagination over users.
+
+Instead of skipping `offset` rows (`User.objects.all()[10:20]`), every page starts right after the last row of the
+previous one, identified by an opaque cursor that encodes its ordering key `(date_joined, id)`. With an index on
+`(date_joined, id)` (see migration 0003) each page is a short index range scan, whatever its depth.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+ORDERING = ('date_joined', 'id')
+DEFAULT_MAX_SIZE = 1000  # largest page, see QUERIES_KEYSET_MAX_SIZE
+
+
+def encode_cursor(row):
+    """ opaque cursor pointing right after `row` (a model instance or a values() dict) """
+    if isinstance(row, dict):
+        date_joined, pk = row['date_joined'], row['id']
+    else:
+        date_joined, pk = row.date_joined, row.pk
+    key = json.dumps([date_joined.isoformat(), pk])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """ inverse of encode_cursor(), raises ValueError if the cursor is malformed """
+    try:
+        date_joined, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        date_joined = parse_datetime(date_joined)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    if date_joined is None or not isinstance(pk, int):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    return date_joined, pk
+
+
+def seek(queryset, cursor=None):
+    """ `queryset` ordered by (date_joined, id), starting right after `cursor` (from the beginning if None) """
+    queryset = queryset.order_by(*ORDERING)
+    if cursor is None:
+        return queryset
+    date_joined, pk = decode_cursor(cursor)
+    # the redundant date_joined >= bound gives the planner an index range to start from
+    return queryset.filter(date_joined__gte=date_joined).filter(
+        Q(date_joined__gt=date_joined) | Q(date_joined=date_joined, id__gt=pk)
+    )
@@ -0,0 +1,115 @@
+"""
+Server-side prepared statements for the postgresql backend.
+
+With `QUERIES_PREPARED_STATEMENTS = True`, every distinct statement run through `execution.CompiledQuery` is sent
+once per connection as `PREPARE q_<hash> AS ...` and afterwards only as `EXECUTE q_<hash>(params)`, so postgres
+parses it once and can reuse its plan. The statements prepared on a connection are tracked on its DatabaseWrapper
+and forgotten when django connects again (`connection_created`, whether the session is new or comes from the pool of
+postgresql_pool, which deallocates everything on check-in); the least recently used ones are deallocated past
+`QUERIES_PREPARED_STATEMENTS_MAX`. A name already prepared in the session by someone else (e.g. a pool without
+`RESET`) is deallocated and prepared again; a statement postgres refuses to prepare runs unprepared in that session.
+
+Prepared statements live in a server session: don't enable this behind a transaction-pooling pgbouncer.
+"""
+import hashlib
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from psycopg2 import errorcodes
+
+DEFAULT_MAX_STATEMENTS = 100
+_PLACEHOLDER = re.compile(r'%([s%])')
+
+
+def is_enabled(connection):
+    return getattr(settings, 'QUERIES_PREPARED_STATEMENTS', False) and connection.vendor == 'postgresql'
+
+
+class _Session:
+    """ statements prepared on one server session """
+
+    def __init__(self):
+        self.prepared = OrderedDict()  # name -> sql, least recently used first
+        self.unpreparable = set()
+
+
+def _session(connection):
+    session = getattr(connection, '_queries_prepared', None)
+    if session is None:
+        session = connection._queries_prepared = _Session()
+    return session
+
+
+# signal receiver, connected in QueriesConfig.ready()
+
+def connection_created(sender, connection, **kwargs):
+    # a new session, or a pooled one reset on check-in: nothing we know of is prepared there
+    connection._queries_prepared = _Session()
+
+
+def statements(connection):
+    """ name -> sql of the statements prepared on the current session of `connection` (a DatabaseWrapper) """
+    return dict(_session(connection).prepared)
+
+
+def to_server_placeholders(sql):
+    """ django's %s placeholders as $1, $2...; %% escapes become a plain % """
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f'${count}'
+
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+def _pgcode(error):
+    return getattr(error.__cause__, 'pgcode', None) or ''
+
+
+def _prepare(connection, cursor, name, sql, retry=True):
+    """ whether `sql` could be prepared as `name` """
+    try:
+        # in a savepoint, so a statement postgres can't prepare doesn't break the current transaction
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(f'PREPARE {name} AS {to_server_placeholders(sql)}')
+        return True
+    except DatabaseError as e:
+        code = _pgcode(e)
+    if code == errorcodes.DUPLICATE_PREPARED_STATEMENT and retry:
+        # left in the session by someone else (e.g. a pool without RESET), maybe for other column types
+        cursor.execute(f'DEALLOCATE {name}')
+        return _prepare(connection, cursor, name, sql, retry=False)
+    if code[:2] == errorcodes.CLASS_SYNTAX_ERROR_OR_ACCESS_RULE_VIOLATION:
+        # e.g. the type of a parameter can't be inferred: run it as a plain statement for the rest of the session
+        _session(connection).unpreparable.add(name)
+    return False
+
+
+def execute(connection, cursor, sql, params):
+    """ run `sql` with `params` on `cursor` as a prepared statement, return the statement as it would run unprepared """
+    name = 'q_' + hashlib.sha1(sql.encode()).hexdigest()[:20]
+    session = _session(connection)
+
+    if name not in session.prepared and name not in session.unpreparable:
+        if _prepare(connection, cursor, name, sql):
+            session.prepared[name] = sql
+            max_statements = getattr(settings, 'QUERIES_PREPARED_STATEMENTS_MAX', DEFAULT_MAX_STATEMENTS)
+            while len(session.prepared) > max_statements:
+                oldest, _ = session.prepared.popitem(last=False)
+                cursor.execute(f'DEALLOCATE {oldest}')
+
+    if name in session.prepared:
+        session.prepared.move_to_end(name)
+        if params:
+            cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(params))})', params)
+        else:
+            cursor.execute(f'EXECUTE {name}')
+    else:
+        cursor.execute(sql, params)
+    return cursor.mogrify(sql, params).decode()
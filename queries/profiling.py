@@ -0,0 +1,141 @@
+"""
+Profiles of individual requests.
+
+`ProfilerMiddleware` (see middleware.py) runs a request under cProfile when a staff user asks for it with
+`?profile=1`, or for a random `QUERIES_PROFILE_SAMPLE_RATE` fraction of all requests. Otherwise it only looks up a
+query string key and compares a number: with the default rate of 0 there is no profiler overhead at all.
+
+The time of a profile is split into phases by where it is spent (the own time of every function, so the phases add
+up to the total): `sql` in the database driver and backends, `materialize` turning rows into model instances and
+values, `to_dict` in model_to_dict and the row serializer, `serialize` encoding JSON, and `other`.
+
+Profiles are kept in `QUERIES_PROFILE_DIR`, a ring buffer of the latest `QUERIES_PROFILE_KEEP` requests: a pstats
+dump (open it with `python -m pstats` or snakeviz) and a JSON summary each. `/queries/profiles` lists the summaries,
+`/queries/profiles/<id>` shows the top functions of one profile (`?format=prof` downloads the dump).
+
+Only the thread serving the request is profiled: querysets evaluated by the worker threads of
+`QUERIES_PARALLEL_WORKERS` only show up as waiting.
+"""
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import time
+
+from django.conf import settings
+
+DEFAULT_KEEP = 100
+
+# (phase, pattern matched against the file and function name of pstats entries), first match wins
+PHASES = [
+    ('sql', re.compile(r'psycopg2|sqlite3|django/db/backends/|queries/backends/')),
+    ('to_dict', re.compile(r'django/forms/models\.py|queries/serializers\.py')),
+    ('serialize', re.compile(r'json|django/http/')),
+    ('materialize', re.compile(r'django/db/models/|queries/execution\.py|queries/batching\.py')),
+]
+_ID = re.compile(r'^\d+-\d+$')
+# orders of the /queries/profiles/<id> listing (?sort=)
+SORT_KEYS = sorted(key.value for key in pstats.SortKey)
+
+
+def directory():
+    return getattr(settings, 'QUERIES_PROFILE_DIR', None) or os.path.join(tempfile.gettempdir(), 'queries-profiles')
+
+
+def is_requested(request):
+    if request.GET.get('profile'):
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+    rate = getattr(settings, 'QUERIES_PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def phases(stats):
+    """ {phase: seconds} of a pstats.Stats, by the own time of every function """
+    totals = dict.fromkeys([name for name, _ in PHASES] + ['other'], 0.0)
+    for (filename, _, function), (_, _, own_time, _, _) in stats.stats.items():
+        location = f'{filename.replace(os.sep, "/")} {function}'
+        phase = next((name for name, pattern in PHASES if pattern.search(location)), 'other')
+        totals[phase] += own_time
+    return totals
+
+
+def _path(profile_id, extension):
+    return os.path.join(directory(), f'{profile_id}.{extension}')
+
+
+def save(profiler, request, response, wall_seconds, request_metrics=None):
+    """ store a finished profile in the ring buffer, returns its id """
+    os.makedirs(directory(), exist_ok=True)
+    profile_id = f'{time.time_ns()}-{os.getpid()}'
+    profiler.dump_stats(_path(profile_id, 'prof'))
+    stats = pstats.Stats(profiler)
+    summary = {
+        'id': profile_id,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'wall_ms': wall_seconds * 1000,
+        'profiled_ms': stats.total_tt * 1000,
+        'phases_ms': {name: seconds * 1000 for name, seconds in phases(stats).items()},
+        'queries': request_metrics.queries if request_metrics else None,
+    }
+    # written last and atomically: a profile is listed once both files are complete
+    temporary = _path(profile_id, 'json.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(summary, f)
+    os.replace(temporary, _path(profile_id, 'json'))
+    _prune()
+    return profile_id
+
+
+def _ids():
+    # ids start with the time they were taken at, newest first
+    names = [name[:-len('.json')] for name in os.listdir(directory()) if name.endswith('.json')]
+    return sorted(names, key=lambda profile_id: [int(part) for part in profile_id.split('-')], reverse=True)
+
+
+def _prune():
+    for profile_id in _ids()[getattr(settings, 'QUERIES_PROFILE_KEEP', DEFAULT_KEEP):]:
+        for extension in ['json', 'prof']:
+            try:
+                os.remove(_path(profile_id, extension))
+            except FileNotFoundError:
+                pass  # pruned by another process
+
+
+def index():
+    """ summaries of the stored profiles, newest first """
+    if not os.path.isdir(directory()):
+        return []
+    summaries = []
+    for profile_id in _ids():
+        try:
+            with open(_path(profile_id, 'json')) as f:
+                summaries.append(json.load(f))
+        except FileNotFoundError:
+            pass
+    return summaries
+
+
+def dump_path(profile_id):
+    """ path of the pstats dump of a stored profile, None if there is no such profile """
+    if not _ID.match(profile_id):
+        return None
+    path = _path(profile_id, 'prof')
+    return path if os.path.exists(path) else None
+
+
+def report(profile_id, sort='cumulative', limit=50):
+    """ pstats listing of the top `limit` functions of a stored profile, None if there is no such profile """
+    if sort not in SORT_KEYS:
+        raise ValueError(f'unknown sort key {sort}')
+    path = dump_path(profile_id)
+    if path is None:
+        return None
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
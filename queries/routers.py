@@ -0,0 +1,139 @@
+"""
+Read replicas for the read-only views.
+
+With `DATABASE_ROUTERS = ['queries.routers.ReplicaRouter']` and the aliases of the replicas in `QUERIES_REPLICAS`,
+requests read from the replicas in turn and write to `default`: all the reads of a request go to the same database,
+so its results (and the table versions of conditional.py) come from one point in time. A replica is skipped while it
+is unreachable or lags more than `QUERIES_REPLICA_MAX_LAG` seconds behind; its lag is measured at most every
+`QUERIES_REPLICA_LAG_CHECK_INTERVAL` seconds. When no replica qualifies, reads fall back to `default`.
+
+Outside of requests, every `queryset.db` asks the router again: code that compiles a queryset and then runs it pins
+the alias first (`queryset.using(queryset.db)`, as CompiledQuery in execution.py does), or the two may happen on
+different replicas.
+
+Reads also stay on `default`:
+- inside a transaction on `default` (ATOMIC_REQUESTS, TestCase...), which may hold uncommitted writes
+- for `QUERIES_REPLICA_STICKY_SECONDS` after a request of the same client wrote something, so it reads its own
+  writes: `ReplicaRoutingMiddleware` (see middleware.py) sets a cookie on the responses of requests that wrote
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'queries_read_primary'
+
+# lag of a replica in seconds: 0 when it has replayed everything it received, or isn't a standby at all (a second
+# independent instance, in tests)
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class RequestRouting:
+    """ routing state of the current request """
+
+    def __init__(self, read_primary):
+        self.read_primary = read_primary
+        self.wrote = False
+        self.read_alias = None  # picked at the first read
+
+
+_current = contextvars.ContextVar('queries_request_routing', default=None)
+
+
+@contextmanager
+def routing(state):
+    """ make `state` the routing state of the code run inside """
+    token = _current.set(state)
+    try:
+        yield state
+    finally:
+        _current.reset(token)
+
+
+def replicas():
+    return list(getattr(settings, 'QUERIES_REPLICAS', []))
+
+
+class ReplicaRouter:
+
+    def __init__(self):
+        self._lags = {}  # alias -> (lag in seconds or None if unreachable, monotonic time of the check)
+        self._lock = threading.Lock()
+        self._turns = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is not None and state.read_primary:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state is not None and state.read_alias is not None:
+            return state.read_alias
+        candidates = [alias for alias in replicas() if self._is_fresh(alias)]
+        alias = candidates[next(self._turns) % len(candidates)] if candidates else DEFAULT_DB_ALIAS
+        if state is not None:
+            state.read_alias = alias
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+            state.read_alias = DEFAULT_DB_ALIAS  # the rest of the request reads what it wrote
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as default
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        return obj1._state.db in aliases and obj2._state.db in aliases or None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from default through replication
+        return False if db in replicas() else None
+
+    def lags(self):
+        """ last measured lag of every replica, in seconds (None: unreachable) """
+        with self._lock:
+            return {alias: self._lags.get(alias, (None, None))[0] for alias in replicas()}
+
+    def _is_fresh(self, alias):
+        lag = self._lag(alias)
+        return lag is not None and lag <= getattr(settings, 'QUERIES_REPLICA_MAX_LAG', 5)
+
+    def _lag(self, alias):
+        interval = getattr(settings, 'QUERIES_REPLICA_LAG_CHECK_INTERVAL', 1)
+        with self._lock:
+            lag, checked_at = self._lags.get(alias, (None, None))
+        if checked_at is not None and time.monotonic() - checked_at < interval:
+            return lag
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError as e:
+            logger.warning('replica %s is unavailable: %s', alias, e)
+            lag = None
+        with self._lock:
+            self._lags[alias] = lag, time.monotonic()
+        return lag
+
+
+def replica_lags():
+    """ {alias: lag} measured by the configured ReplicaRouter, {} without one """
+    for configured in router.routers:
+        if isinstance(configured, ReplicaRouter):
+            return configured.lags()
+    return {}
@@ -0,0 +1,70 @@
+"""
+Random samples without `ORDER BY RANDOM()`.
+
+`order_by('?')` makes the database sort the whole table by a random key. `random_sample()` draws random primary keys
+between MIN(pk) and MAX(pk) (both answered by the pk index) and fetches the rows that exist with `pk IN (...)`,
+so its cost depends on the sample size, not on the table size. Every row matching the queryset has the same chance
+of being picked; gaps in the pk sequence, or rows filtered out by the queryset, only make it draw more probes. When
+`MAX_ROUNDS` of probes don't find enough rows, the rest are the rows following a random pk: still bounded and
+reproducible from the seed, but rows after a gap are more likely to be picked.
+
+Views cap the sample size at `QUERIES_RANDOM_SAMPLE_MAX`.
+"""
+import math
+import random
+
+from django.db.models import Max, Min
+
+MAX_ROUNDS = 5
+MAX_PROBES_PER_ROUND = 10000
+DEFAULT_MAX_SIZE = 1000
+
+
+def random_sample(queryset, n, seed=None):
+    """
+    `n` random rows of `queryset` (fewer if it has fewer), in a random order. The same seed over the same data
+    returns the same sample.
+    """
+    rng = random.Random(seed)
+    pk_name = queryset.model._meta.pk.attname
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None or n <= 0:
+        return []
+    candidates = range(bounds['low'], bounds['high'] + 1)
+
+    picked, tried = {}, set()
+    hit_ratio = 1.0
+    for _ in range(MAX_ROUNDS):
+        missing = n - len(picked)
+        untried = len(candidates) - len(tried)
+        if missing <= 0 or untried <= 0:
+            break
+        # oversample by the share of probes that found a row so far
+        wanted = min(untried, MAX_PROBES_PER_ROUND, math.ceil(missing / hit_ratio * 1.2))
+        probes = [pk for pk in rng.sample(candidates, min(len(candidates), wanted + len(tried))) if pk not in tried]
+        probes = probes[:wanted]
+        tried.update(probes)
+
+        rows = {_pk(row, pk_name): row for row in queryset.filter(pk__in=probes)}
+        hit_ratio = max(len(rows) / len(probes), 0.01)
+        for pk in probes:
+            if pk in rows and len(picked) < n:
+                picked[pk] = rows[pk]
+
+    missing = n - len(picked)
+    if missing > 0 and len(tried) < len(candidates):
+        # very sparse pks or a very selective queryset: take the rows following a random pk, in pk order (the pk index
+        # answers it with a bounded scan), then wrap around to the start
+        pivot = rng.choice(candidates)
+        rest = queryset.exclude(pk__in=list(picked)).order_by('pk')
+        for page in (rest.filter(pk__gte=pivot), rest.filter(pk__lt=pivot)):
+            picked.update((_pk(row, pk_name), row) for row in page[:n - len(picked)])
+            if len(picked) >= n:
+                break
+    sample = list(picked.values())
+    rng.shuffle(sample)
+    return sample
+
+
+def _pk(row, pk_name):
+    return row[pk_name] if isinstance(row, dict) else row.pk
@@ -0,0 +1,54 @@
+"""
+Rows as dicts without model instances.
+
+`model_to_dict(instance, fields, exclude)` instantiates the model for every row, then walks all its fields to pick
+the editable ones that aren't excluded. `RowSerializer` makes that choice once per model and field set
+(`serializer_for()` caches them), selects only those columns with `values_list()`, and turns every row tuple into
+the same dict `model_to_dict` would have returned with a single `dict(zip(keys, row))`.
+"""
+from functools import lru_cache
+from itertools import chain
+
+
+class RowSerializer:
+
+    def __init__(self, model, fields=None, exclude=None):
+        opts = model._meta
+        selected = [
+            field for field in chain(opts.concrete_fields, opts.private_fields, opts.many_to_many)
+            # the same choice as model_to_dict
+            if getattr(field, 'editable', False)
+            and (fields is None or field.name in fields)
+            and not (exclude and field.name in exclude)
+        ]
+        for field in selected:
+            if field not in opts.concrete_fields:
+                raise ValueError(f'{field.name} is not a column of {opts.db_table}, exclude it')
+        self.model = model
+        self.keys = tuple(field.name for field in selected)
+        self.attnames = tuple(field.attname for field in selected)
+
+    def values_list(self, queryset):
+        """ `queryset` (or manager) selecting the serialized columns, as tuples to pass to the serializer """
+        return queryset.values_list(*self.attnames)
+
+    def in_bulk(self, queryset, id_list):
+        """ {pk: dict}, with the statement of `queryset.in_bulk(id_list)` """
+        pk_index = self.attnames.index(self.model._meta.pk.attname)
+        return {
+            row[pk_index]: self(row)
+            for row in self.values_list(queryset).filter(pk__in=id_list).order_by()
+        } if id_list else {}
+
+    def from_instance(self, instance):
+        """ the dict of an instance fetched anyway """
+        return {key: getattr(instance, attname) for key, attname in zip(self.keys, self.attnames)}
+
+    def __call__(self, row):
+        return dict(zip(self.keys, row))
+
+
+@lru_cache(maxsize=None)
+def serializer_for(model, fields=None, exclude=None):
+    """ the RowSerializer of `model` and these fields/exclude (tuples), built once """
+    return RowSerializer(model, fields, exclude)
@@ -0,0 +1,174 @@
+"""
+Precomputed membership statistics for `/queries/annotations?precomputed=1`.
+
+The live `annotations` querysets join auth_user_groups and GROUP BY on every request. GroupStats and UserStats (see
+models.py) store the same numbers, one row per group and per user, so the precomputed querysets are plain joins on
+primary keys. The rows are refreshed incrementally: every change of User.groups, and every creation, rename or deletion
+of a user or group, recomputes the rows of the users and groups it touches, inside the same transaction (see the
+receivers below, connected in QueriesConfig.ready()). A recount first takes a transaction-level advisory lock: under
+READ COMMITTED, two transactions adding members to the same group would each count without the other's uncommitted
+membership, and the last to commit would store its stale count. Waiting for the lock, the second recount starts after
+the first transaction committed, and sees its rows. It is one lock for all the statistics rather than one per user or
+group: a transaction recounts as many times as it changes memberships, and its later recounts would lock users and
+groups in another order than a concurrent transaction, which deadlocks. Transactions changing memberships are
+serialized from their first recount to their commit.
+
+Writes that send no signals (`bulk_create()`, COPY, raw SQL) leave the rows stale until `refresh_all()`, which
+generate_data runs after loading; the check_stats command reports and fixes rows that drifted.
+"""
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+
+# live statistics, WHERE_CLAUSE restricts the users (groups) computed
+_USERS_LIVE = """
+    SELECT u.id AS user_id,
+           COUNT(g.id) AS group_count,
+           COALESCE(ARRAY_AGG(g.name ORDER BY g.name) FILTER (WHERE g.id IS NOT NULL), '{}') AS group_names
+    FROM auth_user u
+    LEFT JOIN auth_user_groups ug ON ug.user_id = u.id
+    LEFT JOIN auth_group g ON g.id = ug.group_id
+    WHERE_CLAUSE
+    GROUP BY u.id
+"""
+_GROUPS_LIVE = """
+    SELECT g.id AS group_id, COUNT(ug.user_id) AS user_count
+    FROM auth_group g
+    LEFT JOIN auth_user_groups ug ON ug.group_id = g.id
+    WHERE_CLAUSE
+    GROUP BY g.id
+"""
+
+_UPSERT_USERS = """
+    INSERT INTO queries_userstats (user_id, group_count, group_names) {live}
+    ON CONFLICT (user_id) DO UPDATE SET group_count = EXCLUDED.group_count, group_names = EXCLUDED.group_names
+"""
+_UPSERT_GROUPS = """
+    INSERT INTO queries_groupstats (group_id, user_count) {live}
+    ON CONFLICT (group_id) DO UPDATE SET user_count = EXCLUDED.user_count
+"""
+
+# one transaction recounting at a time (see the module docstring), until it ends; taken again by the same
+# transaction, it doesn't wait
+_LOCK = "SELECT pg_advisory_xact_lock(hashtext('queries.stats'))"
+
+# members of a group whose stored group_names lack its name: it was renamed
+_RENAMED_GROUP_MEMBERS = """
+    SELECT ug.user_id FROM auth_user_groups ug
+    JOIN auth_group g ON g.id = ug.group_id
+    LEFT JOIN queries_userstats s ON s.user_id = ug.user_id
+    WHERE ug.group_id = %s AND (s.user_id IS NULL OR NOT g.name = ANY(s.group_names))
+"""
+
+_STALE_USERS = """
+    SELECT live.user_id FROM ({live}) live
+    LEFT JOIN queries_userstats s ON s.user_id = live.user_id
+    WHERE s.user_id IS NULL OR s.group_count <> live.group_count OR s.group_names <> live.group_names
+    ORDER BY live.user_id
+"""
+_STALE_GROUPS = """
+    SELECT live.group_id FROM ({live}) live
+    LEFT JOIN queries_groupstats s ON s.group_id = live.group_id
+    WHERE s.group_id IS NULL OR s.user_count <> live.user_count
+    ORDER BY live.group_id
+"""
+
+
+def _live(sql, where=''):
+    # not str.format(): the live statements contain a literal '{}'
+    return sql.replace('WHERE_CLAUSE', where)
+
+
+def is_enabled(connection):
+    # the statements above are postgres SQL
+    return connection.vendor == 'postgresql'
+
+
+def _execute(using, sql, params=()):
+    connection = connections[using]
+    if not is_enabled(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _refresh(using, ids, upsert):
+    ids = sorted(set(ids))
+    connection = connections[using]
+    if not ids or not is_enabled(connection):
+        return
+    # the lock is held until the end of the transaction: without one, it would be released before the upsert
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(_LOCK)
+        cursor.execute(upsert, [ids])
+
+
+def refresh_users(user_ids, using='default'):
+    _refresh(using, user_ids, _UPSERT_USERS.format(live=_live(_USERS_LIVE, 'WHERE u.id = ANY(%s)')))
+
+
+def refresh_groups(group_ids, using='default'):
+    _refresh(using, group_ids, _UPSERT_GROUPS.format(live=_live(_GROUPS_LIVE, 'WHERE g.id = ANY(%s)')))
+
+
+def refresh_all(using='default'):
+    _execute(using, _UPSERT_USERS.format(live=_live(_USERS_LIVE)))
+    _execute(using, _UPSERT_GROUPS.format(live=_live(_GROUPS_LIVE)))
+
+
+def stale(using='default'):
+    """ {'users': [ids], 'groups': [ids]} whose stored statistics don't match auth_user_groups """
+    result = {}
+    with connections[using].cursor() as cursor:
+        for name, sql, live in [('users', _STALE_USERS, _USERS_LIVE), ('groups', _STALE_GROUPS, _GROUPS_LIVE)]:
+            cursor.execute(sql.format(live=_live(live)))
+            result[name] = [row[0] for row in cursor.fetchall()]
+    return result
+
+
+# signal receivers, connected in QueriesConfig.ready()
+
+def user_saved(sender, instance, created, using, **kwargs):
+    if created:
+        refresh_users([instance.pk], using)
+
+
+def group_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    if created:
+        refresh_groups([instance.pk], using)
+    elif (update_fields is None or 'name' in update_fields) and is_enabled(connections[using]):
+        # possibly renamed: the group_names of its members, unless they already list its name (saved unchanged)
+        with connections[using].cursor() as cursor:
+            cursor.execute(_RENAMED_GROUP_MEMBERS, [instance.pk])
+            members = [row[0] for row in cursor.fetchall()]
+        refresh_users(members, using)
+
+
+def user_or_group_pre_delete(sender, instance, using, **kwargs):
+    # the database cascade removes the memberships without m2m_changed: remember who is on the other side
+    if is_enabled(connections[using]):
+        related = instance.groups if sender is User else instance.user_set
+        instance._queries_stats_related = list(related.values_list('pk', flat=True))
+
+
+def user_or_group_deleted(sender, instance, using, **kwargs):
+    related = getattr(instance, '_queries_stats_related', [])
+    if sender is User:
+        refresh_groups(related, using)
+    else:
+        refresh_users(related, using)
+
+
+def memberships_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    # instance is a user (reverse=False) or a group (reverse=True), pk_set the other side
+    if action == 'pre_clear':
+        if is_enabled(connections[using]):
+            related = instance.user_set if reverse else instance.groups
+            instance._queries_stats_cleared = list(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_queries_stats_cleared', [])
+    elif action not in ('post_add', 'post_remove'):
+        return
+    users, groups = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    refresh_users(users, using)
+    refresh_groups(groups, using)
@@ -0,0 +1,80 @@
+"""
+Incremental JSON encoding for queryset responses.
+
+`JsonResponse` needs the whole payload in memory before the first byte is sent. `StreamingJsonResponse`
+walks the payload instead and reads every QuerySet it finds with `QuerySet.iterator(chunk_size=...)`, which on
+PostgreSQL uses a server-side cursor, so memory stays flat regardless of the number of rows.
+
+The rows are read while the response is sent. Django 3.0's ASGI handler sends it from the event loop, where queries
+raise SynchronousOnlyOperation: under ASGI (`is_supported()`), views build the whole payload first instead.
+"""
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
+
+DEFAULT_CHUNK_SIZE = 2000  # rows fetched per round trip from the server-side cursor
+BUFFER_SIZE = 64 * 1024  # characters accumulated before handing a chunk to the WSGI server
+
+
+def is_supported(request):
+    """ whether a response to `request` may run queries while it is sent """
+    return not isinstance(request, ASGIRequest)
+
+
+def iter_json(value, chunk_size=None, encoder=DjangoJSONEncoder):
+    """
+    Yield the JSON encoding of `value` piece by piece.
+
+    dicts, lists and tuples are walked recursively; querysets are read with `iterator(chunk_size)` and any other
+    iterator (e.g. a generator) is encoded as a JSON array, one item at a time. Everything else is encoded as a whole.
+    """
+    chunk_size = chunk_size or getattr(settings, 'QUERIES_STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    dumps = encoder().encode
+
+    def _walk(item):
+        if isinstance(item, dict):
+            yield '{'
+            for i, (key, child) in enumerate(item.items()):
+                yield (', ' if i else '') + dumps(str(key)) + ': '
+                yield from _walk(child)
+            yield '}'
+        elif isinstance(item, QuerySet):
+            yield from _walk_array(item.iterator(chunk_size=chunk_size))
+        elif isinstance(item, (list, tuple)) or hasattr(item, '__next__'):
+            yield from _walk_array(item)
+        else:
+            yield dumps(item)
+
+    def _walk_array(items):
+        yield '['
+        for i, child in enumerate(items):
+            if i:
+                yield ', '
+            yield from _walk(child)
+        yield ']'
+
+    return _walk(value)
+
+
+def _buffered(pieces, size=BUFFER_SIZE):
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Same output as `JsonResponse(data)`, produced incrementally (see `iter_json`)
+    """
+
+    def __init__(self, data, chunk_size=None, encoder=DjangoJSONEncoder, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(_buffered(iter_json(data, chunk_size=chunk_size, encoder=encoder)), **kwargs)
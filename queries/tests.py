@@ -1,9 +1,42 @@
+import csv
+import http.server
+import io
 import json
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-from django.test import TestCase
+import psycopg2
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.utils import load_backend
+from django.http import HttpResponse, StreamingHttpResponse
+from django.forms import model_to_dict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.conf import settings
 import logging
 
+from queries import (
+    batching, bulk, cache, execution, explain, export, metrics, name_search, prepared, routers, sampling, serializers,
+    stats, views,
+)
+from queries.backends.postgresql_pool.base import close_pools
+from queries.backends.postgresql_pool.pool import ConnectionPool, PoolClosed, PoolTimeout
+from queries.middleware import ReplicaRoutingMiddleware
+from queries.models import GroupStats, UserStats
+
+# the ETag of the views with conditional GET reads the table versions on postgres (see conditional.py)
+VERSION_QUERIES = 1 if connection.vendor == 'postgresql' else 0
+
 
 class TestViews(TestCase):
 
@@ -38,36 +71,53 @@ class TestViews(TestCase):
         self.assertEqual(1, len(sqls))
 
     def test__first(self):
-        with self.assertNumQueries(1):
+        with self.assertNumQueries(1 + VERSION_QUERIES):
             response = self.client.get('/queries/first')
         self.assertEqual(200, response.status_code)
         data = response.json()
         self.assertEqual(2, len(data['users']))
 
     def test__and_operation(self):
-        with self.assertNumQueries(4):
+        # all querysets compile to the same SQL, only the first one hits the database
+        with self.assertNumQueries(1):
             response = self.client.get('/queries/and_operation')
         self.assertEqual(200, response.status_code)
+        self.assertEqual('3', response['X-Queries-Deduplicated'])
         data = response.json()
+        # the query is reported as executed, with quoted params
+        self.assertIn('"auth_user"."first_name" = \'John\'', data['qs1']['query'])
 
         self._assert_all_results_and_sqls_equal(data)
 
     def test__or_operation(self):
-        with self.assertNumQueries(2):
+        # all querysets compile to the same SQL, only the first one hits the database
+        with self.assertNumQueries(1):
             response = self.client.get('/queries/or_operation')
         self.assertEqual(200, response.status_code)
+        self.assertEqual('1', response['X-Queries-Deduplicated'])
         data = response.json()
 
         self._assert_all_results_and_sqls_equal(data)
 
     def test__not_equal(self):
-        with self.assertNumQueries(2):
+        # all querysets compile to the same SQL, only the first one hits the database
+        with self.assertNumQueries(1):
             response = self.client.get('/queries/not_equal')
         self.assertEqual(200, response.status_code)
+        self.assertEqual('1', response['X-Queries-Deduplicated'])
         data = response.json()
 
         self._assert_all_results_and_sqls_equal(data)
 
+    @override_settings(QUERIES_DEDUPLICATE=False)
+    def test__and_operation_without_deduplication(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/queries/and_operation')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('0', response['X-Queries-Deduplicated'])
+
+        self._assert_all_results_and_sqls_equal(response.json())
+
     def test__in_filtering(self):
         with self.assertNumQueries(2):
             response = self.client.get('/queries/in_filtering')
@@ -80,6 +130,44 @@ class TestViews(TestCase):
         self.assertCountEqual(data['qs']['data'], data['bulk']['data'].values())
         self.assertEqual(data['qs']['query'], data['bulk']['query'])
 
+    def test__bulk_lookup(self):
+        john, jane = User.objects.get(username='john.doe'), User.objects.get(username='jane.doe')
+        expected = self.client.get('/queries/in_filtering').json()
+
+        response = self.client.get('/queries/bulk_lookup', {'ids': f'{john.pk},{jane.pk},{john.pk},999999'})
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertCountEqual(['john.doe', 'jane.doe'], [user['username'] for user in data['bulk']['data']])
+        self.assertEqual(1, data['bulk']['chunks'])
+        if connection.vendor == 'postgresql':
+            self.assertIn(f'"auth_user"."id" = ANY(\'{{{john.pk},{jane.pk},999999}}\'::integer[])',
+                          data['bulk']['query'])
+
+        response = self.client.post('/queries/bulk_lookup', json.dumps({'ids': [1, 4, 7]}),
+                                    content_type='application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(expected['qs']['data'], data['bulk']['data'])
+
+        for bad_request in [self.client.get('/queries/bulk_lookup', {'ids': '1,x'}),
+                            self.client.post('/queries/bulk_lookup', '{"ids": 1}', content_type='application/json'),
+                            self.client.post('/queries/bulk_lookup', '{"ids": "123"}', content_type='application/json'),
+                            self.client.get('/queries/bulk_lookup', {'ids': f'1,{2 ** 63}'}),
+                            self.client.post('/queries/bulk_lookup', 'ids=1', content_type='text/plain')]:
+            self.assertEqual(400, bad_request.status_code)
+        if connection.vendor == 'postgresql':  # auth_user.id is an integer
+            self.assertEqual(400, self.client.get('/queries/bulk_lookup', {'ids': f'1,{2 ** 31}'}).status_code)
+
+    def test__in_bulk_array(self):
+        ids = list(User.objects.values_list('pk', flat=True)) + [999999]
+        expected = User.objects.in_bulk(ids)
+        with self.assertNumQueries(2):
+            # one query per chunk
+            self.assertEqual(expected, bulk.in_bulk_array(User.objects.all(), ids, chunk_size=2))
+        with self.assertNumQueries(0):
+            self.assertEqual({}, bulk.in_bulk_array(User.objects.all(), []))
+        self.assertEqual([], list(User.objects.filter(pk__any=[])))
+
     def test__is_null(self):
         with self.assertNumQueries(2):
             response = self.client.get('/queries/is_null')
@@ -98,11 +186,11 @@ class TestViews(TestCase):
         self.assertEqual(200, response.status_code)
         data = response.json()
 
-        self.assertIn("LIKE Jo%", data['startswith_qs']['query'])
+        self.assertIn("LIKE 'Jo%'", data['startswith_qs']['query'])
         self.assertEqual(1, len(data['startswith_qs']['data']))
-        self.assertIn("LIKE %ya", data['endswith_qs']['query'])
+        self.assertIn("LIKE '%ya", data['endswith_qs']['query'])
         self.assertEqual(0, len(data['endswith_qs']['data']))
-        self.assertIn("LIKE %oh%", data['contains_qs']['query'])
+        self.assertIn("LIKE '%oh%'", data['contains_qs']['query'])
         self.assertEqual(1, len(data['contains_qs']['data']))
         # self.assertIn("REGEXP ^D.e$", data['regex_qs']['query'])  # sqlite3
         self.assertEqual(2, len(data['regex_qs']['data']))
@@ -167,8 +255,20 @@ class TestViews(TestCase):
         self.assertIn('ORDER BY "auth_user"."date_joined" ASC, "auth_user"."first_name" DESC LIMIT 1', data['user_using_earliest']['query'])
         self.assertIn('ORDER BY "auth_user"."first_name" DESC LIMIT 1', data['user_using_latest']['query'])
 
+    def test__get_single_batched(self):
+        expected = self.client.get('/queries/get_single').json()
+        with self.assertNumQueries(1):
+            response = self.client.get('/queries/get_single', {'batch': 1})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual({name: value['data'] for name, value in expected.items()},
+                         {name: value['data'] for name, value in data.items()})
+        # the statement each lookup would send on its own
+        for name, value in expected.items():
+            self.assertEqual(value['query'], data[name]['query'])
+
     def test__joins(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(2 + VERSION_QUERIES):
             response = self.client.get('/queries/joins')
         self.assertEqual(200, response.status_code)
         data = response.json()
@@ -181,8 +281,43 @@ class TestViews(TestCase):
         self.assertIn('JOIN "auth_user_groups"', data['groups_with_users_qs']['query'])
         self.assertIn('JOIN "auth_user"', data['groups_with_users_qs']['query'])
 
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'nested mode is built with postgres json functions')
+    def test__joins_nested(self):
+        flat = self.client.get('/queries/joins').json()
+        with self.assertNumQueries(2 + VERSION_QUERIES):
+            response = self.client.get('/queries/joins', {'nested': 1})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+
+        self.assertIn('JSONB_AGG("auth_group"."name")', data['users_with_groups_qs']['query'])
+        expected_users = {}
+        for row in flat['users_with_group_name_qs']['data']:
+            user = expected_users.setdefault(row['username'], {
+                'username': row['username'], 'first_name': row['first_name'], 'last_name': row['last_name'],
+                'groups': [],
+            })
+            if row['groups__name'] is not None:
+                user['groups'].append(row['groups__name'])
+        users = {user['username']: {**user, 'groups': sorted(user['groups'])}
+                 for user in data['users_with_groups_qs']['data']}
+        self.assertEqual({name: {**user, 'groups': sorted(user['groups'])} for name, user in expected_users.items()},
+                         users)
+
+        expected_groups = {}
+        for row in flat['groups_with_users_qs']['data']:
+            usernames = expected_groups.setdefault(row['name'], [])
+            if row['user__username'] is not None:
+                usernames.append(row['user__username'])
+        self.assertEqual(
+            {name: sorted(usernames) for name, usernames in expected_groups.items()},
+            {group['name']: sorted(group['users']) for group in data['groups_with_users_qs']['data']}
+        )
+
+        streamed = self.client.get('/queries/joins', {'nested': 1, 'stream': 1})
+        self.assertEqual(data, json.loads(b''.join(streamed.streaming_content)))
+
     def test__annotations(self):
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(3 + VERSION_QUERIES):
             response = self.client.get('/queries/annotations')
         self.assertEqual(200, response.status_code)
         data = response.json()
@@ -196,5 +331,1111 @@ class TestViews(TestCase):
         self.assertIn('GROUP BY "auth_user"."id"', data['users_with_group_count_qs']['query'])
 
         self.assertEqual(2, len(data['users_with_group_array_qs']['data']))
-        self.assertIn('ARRAY_AGG("auth_group"."name" )', data['users_with_group_array_qs']['query'])
+        self.assertIn('ARRAY_AGG("auth_group"."name" ORDER BY "auth_group"."name")',
+                      data['users_with_group_array_qs']['query'])
         self.assertIn('GROUP BY "auth_user"."id"', data['users_with_group_array_qs']['query'])
+
+    def test__stream(self):
+        for url in ['/queries/first', '/queries/and_operation', '/queries/joins']:
+            expected = self.client.get(url).json()
+            response = self.client.get(url, {'stream': 1})
+            self.assertEqual(200, response.status_code)
+            self.assertTrue(response.streaming)
+            self.assertEqual(expected, json.loads(b''.join(response.streaming_content)))
+
+    def test__compiled_query_iterator(self):
+        users = User.objects.order_by('pk')
+        for qs in [users.values(), users.values_list('username', 'pk'), users.values_list('username', flat=True),
+                   users.all(), users.filter(pk__in=[])]:
+            expected = list(qs)
+            with self.subTest(qs=qs.query), self.assertNumQueries(1 if expected else 0):
+                self.assertEqual(expected, list(execution.CompiledQuery(qs).iterator(chunk_size=1)))
+
+    def test__keyset(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/queries/keyset', {'size': 1})
+        self.assertEqual(200, response.status_code)
+        first_page = response.json()
+        self.assertEqual(1, len(first_page['page_qs']['data']))
+        self.assertIn('ORDER BY "auth_user"."date_joined" ASC, "auth_user"."id" ASC', first_page['page_qs']['query'])
+        self.assertIsNotNone(first_page['next_cursor'])
+
+        response = self.client.get('/queries/keyset', {'size': 1, 'cursor': first_page['next_cursor']})
+        self.assertEqual(200, response.status_code)
+        second_page = response.json()
+        self.assertEqual(1, len(second_page['page_qs']['data']))
+        self.assertIsNone(second_page['next_cursor'])
+
+        all_users = self.client.get('/queries/keyset', {'size': 10}).json()
+        self.assertEqual(
+            all_users['page_qs']['data'],
+            first_page['page_qs']['data'] + second_page['page_qs']['data']
+        )
+        self.assertIsNone(all_users['next_cursor'])
+
+    def test__keyset_bad_params(self):
+        response = self.client.get('/queries/keyset', {'cursor': 'not-a-cursor'})
+        self.assertEqual(400, response.status_code)
+        for size in [0, settings.QUERIES_KEYSET_MAX_SIZE + 1]:
+            with self.subTest(size=size):
+                self.assertEqual(400, self.client.get('/queries/keyset', {'size': size}).status_code)
+        with self.assertRaises(CommandError):
+            call_command('bench_pagination', '--depths', '0', '10', stdout=StringIO())
+
+    def test__random_sample(self):
+        response = self.client.get('/queries/random_sample', {'n': 1, 'seed': 42})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual(1, len(data['sample']['data']))
+        self.assertNotIn('RANDOM()', data['sample']['query'])
+        # reproducible from the seed
+        self.assertEqual(data, self.client.get('/queries/random_sample', {'n': 1, 'seed': 42}).json())
+
+        # asking for more rows than there are returns all of them
+        data = self.client.get('/queries/random_sample', {'n': 5}).json()
+        self.assertCountEqual(['john.doe', 'jane.doe'], [user['username'] for user in data['sample']['data']])
+
+        with override_settings(QUERIES_RANDOM_SAMPLE_MAX=4):
+            self.assertEqual(400, self.client.get('/queries/random_sample', {'n': 5}).status_code)
+
+    def test__random_sample_of_sparse_pks(self):
+        # the probes between the pks of the fixtures and this one hardly ever find a row
+        User.objects.create(pk=10 ** 7, username='far.away')
+        queryset = User.objects.exclude(username='john.doe')
+        with CaptureQueriesContext(connection) as ctx:
+            sample = sampling.random_sample(queryset, 2, seed=1)
+        self.assertCountEqual(['jane.doe', 'far.away'], [user.username for user in sample])
+        self.assertEqual(sample, sampling.random_sample(queryset, 2, seed=1))
+        self.assertFalse(any('RANDOM' in query['sql'].upper() for query in ctx.captured_queries))
+
+    def test__search(self):
+        for match, pattern in [('startswith', 'Ja'), ('endswith', 'ane'), ('contains', 'ane'), ('regex', '^J.ne$')]:
+            with self.assertNumQueries(1):
+                response = self.client.get('/queries/search', {'field': 'first_name', 'match': match, 'q': pattern})
+            self.assertEqual(200, response.status_code)
+            data = response.json()
+            self.assertEqual(['jane.doe'], [user['username'] for user in data['search_qs']['data']])
+
+        data = self.client.get('/queries/search', {'field': 'last_name', 'match': 'endswith', 'q': 'oe'}).json()
+        self.assertIn("REVERSE(\"auth_user\".\"last_name\")", data['search_qs']['query'])
+        self.assertIn("LIKE 'eo%'", data['search_qs']['query'])
+        self.assertEqual(2, len(data['search_qs']['data']))
+
+        # LIKE wildcards in the pattern are matched literally
+        data = self.client.get('/queries/search', {'match': 'startswith', 'q': 'J%'}).json()
+        self.assertEqual([], data['search_qs']['data'])
+
+    def test__search_bad_params(self):
+        for params in [
+            {'field': 'password', 'q': 'abc'},
+            {'match': 'iexact', 'q': 'abc'},
+            {'match': 'contains', 'q': 'oh'},  # too short for a trigram index
+            {'match': 'regex', 'q': '(unclosed'},
+            {'match': 'startswith', 'q': ''},
+            {'q': 'abc', 'size': 0},
+        ]:
+            with self.subTest(**params):
+                self.assertEqual(400, self.client.get('/queries/search', params).status_code)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'postgres regexes are not python regexes')
+    def test__search_regex_rejected_by_postgres(self):
+        # valid for re.compile(), not for postgres. Streamed or not, the error is known before the response starts
+        for stream in ['', '1']:
+            with self.subTest(stream=stream), transaction.atomic():
+                response = self.client.get('/queries/search', {'match': 'regex', 'q': '(?P<x>abc)', 'stream': stream})
+                self.assertEqual(400, response.status_code)
+                self.assertIn('invalid regular expression', response.json()['error'])
+                transaction.set_rollback(True)
+
+
+class TestSingleObjectBatch(TestCase):
+
+    def test__same_results_as_the_queryset_methods(self):
+        batch = batching.SingleObjectBatch()
+        batch.first('first', User.objects.filter(username='nobody'))
+        batch.last('last', User.objects.all())
+        batch.get('get', User.objects.all(), username='jane.doe')
+        batch.first('none', User.objects.filter(pk__in=[]))
+        with self.assertNumQueries(1):
+            results = batch.fetch()
+
+        self.assertEqual((None, User.objects.last(), User.objects.get(username='jane.doe')),
+                         tuple(results[name][0] for name in ('first', 'last', 'get')))
+        self.assertEqual((None, None), results['none'])  # can't match anything: not sent to the database
+
+    def test__errors(self):
+        for lookup, error in [
+            (lambda batch: batch.get('get', User.objects.all()), User.MultipleObjectsReturned),
+            (lambda batch: batch.get('get', User.objects.all(), username='nobody'), User.DoesNotExist),
+            (lambda batch: batch.latest('latest', User.objects.filter(username='nobody'), 'pk'), User.DoesNotExist),
+            (lambda batch: batch.limit('limit', User.objects.all(), 10), IndexError),
+        ]:
+            batch = batching.SingleObjectBatch()
+            lookup(batch)
+            with self.subTest(error=error.__name__), self.assertRaises(error):
+                batch.fetch()
+
+        batch = batching.SingleObjectBatch()
+        batch.first('user', User.objects.all())
+        batch.first('group', Group.objects.all())
+        with self.assertRaises(ValueError):
+            batch.fetch()
+
+
+class TestRowSerializer(TestCase):
+
+    def test__same_output_as_model_to_dict(self):
+        User.objects.filter(username='john.doe').update(last_login=timezone.now())
+        for model, options in [
+            (User, {'exclude': ('groups', 'user_permissions')}),
+            (User, {'fields': ('username', 'date_joined', 'last_login'), 'exclude': ('username',)}),
+            (Group, {'exclude': ('permissions',)}),
+        ]:
+            with self.subTest(model=model.__name__, **options):
+                serializer = serializers.serializer_for(model, **options)
+                instances = model.objects.order_by('pk')
+                expected = [model_to_dict(instance, **options) for instance in instances]
+                self.assertEqual(expected, [serializer(row) for row in serializer.values_list(instances)])
+                self.assertEqual(expected, [serializer.from_instance(instance) for instance in instances])
+        self.assertIs(serializers.serializer_for(Group, exclude=('permissions',)), serializer)
+
+    def test__many_to_many_fields_must_be_excluded(self):
+        with self.assertRaises(ValueError):
+            serializers.RowSerializer(User, exclude=('groups',))
+
+
+@override_settings(QUERIES_RESULT_CACHE=True)
+class TestResultCache(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        caches[settings.QUERIES_RESULT_CACHE_ALIAS].clear()
+        caches[settings.QUERIES_RESULT_CACHE_VERSIONS_ALIAS].clear()
+
+    def test__repeated_requests_hit_the_cache(self):
+        with self.assertNumQueries(4):
+            first = self.client.get('/queries/comparison')
+        self.assertEqual('0', first['X-Queries-Cache-Hits'])
+        with self.assertNumQueries(0):
+            second = self.client.get('/queries/comparison')
+        self.assertEqual('4', second['X-Queries-Cache-Hits'])
+        self.assertEqual(first.json(), second.json())
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        stats = self.client.get('/queries/cache_stats').json()
+        self.assertTrue(stats['enabled'])
+        self.assertGreaterEqual(stats['hits'], 4)
+
+    def test__saving_a_user_invalidates(self):
+        self.client.get('/queries/like')
+        user = User.objects.get(username='john.doe')
+        user.first_name = 'Johanna'
+        user.save()
+        with self.assertNumQueries(4):
+            response = self.client.get('/queries/like')
+        self.assertEqual('Johanna', response.json()['startswith_qs']['data'][0]['first_name'])
+
+    def test__membership_changes_invalidate_joins_only(self):
+        self.client.get('/queries/joins')
+        self.client.get('/queries/first')
+        User.objects.get(username='john.doe').groups.add(Group.objects.get(name='empty-group'))
+
+        with self.assertNumQueries(2 + VERSION_QUERIES):
+            response = self.client.get('/queries/joins')
+        self.assertEqual(5, len(response.json()['users_with_group_name_qs']['data']))
+        # auth_user alone didn't change
+        with self.assertNumQueries(VERSION_QUERIES):
+            self.client.get('/queries/first')
+
+    def test__uncommitted_rows_are_not_cached(self):
+        # the test transaction is still open: the rows of auth_user may be rolled back
+        User.objects.filter(username='john.doe').get().save()
+        for _ in range(2):
+            with self.assertNumQueries(4):
+                self.client.get('/queries/comparison')
+
+    def test__versions_in_local_memory_are_reported(self):
+        self.assertEqual([], cache.check_versions_cache(None))
+        with override_settings(QUERIES_RESULT_CACHE_VERSIONS_ALIAS='queries'):
+            self.assertEqual(['queries.W001'], [warning.id for warning in cache.check_versions_cache(None)])
+
+
+@override_settings(QUERIES_RESULT_CACHE=True)
+class TestResultCacheCommits(TransactionTestCase):
+    serialized_rollback = True
+
+    def test__versions_change_again_on_commit(self):
+        with transaction.atomic():
+            User.objects.get(username='john.doe').save()
+            during = cache.table_versions(['auth_user'])
+        self.assertNotEqual(during, cache.table_versions(['auth_user']))
+        # committed: cached again
+        self.client.get('/queries/comparison')
+        with self.assertNumQueries(0):
+            self.client.get('/queries/comparison')
+
+
+class TestConditionalGet(TestCase):
+
+    def _etag(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(200, response.status_code)
+        return response['ETag']
+
+    def test__not_modified(self):
+        etag = self._etag('/queries/first')
+        with self.assertNumQueries(VERSION_QUERIES):
+            response = self.client.get('/queries/first', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+        self.assertNotEqual(etag, self._etag('/queries/first', stream=1))
+        with override_settings(QUERIES_CONDITIONAL_GET=False):
+            self.assertNotIn('ETag', self.client.get('/queries/first'))
+
+    def test__etags_follow_the_tables(self):
+        # annotations aggregates with ARRAY_AGG, a postgres function
+        views = ['first', 'joins', 'annotations'] if connection.vendor == 'postgresql' else ['first', 'joins']
+        first, *others = [self._etag(f'/queries/{view}') for view in views]
+        User.objects.get(username='john.doe').groups.add(Group.objects.get(name='empty-group'))
+        self.assertEqual(first, self._etag('/queries/first'))
+        for view, etag in zip(views[1:], others):
+            self.assertNotEqual(etag, self._etag(f'/queries/{view}'))
+
+        user = User.objects.get(username='jane.doe')
+        user.first_name = 'Janet'
+        user.save()
+        self.assertNotEqual(first, self._etag('/queries/first'))
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'the version triggers need postgres')
+    def test__writes_without_signals(self):
+        etag = self._etag('/queries/first')
+        User.objects.filter(username='jane.doe').update(first_name='Janet')
+        self.assertNotEqual(etag, self._etag('/queries/first'))
+
+
+@override_settings(QUERIES_PREPARED_STATEMENTS=True)
+class TestPreparedStatements(TestCase):
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'prepared statements need postgres')
+    def test__statements_are_prepared_once_per_connection(self):
+        with override_settings(QUERIES_PREPARED_STATEMENTS=False):
+            expected = self.client.get('/queries/comparison').json()
+
+        # PREPARE (in a savepoint) + EXECUTE for each of the 4 statements
+        response = self.client.get('/queries/comparison')
+        self.assertEqual(expected, response.json())
+        self.assertEqual(4, len(prepared.statements(connection)))
+
+        # EXECUTE only
+        with self.assertNumQueries(4):
+            response = self.client.get('/queries/comparison')
+        self.assertEqual(expected, response.json())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'prepared statements need postgres')
+    def test__sessions_reset_or_shared_by_someone_else(self):
+        sql, params = 'SELECT id FROM auth_user WHERE id = %s', [1]
+        with connection.cursor() as cursor:
+            prepared.execute(connection, cursor, sql, params)
+        (name, _), = prepared.statements(connection).items()
+
+        # a connection handed over without its statements, as by a pool on check-in: tracked as empty again
+        with connection.cursor() as cursor:
+            cursor.execute(f'DEALLOCATE {name}')
+        prepared.connection_created(sender=type(connection), connection=connection)
+        self.assertEqual({}, prepared.statements(connection))
+        with connection.cursor() as cursor:
+            prepared.execute(connection, cursor, sql, params)
+            self.assertEqual(list(User.objects.filter(id=1).values_list('id')), cursor.fetchall())
+
+        # a connection handed over with its statements, unknown to us: prepared again rather than given up
+        prepared.connection_created(sender=type(connection), connection=connection)
+        with connection.cursor() as cursor:
+            prepared.execute(connection, cursor, sql, params)
+        self.assertEqual([name], list(prepared.statements(connection)))
+
+    def test__placeholders(self):
+        self.assertEqual(
+            "SELECT * FROM t WHERE a = $1 AND b LIKE $2 AND c LIKE 'x%'",
+            prepared.to_server_placeholders("SELECT * FROM t WHERE a = %s AND b LIKE %s AND c LIKE 'x%%'")
+        )
+
+
+class PlannerTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            # the test table is tiny: make the planner prefer any usable index, for the rest of the test's transaction
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_sort = off')
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the search indexes need postgres')
+class TestSearchIndexes(PlannerTestCase):
+
+    def test__like_view_uses_trigram_indexes(self):
+        self.assertIn('queries_user_first_name_trgm', User.objects.filter(first_name__startswith='Jo').explain())
+        self.assertIn('queries_user_first_name_trgm', User.objects.filter(first_name__contains='ohn').explain())
+        self.assertIn('queries_user_last_name_trgm', User.objects.filter(last_name__regex=r'^D.e$').explain())
+
+    def test__search_uses_indexes(self):
+        for field in name_search.FIELDS:
+            for match, index in [
+                ('startswith', f'queries_user_{field}_trgm'),
+                ('contains', f'queries_user_{field}_trgm'),
+                ('regex', f'queries_user_{field}_trgm'),
+                ('endswith', f'queries_user_{field}_reverse'),
+            ]:
+                with self.subTest(field=field, match=match):
+                    plan = name_search.search(User.objects.all(), field, match, 'Doe').explain()
+                    self.assertIn(index, plan)
+                    self.assertNotIn('Seq Scan', plan)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the access path indexes need postgres')
+class TestAccessPathIndexes(PlannerTestCase):
+
+    def test__range_and_orderings_use_indexes(self):
+        today = timezone.now()
+        # any btree leading with date_joined serves a range of it, or an ordering by it alone
+        date_joined_btrees = (
+            'queries_user_date_joined_id', 'queries_user_date_joined_last_name', 'queries_user_date_joined_first_name'
+        )
+        for name, queryset, indexes in [
+            # between
+            ('between_qs', User.objects.filter(date_joined__range=[today - timedelta(days=14), today]),
+             date_joined_btrees + ('queries_user_date_joined_brin',)),
+            # orderby
+            ('by_date_joined_qs', User.objects.order_by('date_joined'), date_joined_btrees),
+            ('by_multiple_qs', User.objects.order_by('date_joined', '-last_name'),
+             ('queries_user_date_joined_last_name',)),
+            ('by_reverse_date_joined_qs', User.objects.order_by('date_joined').reverse(), date_joined_btrees),
+            # get_single
+            ('user_using_first', User.objects.order_by('date_joined', '-first_name')[:1],
+             ('queries_user_date_joined_first_name',)),
+            ('user_using_last', User.objects.order_by('-first_name')[:1], ('queries_user_first_name',)),
+            ('user_using_earliest', User.objects.order_by('date_joined', '-first_name')[:1],
+             ('queries_user_date_joined_first_name',)),
+            ('user_using_latest', User.objects.order_by('-first_name')[:1], ('queries_user_first_name',)),
+        ]:
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertTrue(any(index in plan for index in indexes), plan)
+                self.assertNotIn('Seq Scan', plan)
+                self.assertNotIn('Sort', plan)
+
+    def test__brin_index_serves_date_ranges(self):
+        with connection.cursor() as cursor:
+            # without the btrees on date_joined (rolled back with the test's transaction)
+            for index in ('queries_user_date_joined_id', 'queries_user_date_joined_last_name',
+                          'queries_user_date_joined_first_name'):
+                cursor.execute(f'DROP INDEX {index}')
+        today = timezone.now()
+        plan = User.objects.filter(date_joined__range=[today - timedelta(days=14), today]).explain()
+        self.assertIn('queries_user_date_joined_brin', plan)
+
+
+class TestExplain(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    # views that don't build their response with _querysets_response
+    OTHER_VIEWS = [
+        ('/queries/first', {}), ('/queries/in_filtering', {}), ('/queries/get_single', {}),
+        ('/queries/get_single', {'batch': 1}), ('/queries/keyset', {}), ('/queries/random_sample', {}),
+    ]
+
+    def test__restricted_to_staff(self):
+        self.assertEqual(403, self.client.get('/queries/like', {'explain': 1}).status_code)
+        self.client.force_login(User.objects.get(username='john.doe'))
+        for url, params in [('/queries/like', {})] + self.OTHER_VIEWS:
+            with self.subTest(url=url, **params):
+                self.assertEqual(403, self.client.get(url, {'explain': 1, **params}).status_code)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'explain needs postgres')
+    @override_settings(QUERIES_EXPLAIN_SEQ_SCAN_ROWS=1)
+    def test__plans_next_to_data_and_query(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE auth_user')
+        self.client.force_login(self.staff)
+        with self.assertLogs('queries.explain', 'WARNING'):
+            response = self.client.get('/queries/between', {'explain': 1})
+        self.assertEqual(200, response.status_code)
+        for name, entry in response.json().items():
+            with self.subTest(name):
+                self.assertEqual({'data', 'query', 'explain'}, set(entry))
+                explained = entry['explain']
+                self.assertIn('Node Type', explained['plan'])
+                self.assertGreater(explained['execution_ms'], 0)
+                self.assertIn('shared_hit', explained['buffers'])
+                # a few rows: the planner reads the whole table
+                self.assertEqual('auth_user', explained['seq_scans'][0]['table'])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'explain needs postgres')
+    def test__views_without_querysets_response(self):
+        self.client.force_login(self.staff)
+        for url, params in self.OTHER_VIEWS:
+            with self.subTest(url=url, **params):
+                data = self.client.get(url, {'explain': 1, **params}).json()
+                entries = [data] if url == '/queries/first' else [
+                    entry for entry in data.values() if isinstance(entry, dict)
+                ]
+                for entry in entries:
+                    plans = entry['explain'] if isinstance(entry['explain'], list) else [entry['explain']]
+                    self.assertTrue(plans)
+                    for plan in plans:
+                        self.assertIn('Node Type', plan['plan'])
+
+    def test__other_databases(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertTrue(explain.is_supported(['default']))
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            self.assertFalse(explain.is_supported(['default']))
+
+        self.client.force_login(self.staff)
+        with mock.patch('queries.explain.is_supported', return_value=False):
+            for url, params in [('/queries/like', {})] + self.OTHER_VIEWS:
+                with self.subTest(url=url, **params):
+                    response = self.client.get(url, {'explain': 1, **params})
+                    self.assertEqual(400, response.status_code)
+                    self.assertEqual({'error': 'explain needs postgres'}, response.json())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the connection pool is for postgres')
+class TestConnectionPool(TestCase):
+
+    def _pool(self, **kwargs):
+        pool = ConnectionPool(lambda: psycopg2.connect(**connection.get_connection_params()), **kwargs)
+        self.addCleanup(pool.closeall)
+        return pool
+
+    def test__checkout_reuse_and_timeout(self):
+        pool = self._pool(min_size=0, max_size=2, timeout=0.1)
+        first, second = pool.getconn(), pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+        pool.putconn(first)
+        self.assertIs(first, pool.getconn())
+        self.assertEqual({'created': 2, 'timeouts': 1, 'in_use': 2}, {
+            key: value for key, value in pool.stats().items() if key in ('created', 'timeouts', 'in_use')
+        })
+        pool.putconn(first)
+        pool.putconn(second)
+
+    def test__broken_connections_are_discarded(self):
+        pool = self._pool(min_size=0, max_size=1, check_after=0)
+        broken = pool.getconn()
+        pool.putconn(broken)
+        broken.close()  # e.g. the server went away while it was idle
+        replacement = pool.getconn()
+        self.assertIsNot(broken, replacement)
+        self.assertEqual(1, pool.stats()['failed_checks'])
+
+        # returned in the middle of a transaction: rolled back and kept
+        with replacement.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.putconn(replacement)
+        self.assertIs(replacement, pool.getconn())
+
+    def test__closed_pool(self):
+        pool = self._pool(min_size=0, max_size=2)
+        checked_out = pool.getconn()
+        pool.closeall()
+        with self.assertRaises(PoolClosed):
+            pool.getconn()
+        pool.putconn(checked_out)
+        self.assertTrue(checked_out.closed)
+        self.assertEqual(0, pool.stats()['size'])
+
+    def _backend(self, **pool_settings):
+        """ a connection of the pooled backend to the test database, in a pool of its own """
+        settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'queries.backends.postgresql_pool',
+            # another application_name gives other connection parameters, hence another pool
+            'OPTIONS': {**connection.settings_dict['OPTIONS'], 'application_name': self.id()[-63:]},
+            'POOL': pool_settings,
+        }
+        pooled = load_backend('queries.backends.postgresql_pool').DatabaseWrapper(settings_dict, 'pooled')
+        self.addCleanup(close_pools)
+        self.addCleanup(pooled.close)
+        return pooled
+
+    @staticmethod
+    def _wait_for_stats(pool, **expected):
+        deadline = time.monotonic() + 5
+        while True:
+            stats = {key: value for key, value in pool.stats().items() if key in expected}
+            if stats == expected or time.monotonic() > deadline:
+                return stats
+            time.sleep(0.01)
+
+    def test__sessions_are_reset_on_checkin(self):
+        pooled = self._backend(MIN_SIZE=0, MAX_SIZE=1)
+        with pooled.cursor() as cursor:
+            cursor.execute("SET statement_timeout = '1234ms'")
+            cursor.execute('CREATE TEMPORARY TABLE pool_leftover (id int)')
+            cursor.execute('PREPARE pool_leftover AS SELECT 1')
+        raw = pooled.connection
+        pooled.close()
+
+        with pooled.cursor() as cursor:
+            self.assertIs(raw, pooled.connection)  # the same server session
+            cursor.execute('SHOW statement_timeout')
+            self.assertNotEqual('1234ms', cursor.fetchone()[0])
+            cursor.execute("SELECT to_regclass('pg_temp.pool_leftover')")
+            self.assertIsNone(cursor.fetchone()[0])
+            cursor.execute('SELECT count(*) FROM pg_prepared_statements')
+            self.assertEqual(0, cursor.fetchone()[0])
+
+    def test__test_database_created_and_destroyed(self):
+        pooled = self._backend(MIN_SIZE=2, MAINTENANCE_INTERVAL=0.05)
+        name = connection.settings_dict['NAME'] + '_pooled'
+        pooled.settings_dict['TEST'] = {**pooled.settings_dict['TEST'], 'NAME': name}
+        self.assertEqual(name, pooled.creation._create_test_db(verbosity=0, autoclobber=True, keepdb=False))
+        pooled.settings_dict['NAME'] = name
+
+        pooled.ensure_connection()
+        pool = pooled._pool
+        pooled.close()
+        self.assertEqual({'size': 2}, self._wait_for_stats(pool, size=2))
+        # the connections the pool keeps open would make postgres refuse the DROP DATABASE
+        pooled.creation.destroy_test_db(verbosity=0)
+        self.assertEqual(0, pool.stats()['size'])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pg_database WHERE datname = %s', [name])
+            self.assertEqual(0, cursor.fetchone()[0])
+
+    def test__maintenance_fills_min_size_and_reaps_idle_connections(self):
+        pooled = self._backend(MIN_SIZE=2, MAX_SIZE=4, MAX_IDLE=0.2, MAINTENANCE_INTERVAL=0.05)
+        pooled.ensure_connection()
+        pool = pooled._pool
+        pooled.close()
+        # opened in the background, before any request needed them
+        self.assertEqual({'size': 2, 'idle': 2}, self._wait_for_stats(pool, size=2, idle=2))
+
+        others = [self._backend(MIN_SIZE=2, MAX_SIZE=4, MAX_IDLE=0.2, MAINTENANCE_INTERVAL=0.05) for _ in range(4)]
+        for other in others:
+            other.ensure_connection()
+        self.assertEqual({'size': 4, 'in_use': 4}, self._wait_for_stats(pool, size=4, in_use=4))
+        for other in others:
+            other.close()
+        # without checkouts, the ones idle for more than MAX_IDLE are closed down to MIN_SIZE
+        self.assertEqual({'size': 2, 'idle': 2}, self._wait_for_stats(pool, size=2, idle=2))
+        self.assertEqual(2, pool.stats()['reaped'])
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        metrics.registry.clear()
+
+    def test__restricted_to_staff(self):
+        for url in ['/queries/metrics', '/queries/cache_stats']:
+            with self.subTest(url):
+                self.assertEqual(403, self.client.get(url).status_code)
+        self.client.force_login(User.objects.get(username='john.doe'))
+        for url in ['/queries/metrics', '/queries/cache_stats']:
+            with self.subTest(url):
+                self.assertEqual(403, self.client.get(url).status_code)
+
+    def test__metrics_per_route(self):
+        for _ in range(3):
+            response = self.client.get('/queries/comparison')
+            self.assertEqual('4', response['X-Queries-Count'])
+        response = self.client.get('/queries/first', {'stream': 1})
+        body = b''.join(response.streaming_content)
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        data = self.client.get('/queries/metrics').json()
+        comparison = data['queries/comparison']
+        self.assertEqual(3, comparison['queries']['count'])
+        self.assertEqual(4, comparison['queries']['p99'])
+        self.assertGreater(comparison['db_ms']['p50'], 0)
+        self.assertGreater(comparison['serialize_ms']['p50'], 0)
+        for key in ['p50', 'p95', 'p99']:
+            self.assertIn(key, comparison['latency_ms'])
+
+        first = data['queries/first']
+        self.assertEqual(1 + VERSION_QUERIES, first['queries']['p50'])
+        self.assertEqual(len(body), first['response_bytes']['p50'])
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profile_settings = override_settings(QUERIES_PROFILE_DIR=directory.name, QUERIES_PROFILE_KEEP=2)
+        profile_settings.enable()
+        self.addCleanup(profile_settings.disable)
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    def test__profiles_on_request_and_by_sampling(self):
+        self.assertNotIn('X-Queries-Profile', self.client.get('/queries/comparison', {'profile': 1}))  # not staff
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Queries-Profile', self.client.get('/queries/comparison'))
+
+        response = self.client.get('/queries/comparison', {'profile': 1})
+        profile_id = response['X-Queries-Profile']
+        summary, = self.client.get('/queries/profiles').json()['profiles']
+        self.assertEqual(profile_id, summary['id'])
+        self.assertEqual('/queries/comparison?profile=1', summary['path'])
+        self.assertEqual(int(response['X-Queries-Count']), summary['queries'])  # with the session and user
+        self.assertGreater(summary['phases_ms']['sql'], 0)
+        self.assertGreater(summary['phases_ms']['serialize'], 0)
+        self.assertAlmostEqual(summary['profiled_ms'], sum(summary['phases_ms'].values()), places=3)
+
+        report = self.client.get(f'/queries/profiles/{profile_id}')
+        self.assertIn('function calls', report.content.decode())
+        self.assertEqual(200, self.client.get(f'/queries/profiles/{profile_id}', {'sort': 'time'}).status_code)
+        self.assertEqual(400, self.client.get(f'/queries/profiles/{profile_id}', {'sort': 'tottime;'}).status_code)
+        dump = self.client.get(f'/queries/profiles/{profile_id}', {'format': 'prof'})
+        self.assertGreater(len(b''.join(dump.streaming_content)), 0)
+
+        with override_settings(QUERIES_PROFILE_SAMPLE_RATE=1):
+            self.client.get('/queries/first', {'stream': 1})  # not consumed: not saved yet
+            b''.join(self.client.get('/queries/first', {'stream': 1}).streaming_content)
+            self.client.get('/queries/between')
+        # the ring buffer keeps the latest 2
+        paths = [summary['path'] for summary in self.client.get('/queries/profiles').json()['profiles']]
+        self.assertEqual(['/queries/between', '/queries/first?stream=1'], paths)
+
+    def test__index_links_the_listing_only(self):
+        urls = self.client.get('/queries/').context['urls']
+        self.assertIn('/queries/profiles', urls)
+        self.assertEqual([], [url for url in urls if '%(' in url])
+
+    def test__restricted_to_staff(self):
+        self.assertEqual(403, self.client.get('/queries/profiles').status_code)
+        self.client.force_login(self.staff)
+        self.assertEqual(404, self.client.get('/queries/profiles/123-4').status_code)
+        self.assertEqual(404, self.client.get('/queries/profiles/..%2Fpasswd').status_code)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the precomputed statistics need postgres')
+class TestPrecomputedStats(TestCase):
+
+    def _annotations(self, **params):
+        data = self.client.get('/queries/annotations', params).json()
+        return (
+            {row['name']: row['user_count'] for row in data['groups_with_user_count_qs']['data']},
+            {row['username']: row['group_count'] for row in data['users_with_group_count_qs']['data']},
+            {row['username']: row['group_names'] for row in data['users_with_group_array_qs']['data']},
+        )
+
+    def _assert_consistent(self):
+        self.assertEqual({'users': [], 'groups': []}, stats.stale())
+        self.assertEqual(self._annotations(), self._annotations(precomputed=1))
+
+    def test__precomputed_annotations_match_live(self):
+        self._assert_consistent()
+        with self.assertNumQueries(3 + VERSION_QUERIES):
+            response = self.client.get('/queries/annotations', {'precomputed': 1})
+        self.assertNotIn('GROUP BY', response.json()['groups_with_user_count_qs']['query'])
+
+    def test__users_without_groups_and_missing_rows(self):
+        User.objects.create(username='no.groups')
+        self._assert_consistent()
+        self.assertEqual([], self._annotations()[2]['no.groups'])
+
+        # rows not computed yet read as no members and no groups rather than null
+        UserStats.objects.all().delete()
+        GroupStats.objects.all().delete()
+        groups, users, group_names = self._annotations(precomputed=1)
+        self.assertEqual(dict.fromkeys(groups, 0), groups)
+        self.assertEqual(dict.fromkeys(users, 0), users)
+        self.assertEqual(dict.fromkeys(group_names, []), group_names)
+
+    def test__stats_follow_changes(self):
+        john = User.objects.get(username='john.doe')
+        empty_group = Group.objects.get(name='empty-group')
+        john.groups.add(empty_group)
+        self._assert_consistent()
+        empty_group.user_set.remove(john)
+        self._assert_consistent()
+        john.groups.clear()
+        self._assert_consistent()
+
+        group = Group.objects.create(name='new-group')
+        user = User.objects.create(username='new.user')
+        group.user_set.add(user, User.objects.get(username='jane.doe'))
+        self._assert_consistent()
+        group.name = 'a-renamed-group'
+        group.save()
+        self._assert_consistent()
+        user.delete()
+        self._assert_consistent()
+        group.delete()
+        self._assert_consistent()
+
+    def test__saving_an_unchanged_group_keeps_the_stats_of_its_members(self):
+        def user_stats_versions():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT user_id, xmin::text FROM queries_userstats')
+                return dict(cursor.fetchall())
+
+        group = Group.objects.get(name='all-users')
+        before = user_stats_versions()
+        group.save()
+        self.assertEqual(before, user_stats_versions())
+        group.name = 'a-renamed-group'
+        group.save()
+        self.assertNotEqual(before, user_stats_versions())
+        self._assert_consistent()
+
+    def test__check_stats(self):
+        call_command('check_stats', stdout=StringIO())
+
+        UserStats.objects.filter(user__username='john.doe').update(group_count=42)
+        GroupStats.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('check_stats', stdout=StringIO())
+
+        call_command('check_stats', '--fix', stdout=StringIO())
+        self._assert_consistent()
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the precomputed statistics need postgres')
+class TestPrecomputedStatsConcurrency(TransactionTestCase):
+    serialized_rollback = True
+
+    def test__concurrent_members_are_all_counted(self):
+        group = Group.objects.create(name='busy-group')
+        first, second = User.objects.create(username='first'), User.objects.create(username='second')
+        added = threading.Event()
+
+        def add_first():
+            with transaction.atomic():
+                group.user_set.add(first)
+                added.set()
+                time.sleep(0.2)  # the other transaction adds its member meanwhile
+            connection.close()
+
+        thread = threading.Thread(target=add_first)
+        thread.start()
+        added.wait()
+        group.user_set.add(second)  # its recount waits for the first transaction
+        thread.join()
+        self.assertEqual(2, GroupStats.objects.get(group=group).user_count)
+        self.assertEqual({'users': [], 'groups': []}, stats.stale())
+
+    def test__crossed_membership_changes_dont_deadlock(self):
+        groups = [Group.objects.create(name=f'crossed-{index}') for index in range(2)]
+        users = [User.objects.create(username=f'crossed-{index}') for index in range(2)]
+        first_recounted, errors = threading.Event(), []
+
+        def change(*memberships):
+            # user 0 and group 0, then user 1 and group 1; the other transaction: user 1 and group 0
+            try:
+                with transaction.atomic():
+                    for index, (user, group) in enumerate(memberships):
+                        user.groups.add(group)
+                        if index == 0:
+                            first_recounted.set()
+                            time.sleep(0.5)  # the other transaction recounts meanwhile
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=change, args=[(users[0], groups[0]), (users[1], groups[1])])
+        thread.start()
+        first_recounted.wait()
+        change((users[1], groups[0]))
+        thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual({'users': [], 'groups': []}, stats.stale())
+
+
+class TestReplicaRoutingMiddleware(TestCase):
+
+    def _request(self, view, **cookies):
+        seen = []
+
+        def get_response(request):
+            seen.append(routers._current.get().read_primary)
+            view()
+            return HttpResponse()
+
+        request = RequestFactory().get('/queries/comparison')
+        request.COOKIES.update(cookies)
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return seen[0], response
+
+    def test__writes_make_the_client_read_from_the_primary(self):
+        read_primary, response = self._request(lambda: list(User.objects.all()))
+        self.assertFalse(read_primary)
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+        read_primary, response = self._request(lambda: Group.objects.create(name='written'))
+        self.assertFalse(read_primary)
+        self.assertEqual(settings.QUERIES_REPLICA_STICKY_SECONDS, response.cookies[routers.STICKY_COOKIE]['max-age'])
+
+        read_primary, _ = self._request(lambda: None, **{routers.STICKY_COOKIE: '1'})
+        self.assertTrue(read_primary)
+
+    def test__writes_before_a_streamed_response(self):
+        def get_response(request):
+            Group.objects.create(name='written')
+            return StreamingHttpResponse(iter([b'streamed']))
+
+        response = ReplicaRoutingMiddleware(get_response)(RequestFactory().get('/queries/comparison'))
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertEqual(b'streamed', b''.join(response.streaming_content))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the replica lag query needs postgres')
+@override_settings(QUERIES_REPLICAS=['replica'], QUERIES_REPLICA_LAG_CHECK_INTERVAL=0)
+class TestReplicaRouting(TransactionTestCase):
+    # 'replica' is a second connection to the test database (see test_settings.py): it only sees committed data
+    databases = {'default', 'replica'}
+    serialized_rollback = True
+
+    def _queries_per_alias(self, url, **cookies):
+        self.client.cookies.clear()
+        for name, value in cookies.items():
+            self.client.cookies[name] = value
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(200, self.client.get(url).status_code)
+        return len(primary), len(replica)
+
+    def test__reads_go_to_fresh_replicas(self):
+        primary, replica = self._queries_per_alias('/queries/comparison')
+        self.assertEqual(0, primary)
+        self.assertEqual(1 + 4, replica)  # the lag check, once per request, and the statements
+        self.assertEqual({'replica': 0.0}, routers.replica_lags())
+
+    def test__lagging_replicas_are_skipped(self):
+        with override_settings(QUERIES_REPLICA_MAX_LAG=-1):
+            primary, replica = self._queries_per_alias('/queries/comparison')
+        self.assertEqual(4, primary)
+        self.assertEqual(1, replica)
+
+    def test__table_versions_come_from_the_replica_of_the_data(self):
+        primary, replica = self._queries_per_alias('/queries/first')
+        self.assertEqual(0, primary)
+        self.assertEqual(1 + 1 + 1, replica)  # the lag check, the table versions and the users
+
+    def test__views_capturing_their_queries_read_from_one_replica(self):
+        for url in ['/queries/in_filtering', '/queries/get_single', '/queries/get_single?batch=1',
+                    '/queries/random_sample']:
+            with self.subTest(url=url):
+                primary, _ = self._queries_per_alias(url)
+                self.assertEqual(0, primary)
+
+    def test__sticky_clients_read_from_the_primary(self):
+        primary, replica = self._queries_per_alias('/queries/comparison', **{routers.STICKY_COOKIE: '1'})
+        self.assertEqual(4, primary)
+        self.assertEqual(0, replica)
+
+
+class TestGenerateData(TestCase):
+
+    def _generate(self, **options):
+        options = {'groups': 5, 'seed': 7, 'batch_size': 20, **options}
+        call_command('generate_data', stdout=StringIO(), **options)
+        return list(User.objects.filter(username__startswith='gen').order_by('username').values(
+            'username', 'first_name', 'last_name', 'is_active', 'date_joined', 'groups__name'
+        ))
+
+    def test__generated_data_is_reproducible(self):
+        data = self._generate(users=50)
+        self.assertEqual(50, User.objects.filter(username__startswith='gen').count())
+        self.assertEqual(5, Group.objects.filter(name__startswith='gen').count())
+
+        # running it again creates nothing new
+        self.assertEqual(data, self._generate(users=50))
+
+        User.objects.filter(username__startswith='gen').delete()
+        Group.objects.filter(name__startswith='gen').delete()
+        self.assertEqual(data, self._generate(users=50))
+
+    def test__users_only_depend_on_their_index(self):
+        data = self._generate(users=30, batch_size=7)
+        User.objects.filter(username__startswith='gen').delete()
+        topped_up = self._generate(users=50)
+        self.assertEqual(data, [row for row in topped_up if row['username'] < 'gen00000030'])
+        self.assertEqual(topped_up, self._generate(users=50, batch_size=3))
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class TestBenchEndpoints(TestCase):
+
+    def _bench(self, *args):
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('bench_endpoints', '--requests', '2', '--warmup', '0', '--output', output.name, *args,
+                     stdout=StringIO())
+        with open(output.name) as f:
+            return json.load(f)
+
+    def test__bench_and_baseline(self):
+        report = self._bench('--routes', 'comparison', 'first')
+        (users, routes), = report['runs'].items()
+        self.assertEqual(str(User.objects.count()), users)
+        self.assertEqual(['comparison', 'first'], sorted(routes))
+        self.assertEqual(4, routes['comparison']['queries_per_request'])
+        self.assertGreater(routes['comparison']['peak_rss_kb'], 0)
+        self.assertGreaterEqual(routes['comparison']['peak_rss_growth_kb'], 0)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as baseline:
+            for result in routes.values():
+                result.update(p50_ms=0.0001, p99_ms=0.0001)
+            json.dump(report, baseline)
+            baseline.flush()
+            with self.assertRaisesRegex(CommandError, 'comparison: p50_ms'):
+                self._bench('--routes', 'comparison', 'first', '--baseline', baseline.name)
+
+    def test__server(self):
+        class NotFound(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('localhost', 0), NotFound)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://localhost:{server.server_address[1]}'
+
+        # error statuses and unreachable servers are reported, not raised as tracebacks
+        with self.assertRaisesRegex(CommandError, '/queries/comparison returned 404'):
+            self._bench('--routes', 'comparison', '--server', url)
+        server.shutdown()
+        server.server_close()
+        with self.assertRaisesRegex(CommandError, url):
+            self._bench('--routes', 'comparison', '--server', url)
+
+
+class TestReplayRequests(TransactionTestCase):
+    # the replayed requests are served by other threads, on their own connections
+    serialized_rollback = True
+
+    def _replay(self, *args):
+        capture = tempfile.NamedTemporaryFile('w', suffix='.jsonl')
+        self.addCleanup(capture.close)
+        for entry in [
+            {'method': 'GET', 'path': '/queries/comparison', 'offset': 0},
+            {'path': '/queries/search?q=ab', 'offset': 0.01},  # too short: 400
+            {'path': '/queries/comparison', 'offset': 0.02},
+            {'method': 'POST', 'path': '/queries/bulk_lookup', 'body': {'ids': [1, 2]}, 'offset': 0.03},
+            {'path': '/queries/first?stream=1', 'offset': 0.04},
+            {'request_id': 'not-a-request'},
+        ]:
+            capture.write(json.dumps(entry) + '\n')
+        capture.flush()
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('replay_requests', capture.name, '--host', 'testserver', '--output', output.name, *args,
+                     stdout=StringIO(), stderr=StringIO())
+        with open(output.name) as f:
+            return json.load(f)
+
+    def test__replay(self):
+        for args in [['--concurrency', '2'], ['--target', 'asgi', '--speed', '10', '--repeat', '2']]:
+            with self.subTest(args=args):
+                report = self._replay(*args)
+                repeat = 2 if '--repeat' in args else 1
+                self.assertEqual(5 * repeat, report['requests'])
+                routes = report['routes']
+                self.assertEqual(
+                    ['/queries/bulk_lookup', '/queries/comparison', '/queries/first', '/queries/search'], sorted(routes)
+                )
+                # built whole under ASGI, see streaming.py
+                self.assertEqual({'200': repeat}, routes['/queries/first']['statuses'])
+                self.assertEqual(2 * repeat, routes['/queries/comparison']['requests'])
+                self.assertEqual(0, routes['/queries/comparison']['error_rate'])
+                self.assertEqual(4, routes['/queries/comparison']['queries_per_request'])
+                self.assertEqual(1, routes['/queries/search']['error_rate'])
+                self.assertEqual({'200': repeat}, routes['/queries/bulk_lookup']['statuses'])
+
+    def test__bad_captures(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as capture:
+            capture.write('{"request_id": "user-001"}\n')
+            capture.flush()
+            with self.assertRaises(CommandError):
+                call_command('replay_requests', capture.name, stdout=StringIO(), stderr=StringIO())
+
+
+class TestExport(TransactionTestCase):
+    # COPY runs in another thread, on its own connection
+    serialized_rollback = True
+
+    # the CSV has postgres' text form of every value ('t', timestamps with a time zone...): compare strings only
+    COLUMNS = {'users': ['id', 'username', 'email'], 'memberships': ['id', 'username', 'group_name']}
+
+    def _expected(self, dataset):
+        columns = self.COLUMNS[dataset]
+        return sorted(
+            tuple('' if value is None else str(value) for value in row)
+            for row in export.DATASETS[dataset]().values_list(*columns)
+        )
+
+    def _read(self, dataset, csv_file):
+        columns = self.COLUMNS[dataset]
+        return sorted(tuple(row[column] for column in columns) for row in csv.DictReader(csv_file))
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'COPY needs postgres')
+    def test__export_view(self):
+        for dataset in export.DATASETS:
+            with self.subTest(dataset):
+                response = self.client.get('/queries/export', {'data': dataset})
+                self.assertEqual('text/csv; charset=utf-8', response['Content-Type'])
+                body = b''.join(response.streaming_content).decode()
+                self.assertEqual(self._expected(dataset), self._read(dataset, io.StringIO(body)))
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'COPY needs postgres')
+    def test__chunks_and_cancellation(self):
+        chunks = export.iter_copy(export.DATASETS['memberships'](), chunk_size=1, queue_chunks=1)
+        first = next(chunks)
+        self.assertTrue(first.startswith(b'id,username'))
+        chunks.close()  # the client went away: the producer thread stops
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name == 'queries-export'])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'COPY needs postgres')
+    def test__export_data_command(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as output:
+            call_command('export_data', 'users', '--output', output.name, stderr=StringIO())
+            with open(output.name) as f:
+                self.assertEqual(self._expected('users'), self._read('users', f))
+
+    def test__bad_params(self):
+        self.assertEqual(400, self.client.get('/queries/export', {'data': 'passwords'}).status_code)
+        if connection.vendor != 'postgresql':
+            self.assertEqual(400, self.client.get('/queries/export').status_code)
+
+    def test__refused_under_asgi(self):
+        request = ASGIRequest({
+            'type': 'http', 'method': 'GET', 'path': '/queries/export', 'query_string': b'data=users', 'headers': [],
+        }, io.BytesIO())
+        response = views.export_csv(request)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'error': 'export needs a WSGI server'}, json.loads(response.content))
+
+
+class TestParallelExecution(TransactionTestCase):
+    # worker threads use their own connections, so they only see committed data: no TestCase transaction here
+    serialized_rollback = True
+
+    def test__parallel_results_match_sequential(self):
+        for url in ['/queries/and_operation', '/queries/like', '/queries/comparison', '/queries/orderby']:
+            with override_settings(QUERIES_PARALLEL_WORKERS=0):
+                expected = self.client.get(url).json()
+            with override_settings(QUERIES_PARALLEL_WORKERS=4):
+                response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            data = response.json()
+            if url == '/queries/orderby':
+                # by_random_qs is, well, random
+                del expected['by_random_qs']['data']
+                del data['by_random_qs']['data']
+            self.assertEqual(expected, data)
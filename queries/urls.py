@@ -9,13 +9,22 @@ urlpatterns = [
     path('or_operation', views.or_operation),
     path('not_equal', views.not_equal),
     path('in_filtering', views.in_filtering),
+    path('bulk_lookup', views.bulk_lookup),
+    path('export', views.export_csv),
     path('is_null', views.is_null),
     path('like', views.like),
+    path('search', views.search),
     path('comparison', views.comparison),
     path('between', views.between),
     path('limit', views.limit),
+    path('keyset', views.keyset),
     path('orderby', views.orderby),
+    path('random_sample', views.random_sample),
     path('get_single', views.get_single),
     path('joins', views.joins),
     path('annotations', views.annotations),
+    path('cache_stats', views.cache_stats),
+    path('metrics', views.metrics_view),
+    path('profiles', views.profiles),
+    path('profiles/<str:profile_id>', views.profile_detail),
 ]
@@ -1,24 +1,91 @@
+import json
 import logging
 from datetime import timedelta
 
 import django.urls as urls
 from django.conf import settings
 from django.contrib.postgres.aggregates import ArrayAgg
-from django.db import connection
-from django.db.models import Q, Count
-from django.forms import model_to_dict
-from django.http import JsonResponse
+from django.db import DataError, connection, connections, router
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.models import User, Group
 from django.shortcuts import render
 from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from . import (
+    batching, bulk, cache, conditional, execution, explain, export, metrics, name_search, nesting, pagination,
+    profiling, sampling, serializers, streaming,
+)
+from .backends.postgresql_pool.base import pool_stats
+from .routers import replica_lags
+from .streaming import StreamingJsonResponse
 
 logger = logging.getLogger(__name__)
 
 
+def _json_response(request, data):
+    # ?stream=1 sends the same payload incrementally, reading querysets in chunks (see streaming.py)
+    if request.GET.get('stream') and streaming.is_supported(request) and not explain.is_requested(request):
+        return StreamingJsonResponse(data)
+    with metrics.phase('serialize'):
+        return JsonResponse(data)
+
+
+def _querysets_response(request, querysets, layout=None, streamable=True):
+    # layout, if given, rearranges the {name: {data, query}} payload before it is sent. Querysets the database may
+    # reject (user-supplied values it checks itself) are not streamable: their errors are only known once they run
+    layout = layout or (lambda payload: payload)
+    # one database per queryset, however many times it is compiled and run (see routers.py)
+    querysets = [(name, qs.using(qs.db)) for name, qs in querysets]
+    refusal = _explain_refusal(request, [qs.db for _, qs in querysets])
+    if refusal:
+        return refusal
+    if (request.GET.get('stream') and streamable and streaming.is_supported(request)
+            and not explain.is_requested(request)):
+        compiled_queries = [(name, execution.CompiledQuery(qs)) for name, qs in querysets]
+        chunk_size = getattr(settings, 'QUERIES_STREAM_CHUNK_SIZE', streaming.DEFAULT_CHUNK_SIZE)
+        return StreamingJsonResponse(layout({
+            name: {
+                'data': compiled.iterator(chunk_size),
+                'query': compiled.display(),
+            } for name, compiled in compiled_queries
+        }))
+    try:
+        payload, stats = execution.evaluate(querysets)
+    except DataError as e:
+        return JsonResponse({'error': str(e).strip()}, status=400)
+    if explain.is_requested(request):
+        payload = explain.attach(request.path, querysets, payload)
+    with metrics.phase('serialize'):
+        response = JsonResponse(layout(payload))
+    response['X-Queries-Deduplicated'] = stats['deduplicated']
+    response['X-Queries-Cache-Hits'] = stats['cache_hits']
+    return response
+
+
+def _explain_refusal(request, aliases):
+    # the error response to an ?explain=1 that can't be served from the databases of `aliases`, None otherwise
+    if not explain.is_requested(request):
+        return None
+    if not explain.is_allowed(request):
+        return JsonResponse({'error': 'explain is restricted to staff users'}, status=403)
+    if not explain.is_supported(aliases):
+        return JsonResponse({'error': 'explain needs postgres'}, status=400)
+    return None
+
+
+def _user_serializer():
+    # the fields of model_to_dict(user, exclude=['groups', 'user_permissions'])
+    return serializers.serializer_for(User, exclude=('groups', 'user_permissions'))
+
+
 def index(request):
     resolver = urls.get_resolver()
-    all_urls = ['/' + v[0][0][0] for v in resolver.reverse_dict.values()]
+    # routes taking parameters (profiles/<id>) have no link of their own
+    all_urls = ['/' + v[0][0][0] for v in resolver.reverse_dict.values() if not v[0][0][1]]
     all_urls.reverse()
     return render(request, 'queries/index.html', {
         'urls': all_urls,
@@ -26,12 +93,14 @@ def index(request):
     })
 
 
+@conditional.depends_on('auth_user')
 def first(request):
     # https://davit.tech/django-queryset-examples/#section-query
     users = User.objects.all()
-    return JsonResponse({
-        'users': list(users.values()),
-        'query': str(users.query),
+    return _querysets_response(request, [('users', users.values())], lambda payload: {
+        'users': payload['users']['data'],
+        'query': payload['users']['query'],
+        **({'explain': payload['users']['explain']} if 'explain' in payload['users'] else {}),
     })
 
 
@@ -42,17 +111,12 @@ def and_operation(request):
     qs3 = User.objects.filter(first_name="John") & User.objects.filter(is_active=True)
     qs4 = User.objects.filter(Q(first_name="John") & Q(is_active=True))
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('qs1', qs1),
-            ('qs2', qs2),
-            ('qs3', qs3),
-            ('qs4', qs4),
-        ]
-    })
+    return _querysets_response(request, [
+        ('qs1', qs1.values()),
+        ('qs2', qs2.values()),
+        ('qs3', qs3.values()),
+        ('qs4', qs4.values()),
+    ])
 
 
 def or_operation(request):
@@ -60,15 +124,10 @@ def or_operation(request):
     qs1 = User.objects.filter(Q(first_name="John") | Q(first_name="Jane"))
     qs2 = User.objects.filter(first_name="John") | User.objects.filter(first_name="Jane")
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('qs1', qs1),
-            ('qs2', qs2),
-        ]
-    })
+    return _querysets_response(request, [
+        ('qs1', qs1.values()),
+        ('qs2', qs2.values()),
+    ])
 
 
 def not_equal(request):
@@ -76,50 +135,102 @@ def not_equal(request):
     qs1 = User.objects.filter(~Q(first_name="John"))
     qs2 = User.objects.exclude(first_name="John")
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('qs1', qs1),
-            ('qs2', qs2),
-        ]
-    })
+    return _querysets_response(request, [
+        ('qs1', qs1.values()),
+        ('qs2', qs2.values()),
+    ])
 
 
 def in_filtering(request):
     # https://davit.tech/django-queryset-examples/#section-in
-    qs = User.objects.filter(pk__in=[1, 4, 7])
-    with CaptureQueriesContext(connection) as ctx:
-        bulk = User.objects.in_bulk([1, 4, 7])
-        for k, v in bulk.items():
-            bulk[k] = model_to_dict(v, exclude=['groups', 'user_permissions'])
+    using = router.db_for_read(User)
+    refusal = _explain_refusal(request, [using])
+    if refusal:
+        return refusal
+    qs = User.objects.using(using).filter(pk__in=[1, 4, 7]).values()
+    rows, query = execution.CompiledQuery(qs).fetch()
+    with CaptureQueriesContext(connections[using]) as ctx:
+        # User.objects.in_bulk([1, 4, 7]), serialized from the rows rather than through instances (see serializers.py)
+        bulk = _user_serializer().in_bulk(User.objects.using(using), [1, 4, 7])
     assert len(ctx.captured_queries) == 1, "bad number of queries executed"
-    return JsonResponse({
+    payload = {
         'qs': {
-            'data': list(qs.values()),
-            'query': str(qs.query),
+            'data': rows,
+            'query': query,
         },
         'bulk': {
             'data': bulk,
             'query': ctx.captured_queries[0]['sql'],
         }
-    })
+    }
+    if explain.is_requested(request):
+        explain.attach(request.path, [('qs', qs)], payload)
+        explain.attach_statements(request.path, using, [('bulk', payload['bulk']['query'])], payload)
+    return JsonResponse(payload)
+
+
+@csrf_exempt
+def bulk_lookup(request):
+    # users by id, for long lists: GET ?ids=1,4,7 or POST {"ids": [1, 4, 7]}
+    # ids go to the database as array parameters a chunk at a time, and rows are streamed as they arrive (under WSGI)
+    try:
+        if request.method == 'POST':
+            ids = json.loads(request.body)['ids']
+        else:
+            ids = [value for value in request.GET.get('ids', '').split(',') if value]
+        if not isinstance(ids, list):
+            raise TypeError(f'ids is a {type(ids).__name__}')
+        ids = [int(value) for value in ids]
+        # checked now: the database would only reject them once the response has started. sqlite reports no range,
+        # its integers are 64 bit
+        low, high = connection.ops.integer_field_range(User._meta.pk.get_internal_type())
+        low, high = -2 ** 63 if low is None else low, 2 ** 63 - 1 if high is None else high
+        out_of_range = [value for value in ids if not low <= value <= high]
+        if out_of_range:
+            raise ValueError(f'{out_of_range[0]} is out of the range of the ids, {low} to {high}')
+    except (ValueError, TypeError, KeyError) as e:
+        return JsonResponse({'error': f'expected a list of integer ids: {e}'}, status=400)
+
+    chunks = bulk.chunks(ids)
+    payload = {
+        'bulk': {
+            'data': bulk.iter_bulk(User.objects.values(), ids),
+            # the statement of the first chunk, the others only differ by their ids
+            'query': execution.display_sql(User.objects.filter(pk__any=chunks[0]).values()) if chunks else None,
+            'chunks': len(chunks),
+        },
+    }
+    if streaming.is_supported(request):
+        return StreamingJsonResponse(payload)
+    # under ASGI the response is sent from the event loop: read the rows now (see streaming.py)
+    payload['bulk']['data'] = list(payload['bulk']['data'])
+    return JsonResponse(payload)
+
+
+def export_csv(request):
+    # a complete dump of ?data=users or memberships as CSV, produced by postgres COPY and streamed (see export.py)
+    dataset = request.GET.get('data', 'users')
+    if dataset not in export.DATASETS:
+        return JsonResponse({'error': f'data must be one of {", ".join(export.DATASETS)}'}, status=400)
+    if not streaming.is_supported(request):
+        # the chunks would be waited for in the event loop, blocking every other request of the worker
+        return JsonResponse({'error': 'export needs a WSGI server'}, status=400)
+    queryset = export.DATASETS[dataset]()
+    if not export.is_supported(queryset):
+        return JsonResponse({'error': 'export needs postgres'}, status=400)
+    response = StreamingHttpResponse(export.iter_copy(queryset), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.csv"'
+    return response
 
 
 def is_null(request):
     # https://davit.tech/django-queryset-examples/#section-isnull
     is_null_qs = User.objects.filter(first_name__isnull=True)
     is_not_null_qs = User.objects.filter(first_name__isnull=False)
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('is_null_qs', is_null_qs),
-            ('is_not_null_qs', is_not_null_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('is_null_qs', is_null_qs.values()),
+        ('is_not_null_qs', is_not_null_qs.values()),
+    ])
 
 
 def like(request):
@@ -129,17 +240,33 @@ def like(request):
     contains_qs = User.objects.filter(first_name__contains="oh")
     regex_qs = User.objects.filter(last_name__regex=r"^D.e$")
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('startswith_qs', startswith_qs),
-            ('endswith_qs', endswith_qs),
-            ('contains_qs', contains_qs),
-            ('regex_qs', regex_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('startswith_qs', startswith_qs.values()),
+        ('endswith_qs', endswith_qs.values()),
+        ('contains_qs', contains_qs.values()),
+        ('regex_qs', regex_qs.values()),
+    ])
+
+
+def search(request):
+    # user-supplied patterns on the indexed names: ?field=first_name&match=endswith&q=ohn&size=100
+    try:
+        size = int(request.GET.get('size', 100))
+        if size < 1:
+            raise ValueError('size must be a positive integer')
+        search_qs = name_search.search(
+            User.objects.all(),
+            request.GET.get('field', 'first_name'),
+            request.GET.get('match', 'contains'),
+            request.GET.get('q', ''),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # postgres regexes are AREs, not python's: some patterns re.compile() accepts are only rejected by postgres
+    return _querysets_response(request, [
+        ('search_qs', search_qs.values()[:size]),
+    ], streamable=request.GET.get('match', 'contains') != 'regex')
 
 
 def comparison(request):
@@ -149,17 +276,12 @@ def comparison(request):
     gte_qs = User.objects.filter(id__gte=2)
     lte_qs = User.objects.filter(id__lte=2)
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('gt_qs', gt_qs),
-            ('lt_qs', lt_qs),
-            ('gte_qs', gte_qs),
-            ('lte_qs', lte_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('gt_qs', gt_qs.values()),
+        ('lt_qs', lt_qs.values()),
+        ('gte_qs', gte_qs.values()),
+        ('lte_qs', lte_qs.values()),
+    ])
 
 
 def between(request):
@@ -168,14 +290,9 @@ def between(request):
     two_weeks_ago = today - timedelta(days=14)
     between_qs = User.objects.filter(date_joined__range=[two_weeks_ago, today])
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('between_qs', between_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('between_qs', between_qs.values()),
+    ])
 
 
 def limit(request):
@@ -183,15 +300,39 @@ def limit(request):
     limit_qs = User.objects.all()[:10]
     offset_limit_qs = User.objects.all()[10:20]
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('limit_qs', limit_qs),
-            ('offset_limit_qs', offset_limit_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('limit_qs', limit_qs.values()),
+        ('offset_limit_qs', offset_limit_qs.values()),
+    ])
+
+
+def keyset(request):
+    # seek pagination: ?cursor=<next_cursor of the previous page>&size=10
+    # unlike offset_limit_qs in limit(), the cost of a page does not grow with its depth
+    using = router.db_for_read(User)
+    try:
+        size = int(request.GET.get('size', 10))
+        max_size = getattr(settings, 'QUERIES_KEYSET_MAX_SIZE', pagination.DEFAULT_MAX_SIZE)
+        if not 1 <= size <= max_size:
+            raise ValueError(f'size must be from 1 to {max_size}')
+        page_qs = pagination.seek(User.objects.using(using), request.GET.get('cursor')).values()[:size + 1]
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    refusal = _explain_refusal(request, [using])
+    if refusal:
+        return refusal
+
+    rows, query = execution.CompiledQuery(page_qs).fetch()  # one extra row tells whether there is a next page
+    payload = {
+        'page_qs': {
+            'data': rows[:size],
+            'query': query,
+        },
+        'next_cursor': pagination.encode_cursor(rows[size - 1]) if len(rows) > size else None,
+    }
+    if explain.is_requested(request):
+        explain.attach(request.path, [('page_qs', page_qs)], payload)
+    return _json_response(request, payload)
 
 
 def orderby(request):
@@ -201,36 +342,74 @@ def orderby(request):
     by_reverse_date_joined_qs = User.objects.order_by('date_joined').reverse()
     by_random_qs = User.objects.order_by('?')
 
-    return JsonResponse({
-        name: {
-            'data': list(qs.values()),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('by_date_joined_qs', by_date_joined_qs),
-            ('by_multiple_qs', by_multiple_qs),
-            ('by_reverse_date_joined_qs', by_reverse_date_joined_qs),
-            ('by_random_qs', by_random_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('by_date_joined_qs', by_date_joined_qs.values()),
+        ('by_multiple_qs', by_multiple_qs.values()),
+        ('by_reverse_date_joined_qs', by_reverse_date_joined_qs.values()),
+        ('by_random_qs', by_random_qs.values()),
+    ])
+
+
+def random_sample(request):
+    # scalable alternative to by_random_qs in orderby(): ?n=10&seed=42 (the same seed returns the same sample)
+    try:
+        n = int(request.GET.get('n', 10))
+        max_size = getattr(settings, 'QUERIES_RANDOM_SAMPLE_MAX', sampling.DEFAULT_MAX_SIZE)
+        if n > max_size:
+            raise ValueError(f'n must be at most {max_size}')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    using = router.db_for_read(User)
+    refusal = _explain_refusal(request, [using])
+    if refusal:
+        return refusal
+    with CaptureQueriesContext(connections[using]) as ctx:
+        sample = sampling.random_sample(User.objects.using(using).values(), n, seed=request.GET.get('seed'))
+    payload = {
+        'sample': {
+            'data': sample,
+            'query': ';\n'.join(query['sql'] for query in ctx.captured_queries),
+        },
+    }
+    if explain.is_requested(request):
+        statements = [query['sql'] for query in ctx.captured_queries]
+        explain.attach_statements(request.path, using, [('sample', statements)], payload)
+    return _json_response(request, payload)
 
 
 def get_single(request):
     # https://davit.tech/django-queryset-examples/#section-single-object
-    with CaptureQueriesContext(connection) as ctx:
-        user_using_limit = User.objects.all()[0]
-        user_using_get = User.objects.get(pk=1)
-        user_using_first = User.objects.order_by('date_joined', '-first_name').first()
-        user_using_last = User.objects.order_by('first_name').last()
-        user_using_earliest = User.objects.earliest('date_joined', '-first_name')
-        user_using_latest = User.objects.latest('first_name')
+    using = router.db_for_read(User)
+    refusal = _explain_refusal(request, [using])
+    if refusal:
+        return refusal
+    payload = _get_single_batched(using) if request.GET.get('batch') else _get_single(using)
+    if explain.is_requested(request):
+        explain.attach_statements(request.path, using, [(name, entry['query']) for name, entry in payload.items()],
+                                  payload)
+    return JsonResponse(payload)
+
+
+def _get_single(using):
+    # the same lookups on rows of the serialized columns instead of User instances
+    serializer = _user_serializer()
+    users = serializer.values_list(User.objects.using(using))
+    with CaptureQueriesContext(connections[using]) as ctx:
+        user_using_limit = users[0]
+        user_using_get = users.get(pk=1)
+        user_using_first = users.order_by('date_joined', '-first_name').first()
+        user_using_last = users.order_by('first_name').last()
+        user_using_earliest = users.earliest('date_joined', '-first_name')
+        user_using_latest = users.latest('first_name')
 
     assert 6 == len(ctx.captured_queries), "bad number of queries executed"
 
-    return JsonResponse({
+    return {
         name: {
-            'data': model_to_dict(user_instance, exclude=['groups', 'user_permissions']),
+            'data': serializer(user_row),
             'query': query['sql'],
-        } for (name, user_instance), query in zip([
+        } for (name, user_row), query in zip([
             ('user_using_limit', user_using_limit),
             ('user_using_get', user_using_get),
             ('user_using_first', user_using_first),
@@ -238,25 +417,68 @@ def get_single(request):
             ('user_using_earliest', user_using_earliest),
             ('user_using_latest', user_using_latest),
         ], ctx.captured_queries)
-    })
+    }
+
+
+def _get_single_batched(using):
+    # the same six lookups sent as one UNION ALL statement: one round trip instead of six (see batching.py)
+    users = User.objects.using(using)
+    batch = batching.SingleObjectBatch()
+    batch.limit('user_using_limit', users.all(), 0)
+    batch.get('user_using_get', users.all(), pk=1)
+    batch.first('user_using_first', users.order_by('date_joined', '-first_name'))
+    batch.last('user_using_last', users.order_by('first_name'))
+    batch.earliest('user_using_earliest', users.all(), 'date_joined', '-first_name')
+    batch.latest('user_using_latest', users.all(), 'first_name')
+
+    with CaptureQueriesContext(connections[using]) as ctx:
+        results = batch.fetch()
+    assert 1 == len(ctx.captured_queries), "bad number of queries executed"
+
+    serializer = _user_serializer()
+    return {
+        name: {
+            'data': serializer.from_instance(user_instance),
+            'query': query,
+        } for name, (user_instance, query) in results.items()
+    }
 
 
+@conditional.depends_on('auth_user', 'auth_group', 'auth_user_groups')
 def joins(request):
+    if request.GET.get('nested'):
+        # one JSON object per user and per group, built by postgres (see nesting.py)
+        return _querysets_response(request, [
+            ('users_with_groups_qs', nesting.users_with_groups()),
+            ('groups_with_users_qs', nesting.groups_with_users()),
+        ])
+
     users_with_group_name_qs = User.objects.all().values('username', 'first_name', 'last_name', 'groups__name')
     groups_with_users_qs = Group.objects.all().values('name', 'user__username')
 
-    return JsonResponse({
-        name: {
-            'data': list(qs),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('users_with_group_name_qs', users_with_group_name_qs),
-            ('groups_with_users_qs', groups_with_users_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('users_with_group_name_qs', users_with_group_name_qs),
+        ('groups_with_users_qs', groups_with_users_qs),
+    ])
 
 
+@conditional.depends_on('auth_user', 'auth_group', 'auth_user_groups', 'queries_groupstats', 'queries_userstats')
 def annotations(request):
+    if request.GET.get('precomputed'):
+        # the same figures read from GroupStats/UserStats, kept up to date by stats.py: no GROUP BY
+        return _querysets_response(request, [
+            # LEFT JOINs: a missing row reads as no members or no groups, as live
+            ('groups_with_user_count_qs', Group.objects.values(
+                'name', user_count=Coalesce('queries_stats__user_count', 0)
+            )),
+            ('users_with_group_count_qs', User.objects.values(
+                'username', group_count=Coalesce('queries_stats__group_count', 0)
+            )),
+            ('users_with_group_array_qs', User.objects.values(
+                'username', group_names=Coalesce('queries_stats__group_names', Value([]))
+            )),
+        ])
+
     groups_with_user_count_qs = Group.objects.all().annotate(
         user_count=Count('user__username')
     ).values('name', 'user_count')
@@ -264,16 +486,62 @@ def annotations(request):
         group_count=Count('groups')
     ).values('username', 'group_count')
     users_with_group_array_qs = User.objects.all().annotate(
-        group_names=ArrayAgg('groups__name')  # needs PostgreSQL
+        # needs PostgreSQL. Sorted, and [] rather than [NULL] for users without groups
+        group_names=Coalesce(
+            ArrayAgg('groups__name', filter=Q(groups__isnull=False), ordering='groups__name'), Value([])
+        )
     ).values('username', 'group_names')
 
-    return JsonResponse({
-        name: {
-            'data': list(qs),
-            'query': str(qs.query),
-        } for name, qs in [
-            ('groups_with_user_count_qs', groups_with_user_count_qs),
-            ('users_with_group_count_qs', users_with_group_count_qs),
-            ('users_with_group_array_qs', users_with_group_array_qs),
-        ]
-    })
+    return _querysets_response(request, [
+        ('groups_with_user_count_qs', groups_with_user_count_qs),
+        ('users_with_group_count_qs', users_with_group_count_qs),
+        ('users_with_group_array_qs', users_with_group_array_qs),
+    ])
+
+
+def _staff_only(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'restricted to staff users'}, status=403)
+    return None
+
+
+def cache_stats(request):
+    return _staff_only(request) or JsonResponse(cache.stats())
+
+
+def metrics_view(request):
+    # latency, queries, db/serialization time and response size per route, see middleware.py
+    forbidden = _staff_only(request)
+    if forbidden:
+        return forbidden
+    data = metrics.registry.snapshot()
+    pools = pool_stats()
+    if pools:
+        data['connection_pools'] = pools
+    lags = replica_lags()
+    if lags:
+        data['replica_lags'] = lags
+    return JsonResponse(data)
+
+
+def profiles(request):
+    # the stored request profiles, newest first, see profiling.py
+    return _staff_only(request) or JsonResponse({'profiles': profiling.index()})
+
+
+def profile_detail(request, profile_id):
+    forbidden = _staff_only(request)
+    if forbidden:
+        return forbidden
+    if request.GET.get('format') == 'prof':
+        path = profiling.dump_path(profile_id)
+        if path is None:
+            return JsonResponse({'error': f'no profile {profile_id}'}, status=404)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in profiling.SORT_KEYS:
+        return JsonResponse({'error': f'sort must be one of {", ".join(profiling.SORT_KEYS)}'}, status=400)
+    report = profiling.report(profile_id, sort=sort)
+    if report is None:
+        return JsonResponse({'error': f'no profile {profile_id}'}, status=404)
+    return HttpResponse(report, content_type='text/plain')
@@ -40,11 +40,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'queries.middleware.QueryMetricsMiddleware',
+    'queries.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'queries.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,10 +82,56 @@ DATABASES = {
     # }
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # pooled connections, see queries/backends/postgresql_pool
+        # 'ENGINE': 'queries.backends.postgresql_pool',
+        # 'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 20, 'MAX_IDLE': 300, 'TIMEOUT': 30, 'CHECK_AFTER': 30,
+        #          'RESET': 'DISCARD ALL', 'MAINTENANCE_INTERVAL': 10},
         'NAME': 'queries',
         'USER': 'jami',
         'PASSWORD': '',
-    }
+    },
+    # a read replica of default, add its alias to QUERIES_REPLICAS
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'HOST': 'replica.example.com',
+    #     'NAME': 'queries',
+    #     'USER': 'jami',
+    #     'PASSWORD': '',
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+# reads of the replicas listed in QUERIES_REPLICAS, writes on default, see queries/routers.py
+DATABASE_ROUTERS = ['queries.routers.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # query results, see queries/cache.py
+    'queries': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # LRU, per process
+        'LOCATION': 'queries',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    # the version tokens of the tables the cached results read (see queries/cache.py): shared by all the processes of
+    # the host, so that an invalidation in one reaches the others (use redis or memcached across hosts)
+    'queries-versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/queries_versions',
+        'TIMEOUT': None,
+    },
+    # results shared by all the processes of the host:
+    # 'queries': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': '/var/tmp/queries_cache',
+    #     'TIMEOUT': 300,
+    # },
 }
 
 # Password validation
@@ -159,4 +208,44 @@ LOGGING = {
     }
 }
 
+# queries app
+# rows fetched per round trip when a response is streamed with ?stream=1
+QUERIES_STREAM_CHUNK_SIZE = 2000
+# evaluate the querysets of a response concurrently with this many threads (0 or 1: one after another)
+QUERIES_PARALLEL_WORKERS = 0
+# run querysets that compile to the same SQL and params only once per response
+QUERIES_DEDUPLICATE = True
+# reuse query results across requests until User/Group/memberships change
+QUERIES_RESULT_CACHE = False
+QUERIES_RESULT_CACHE_ALIAS = 'queries'
+QUERIES_RESULT_CACHE_VERSIONS_ALIAS = 'queries-versions'
+# PREPARE each distinct statement once per postgres connection and EXECUTE it afterwards
+QUERIES_PREPARED_STATEMENTS = False
+QUERIES_PREPARED_STATEMENTS_MAX = 100
+# ids per query of /queries/bulk_lookup (sent as one array parameter, see queries/bulk.py)
+QUERIES_BULK_CHUNK_SIZE = 10000
+# aliases of DATABASES the read-only views read from, in turn (none: everything on default)
+QUERIES_REPLICAS = []
+# skip a replica lagging more than this many seconds behind default, checking its lag at most every interval
+QUERIES_REPLICA_MAX_LAG = 5
+QUERIES_REPLICA_LAG_CHECK_INTERVAL = 1
+# after a request writes, the client reads from default for this many seconds (read-your-writes)
+QUERIES_REPLICA_STICKY_SECONDS = 10
+# ?explain=1 (staff only) flags the sequential scans of tables with at least this many rows, see queries/explain.py
+QUERIES_EXPLAIN_SEQ_SCAN_ROWS = 10000
+# fraction of the requests profiled (staff users can also ask with ?profile=1), see queries/profiling.py
+QUERIES_PROFILE_SAMPLE_RATE = 0
+# the latest QUERIES_PROFILE_KEEP profiles are kept in this directory (None: queries-profiles in the temp directory)
+QUERIES_PROFILE_DIR = None
+QUERIES_PROFILE_KEEP = 100
+# /queries/export streams COPY output in chunks of this many bytes, at most QUEUE_CHUNKS of them waiting to be sent
+QUERIES_EXPORT_CHUNK_SIZE = 256 * 1024
+QUERIES_EXPORT_QUEUE_CHUNKS = 8
+# ETag and 304 Not Modified for first, joins and annotations, by table versions (see queries/conditional.py)
+QUERIES_CONDITIONAL_GET = True
+# largest sample /queries/random_sample draws
+QUERIES_RANDOM_SAMPLE_MAX = 1000
+# largest page of /queries/keyset
+QUERIES_KEYSET_MAX_SIZE = 1000
+
 SETTINGS_FILE = os.path.basename(__file__)
@@ -8,5 +8,8 @@ DATABASES['default'].update({
     'PASSWORD': environ.get('POSTGRES_PASSWORD', 'secretpass'),
 })
 
+# a second connection to the test database standing in for a read replica, used by TestReplicaRouting
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
 SETTINGS_FILE = os.path.basename(__file__)
 